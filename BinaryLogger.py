@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import struct
+import itertools
+from datetime import datetime
+import logging
+from background_writer import BackgroundWriter, FsyncPolicy, Journal
+from deadband import timestamp_column
+from log_archive import LogArchiver, open_log, base_name
+
+class BinaryLogger:
+    """
+    Append-only binary sample log with the same log() interface as CSVLogger.
+
+    Every sample is a fixed width little endian record: a time.monotonic_ns() timestamp (int64) followed by one float32
+    per column. Records are appended by a background writer thread in one write per flush, without any text formatting.
+    Each file starts with a HEADER_SIZE byte header holding the column names, the record format and the offset from
+    monotonic to wall clock time (and the change-only compression settings, if any), so the records can be mapped with numpy.memmap (see open_memmap) without any parsing.
+
+    Each record goes to the file of the day it was sampled. A new file dc_currents_YYYYMMDD_HHMMSS.bin (named after its first
+    record) is started each day, each time the logger is created, as the monotonic clock (and so the offset) changes with
+    every boot, and when the wall clock is stepped (the Pi has no RTC, its clock jumps when NTP or GPS time arrives). Closed days are compressed and the oldest days deleted to stay within max_bytes by a LogArchiver;
+    compressed files are read with numpy.frombuffer instead of numpy.memmap.
+    With a journal interval (which requires fsync='flush') the queued records are also journaled, and records left in the journal by a crash are queued
+    again at start-up, their timestamps shifted to the monotonic clock of the new boot.
+    Convert a file to CSV for humans with: python BinaryLogger.py dc_currents_YYYYMMDD_HHMMSS.bin
+    """
+    FILE_PREFIX = 'dc_currents_'
+    MAGIC = b'DCBLOG1\n'
+    HEADER_SIZE = 512  # bytes, magic plus JSON padded with spaces
+    JOURNAL_NAME = '.dc_currents_bin.journal'  # crash recovery journal, hidden from the LogArchiver
+    MAX_CLOCK_STEP_NS = 1_000_000_000  # a larger change of the offset from the header starts a new file
+
+    def __init__(self, directory, columns, flush_interval=30, max_pending_rows=None, overflow_policy=None, compression='gzip', max_bytes=None, max_days=None,
+                 max_buffer_bytes=None, fsync='never', journal_interval=None, deadband=None):
+        self.logger = logging.getLogger(__name__)
+        if not os.path.isabs(directory):
+            directory = os.path.abspath(directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+            self.logger.info(f"Created directory: {directory}")
+        self.directory = directory
+        self.logger.info(f"Using directory: {self.directory}")
+        self.columns = list(columns)
+        self.deadband = deadband    # change-only compression settings, recorded in the header
+        self.record = struct.Struct('<q' + 'f' * len(self.columns))
+        self.timestamp = struct.Struct('<q')
+        self.flush_interval = flush_interval
+        self.fsync = FsyncPolicy(fsync)
+        if journal_interval and self.fsync.policy != 'flush':
+            # the journal is cleared after every write, which only keeps the rows safe if the write was fsync'ed
+            raise ValueError(f"A journal needs fsync='flush', got fsync={fsync!r}")
+        self.filepath = None    # file of the day of the last written record
+        self.day = None
+        self.epoch_offset_ns = None  # offset in the header of that file
+        self.archiver = LogArchiver(directory, self.FILE_PREFIX, compression, max_bytes,
+                                    grace=max(LogArchiver.DEFAULT_GRACE, 2 * flush_interval), max_days=max_days)
+        self.journal = Journal(os.path.join(directory, self.JOURNAL_NAME), journal_interval) if journal_interval else None
+        recovered = self._recover() if self.journal is not None else []
+        # a queued record is a bytes object of the record size
+        self.writer = BackgroundWriter(self._write, flush_interval, max_pending_rows, overflow_policy, name="BinaryLogger writer",
+                                       max_bytes=max_buffer_bytes, row_size=sys.getsizeof(bytes(self.record.size)), journal=self.journal, recovered=recovered)
+
+    def _recover(self):
+        # the records left in the journal by a crash that match the record format, with the timestamps moved from the
+        # monotonic clock of the boot they were journaled in to the current one
+        epoch_offset_ns = time.time_ns() - time.monotonic_ns()
+        records = []
+        for journal_offset_ns, frame in self.journal.recover():
+            shift = journal_offset_ns - epoch_offset_ns
+            for record in frame:
+                if len(record) == self.record.size:
+                    records.append(self.timestamp.pack(self.timestamp.unpack_from(record)[0] + shift) + record[self.timestamp.size:])
+        if records:
+            self.logger.warning(f"Recovered {len(records)} records from the journal")
+        return records
+
+    def log(self, values, timestamp=None):
+        """
+        Queues one record.
+
+        Args:
+            values (tuple): One value per column, in the order of the columns.
+            timestamp (float): time.time() of the sample, converted to the monotonic clock. Default is now.
+        """
+        now = time.monotonic_ns()
+        if timestamp is not None:
+            now -= round((time.time() - timestamp) * 1e9)
+        self.writer.put(self.record.pack(now, *values))
+
+    def _header(self, epoch_offset_ns):
+        header = {
+            'columns': ['timestamp'] + self.columns,
+            'format': self.record.format,
+            'record_size': self.record.size,
+            'epoch_offset_ns': epoch_offset_ns,  # add to the timestamps to get ns since the epoch
+        }
+        if self.deadband:
+            header['deadband'] = self.deadband  # the records are change points, see DeadbandCompressor
+        data = self.MAGIC + json.dumps(header).encode()
+        if len(data) > self.HEADER_SIZE - 1:
+            raise ValueError(f"Binary log header too large: {len(data)} bytes")
+        return data.ljust(self.HEADER_SIZE - 1, b' ') + b'\n'
+
+    def _sample_time(self, record, epoch_offset_ns):
+        return datetime.fromtimestamp((self.timestamp.unpack_from(record)[0] + epoch_offset_ns) / 1e9)
+
+    def ensure_file(self, day, first_record, epoch_offset_ns):
+        stepped = self.epoch_offset_ns is not None and abs(epoch_offset_ns - self.epoch_offset_ns) > self.MAX_CLOCK_STEP_NS
+        if day != self.day or stepped:
+            if self.day is not None and day != self.day:
+                self.archiver.notify()  # the previous day is closed
+            if stepped:
+                self.logger.info(f"Wall clock stepped by {(epoch_offset_ns - self.epoch_offset_ns) / 1e9:.1f} s, starting a new file")
+            self.day = day
+            name = self.FILE_PREFIX + self._sample_time(first_record, epoch_offset_ns).strftime("%Y%m%d_%H%M%S")
+            self.filepath = os.path.join(self.directory, name + '.bin')
+            n = 1
+            while os.path.exists(self.filepath):  # e.g. the clock was stepped back, never append under another header
+                self.filepath = os.path.join(self.directory, f"{name}_{n}.bin")
+                n += 1
+            self.epoch_offset_ns = epoch_offset_ns
+        if not os.path.exists(self.filepath):
+            with open(self.filepath, mode='wb') as f:
+                f.write(self._header(self.epoch_offset_ns))
+        return self.filepath
+
+    def _write(self, records):
+        # Called from the writer thread. Records are split by the day of their sample time
+        self.logger.debug(f"Writing {len(records)} records to binary log file")
+        epoch_offset_ns = time.time_ns() - time.monotonic_ns()
+        sync = self.fsync.due()
+        for day, day_records in itertools.groupby(records, key=lambda r: self._sample_time(r, epoch_offset_ns).strftime("%Y%m%d")):
+            day_records = list(day_records)
+            filepath = self.ensure_file(day, day_records[0], epoch_offset_ns)
+            with open(filepath, mode='ab') as f:
+                f.write(b''.join(day_records))
+                if sync:
+                    self.fsync.sync(f)
+
+    def flush(self):
+        """
+        Writes the queued records now and waits until they are written.
+        """
+        self.writer.flush()
+
+    def get_metrics(self):
+        return {**self.writer.get_metrics(), **self.archiver.get_metrics()}
+
+    def close(self):
+        self.writer.close()
+        self.archiver.close(timeout=5)
+
+def read_header(path):
+    """
+    Returns the header of a binary log file as a dict with columns, format, record_size and epoch_offset_ns, plus deadband
+    (the change-only compression settings) when only the change points were logged.
+    """
+    with open_log(path, 'rb') as f:
+        data = f.read(BinaryLogger.HEADER_SIZE)
+    if not data.startswith(BinaryLogger.MAGIC):
+        raise ValueError(f"{path} is not a binary dc_currents log")
+    return json.loads(data[len(BinaryLogger.MAGIC):].decode())
+
+def open_memmap(path):
+    """
+    Maps the records of a binary log file as a read-only numpy structured array with one field per column.
+    A partially written last record is left out. Compressed files are decompressed into memory instead of mapped.
+    Requires numpy, which is only needed for analysis, not on the device.
+
+    Returns:
+        tuple: (records, epoch_offset_ns)
+    """
+    import numpy as np
+    header = read_header(path)
+    dtype = np.dtype([('timestamp', '<i8')] + [(c, '<f4') for c in header['columns'][1:]])
+    if base_name(path) != os.path.basename(path):
+        with open_log(path, 'rb') as f:
+            data = f.read()
+        count = (len(data) - BinaryLogger.HEADER_SIZE) // dtype.itemsize
+        if count <= 0:
+            return np.zeros(0, dtype=dtype), header['epoch_offset_ns']
+        return np.frombuffer(data, dtype=dtype, count=count, offset=BinaryLogger.HEADER_SIZE), header['epoch_offset_ns']
+    count = (os.path.getsize(path) - BinaryLogger.HEADER_SIZE) // dtype.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=dtype), header['epoch_offset_ns']
+    return np.memmap(path, dtype=dtype, mode='r', offset=BinaryLogger.HEADER_SIZE, shape=(count,)), header['epoch_offset_ns']
+
+def iter_records(path):
+    """
+    Yields the records of a binary log file as (datetime, values) without numpy.
+    """
+    header = read_header(path)
+    record = struct.Struct(header['format'])
+    offset = header['epoch_offset_ns']
+    with open_log(path, 'rb') as f:
+        f.read(BinaryLogger.HEADER_SIZE)
+        while True:
+            block = f.read(record.size * 1024)
+            block = block[:len(block) - len(block) % record.size]  # drop a partially written last record
+            if not block:
+                break
+            for timestamp, *values in record.iter_unpack(block):
+                yield datetime.fromtimestamp((timestamp + offset) / 1e9), values
+
+def to_csv(path, csv_path=None):
+    """
+    Converts a (compressed) binary log file to a CSV file in the format written by CSVLogger. Default is the file name with
+    .csv extension in the current directory: next to the binary file, the LogArchiver and the tools reading the log
+    directory would take it for a sample log.
+    """
+    import csv
+    from CSVLogger import CSVLogger, column_decimals
+    csv_path = csv_path or os.path.splitext(base_name(path))[0] + '.csv'
+    with open(csv_path, mode='w', newline='') as f:
+        writer = csv.writer(f)
+        header = read_header(path)
+        writer.writerow([timestamp_column(header.get('deadband'))] + header['columns'][1:])
+        decimals = column_decimals(header['columns'][1:], CSVLogger.DEFAULT_DECIMALS)
+        for timestamp, values in iter_records(path):
+            writer.writerow([timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")] + [v if d is None else round(v, d) for v, d in zip(values, decimals)])
+    return csv_path
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python {sys.argv[0]} <file.bin> [<file.csv>]")
+        sys.exit(1)
+    print(f"Written {to_csv(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)}")
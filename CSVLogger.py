@@ -1,11 +1,51 @@
 import os
+import sys
 import csv
+import itertools
 import time
 from datetime import datetime
+from fnmatch import fnmatch
 import logging
+from background_writer import BackgroundWriter, FsyncPolicy, Journal
+from deadband import timestamp_column
+from log_archive import LogArchiver, find_day_file, index_path, read_index
 
 class CSVLogger:
-    def __init__(self, directory, flush_interval=30):
+    FILE_PREFIX = 'dc_currents_'
+    INDEX_INTERVAL = 100  # rows between the entries of the sidecar time index
+    TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+    JOURNAL_NAME = '.dc_currents_csv.journal'  # crash recovery journal, hidden from the LogArchiver
+    # column name or fnmatch pattern -> decimals, the first match applies. The voltages are what calibrate_currents.py fits
+    # on: at 22 A/V two decimals of an ADS1115 voltage would be 0.2 A, five keep the resolution of the ADC
+    DEFAULT_DECIMALS = {'*voltage': 5, '*': 2}
+
+    def __init__(self, directory, columns, flush_interval=30, max_pending_rows=None, overflow_policy=None, compression='gzip', max_bytes=None, max_days=None,
+                 max_buffer_bytes=None, fsync='never', journal_interval=None, deadband=None):
+        """
+        Rows are written to the CSV file by a background writer thread every flush_interval seconds,
+        so log() never waits for the file system. Each row goes to the file of the day it was sampled;
+        closed days are compressed and the oldest days deleted to stay within max_bytes by a LogArchiver.
+        Every INDEX_INTERVAL rows the timestamp and byte offset of the row is appended to a sidecar index
+        (dc_currents_YYYYMMDD.csv.idx), used by query_logs.py to seek to a time range. Each write is sorted by timestamp;
+        where rows go back in time (rows written after newer rows) the index goes back in time as well, see _index_entry().
+        With a journal interval the queued rows are also journaled, and rows left in the journal by a crash are queued again at start-up.
+
+        Args:
+            directory (str): Directory of the dc_currents_YYYYMMDD.csv files.
+            columns (list): Column names of the rows passed to log(), the timestamp column is added in front.
+            flush_interval (float): Seconds between writes. Default is 30.
+            max_pending_rows (int): Maximum number of rows waiting to be written. Default is BackgroundWriter.DEFAULT_MAX_PENDING.
+            overflow_policy (str): What to drop when the queue is full: 'drop_oldest' or 'downsample'. Default is 'drop_oldest'.
+            compression (str): Compression of closed days: 'gzip', 'lzma' or None. Default is 'gzip'.
+            max_bytes (int): Quota for all day files in bytes, None for no quota. Default is None.
+            max_days (int): Number of days to keep before today, None to keep all days. Default is None.
+            max_buffer_bytes (int): Memory budget of the rows waiting to be written, None for no budget. Default is None.
+            fsync (str | float): When the written files are fsync'ed: 'never', 'flush' or every N seconds. Default is 'never'.
+            journal_interval (float): Seconds between appends to the crash recovery journal, None for no journal. Requires
+                fsync='flush'. Default is None.
+            deadband (dict): Settings of the change-only compression of the logged rows (DeadbandCompressor.get_settings()),
+                recorded in the timestamp column of the header. None when every sample is logged. Default is None.
+        """
         self.logger = logging.getLogger(__name__)
         if not os.path.isabs(directory):
             directory = os.path.abspath(directory)
@@ -14,64 +54,122 @@ class CSVLogger:
             self.logger.info(f"Created directory: {directory}")
         self.directory = directory
         self.logger.info(f"Using directory: {self.directory}")
-        self.buffer = []
+        self.columns = list(columns)
+        self.header = [timestamp_column(deadband)] + self.columns
+        self.decimals = column_decimals(self.columns, self.DEFAULT_DECIMALS)
         self.flush_interval = flush_interval
-        self.last_flush_time = time.time()
+        self.fsync = FsyncPolicy(fsync)
+        if journal_interval and self.fsync.policy != 'flush':
+            # the journal is cleared after every write, which only keeps the rows safe if the write was fsync'ed
+            raise ValueError(f"A journal needs fsync='flush', got fsync={fsync!r}")
+        self.day = None         # day of the last written row
+        self.filepath = None    # file of that day
+        self.last_entry = None  # time.time() of the last index entry of that file
+        self.last_row = None    # formatted timestamp of the last row written to that file
+        self.archiver = LogArchiver(directory, self.FILE_PREFIX, compression, max_bytes,
+                                    grace=max(LogArchiver.DEFAULT_GRACE, 2 * flush_interval), max_days=max_days)
+        self.journal = Journal(os.path.join(directory, self.JOURNAL_NAME), journal_interval) if journal_interval else None
+        recovered = self._recover() if self.journal is not None else []
+        self.writer = BackgroundWriter(self._write, flush_interval, max_pending_rows, overflow_policy, name="CSVLogger writer",
+                                       max_bytes=max_buffer_bytes, row_size=self._row_size(), journal=self.journal, recovered=recovered)
+
+    def _row_size(self):
+        # estimated memory of one queued (timestamp, values) row of floats
+        values = tuple(float(k) for k in range(len(self.columns)))
+        return sys.getsizeof((0.0, values)) + sys.getsizeof(values) + (len(values) + 1) * sys.getsizeof(0.0)
 
-    def ensure_file(self, filepath):
-        if not os.path.exists(filepath):
-            with open(filepath, mode='w', newline='') as f:
+    def _recover(self):
+        # the rows left in the journal by a crash that match the columns, queued and journaled again by the writer
+        rows = [row for _, frame in self.journal.recover() for row in frame if len(row[1]) == len(self.columns)]
+        if rows:
+            self.logger.warning(f"Recovered {len(rows)} rows from the journal")
+        return rows
+
+    def ensure_file(self, day):
+        if day != self.day:
+            if self.day is not None:
+                self.archiver.notify()  # the previous day is closed
+            self.day = day
+            self.filepath = find_day_file(self.directory, self.FILE_PREFIX, day, self.header)
+            self.last_entry, self.last_row = self._index_state(self.filepath)
+        if not os.path.exists(self.filepath):
+            with open(self.filepath, mode='w', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow([
-                    "timestamp",
-                    "current",
-                    "voltage",
-                    "b1_voltage",
-                    "b1_current",
-                    "b1_smoothed",
-                    "b2_voltage",
-                    "b2_current",
-                    "b2_smoothed",
-                    "b3_voltage",
-                    "b3_current",
-                    "b3_smoothed",
-                ])
+                writer.writerow(self.header)
+        return self.filepath
+
+    def _index_state(self, filepath):
+        # the last index entry and the last row of a file written before, (None, None) for a new file
+        entries = read_index(index_path(filepath))
+        if not entries:
+            return None, None
+        last_entry, offset, _ = entries[-1]
+        last_row = None
+        with open(filepath, newline='') as f:
+            f.seek(offset)
+            for row in csv.reader(f):
+                if row:
+                    last_row = row[0]
+        return datetime.strptime(last_entry, self.TIMESTAMP_FORMAT).timestamp(), last_row
+
+    def _index_entry(self, timestamp, text):
+        # The entry of a block is at or before its first row. When the block starts before the last written row, the entry
+        # is also made earlier than the previous entry, so every place where the rows go back in time is a place where the
+        # index goes back in time: query_logs.py reads each ascending run of the index as a sorted sequence of rows
+        if self.last_row is not None and text < self.last_row and self.last_entry is not None:
+            timestamp = min(timestamp, self.last_entry - 0.001)
+            text = datetime.fromtimestamp(timestamp).strftime(self.TIMESTAMP_FORMAT)
+        self.last_entry = timestamp
+        return text
 
-    def log(self, current, voltage, 
-            b1_voltage, b1_current, b1_smoothed,
-            b2_voltage, b2_current, b2_smoothed, 
-            b3_voltage, b3_current, b3_smoothed):
-        self.buffer.append([
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"),
-            round(current, 2),
-            round(voltage, 2),
-            round(b1_voltage, 2),
-            round(b1_current, 2),
-            round(b1_smoothed, 2),
-            round(b2_voltage, 2),
-            round(b2_current, 2),
-            round(b2_smoothed, 2),
-            round(b3_voltage, 2),
-            round(b3_current, 2),
-            round(b3_smoothed, 2),
-        ])
-        now = time.time()
-        if now - self.last_flush_time > self.flush_interval:
-            self.flush()
+    def log(self, values, timestamp=None):
+        """
+        Queues one row.
+
+        Args:
+            values (tuple): One value per column, in the order of the columns.
+            timestamp (float): time.time() of the sample. Default is now.
+        """
+        self.writer.put((timestamp if timestamp is not None else time.time(), values))
+
+    def _write(self, rows):
+        # Called from the writer thread, which also does the formatting. Rows are split by the day of their timestamp
+        self.logger.debug(f"Writing {len(rows)} rows to CSV file")
+        rows = sorted(rows, key=lambda row: row[0])  # usually sorted already
+        lines = [(timestamp, [datetime.fromtimestamp(timestamp).strftime(self.TIMESTAMP_FORMAT)] + [v if d is None else round(v, d) for v, d in zip(values, self.decimals)])
+                 for timestamp, values in rows]
+        sync = self.fsync.due()
+        for date, day_lines in itertools.groupby(lines, key=lambda line: line[1][0][:10]):
+            day_lines = list(day_lines)
+            filepath = self.ensure_file(date.replace('-', ''))
+            with open(filepath, mode='a', newline='') as f, open(index_path(filepath), mode='a') as index:
+                writer = csv.writer(f)
+                for start in range(0, len(day_lines), self.INDEX_INTERVAL):
+                    block = day_lines[start:start + self.INDEX_INTERVAL]
+                    index.write(f"{self._index_entry(block[0][0], block[0][1][0])},{f.tell()}\n")
+                    writer.writerows(line for _, line in block)
+                    self.last_row = block[-1][1][0]
+                if sync:
+                    # the data before the index, so an index entry on disk never points past the rows on disk
+                    self.fsync.sync(f)
+                    self.fsync.sync(index)
 
     def flush(self):
-        self.logger.debug("Flushing buffer to CSV file")
-        if not self.buffer:
-            return
-        current_date = datetime.now().strftime("%Y%m%d")
-        filename = 'dc_currents_' + current_date + '.csv'
-        filepath = os.path.join(self.directory, filename)
-        self.ensure_file(filepath)
-        with open(filepath, mode='a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(self.buffer)
-        self.buffer = []
-        self.last_flush_time = time.time()
+        """
+        Writes the queued rows now and waits until they are written.
+        """
+        self.writer.flush()
+
+    def get_metrics(self):
+        return {**self.writer.get_metrics(), **self.archiver.get_metrics()}
 
     def close(self):
-        self.flush()
\ No newline at end of file
+        self.writer.close()
+        self.archiver.close(timeout=5)
+
+def column_decimals(columns, decimals):
+    """
+    Returns the number of decimals of each column, from a column name or fnmatch pattern -> decimals mapping.
+    Columns without a match are not rounded (None).
+    """
+    return [next((d for pattern, d in decimals.items() if fnmatch(c, pattern)), None) for c in columns]
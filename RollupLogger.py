@@ -0,0 +1,305 @@
+import os
+import csv
+import itertools
+import io
+import json
+import math
+from datetime import datetime
+import logging
+from background_writer import BackgroundWriter
+from log_archive import LogArchiver, find_day_file
+
+ERROR_VALUE = -999  # same as DcCurrents.ERROR_VALUE, left out of the aggregates
+
+class _Window:
+    """
+    Running min/max/sum/count per column of one rollup window.
+    """
+
+    def __init__(self, start, columns):
+        self.start = start  # window start, seconds since the epoch
+        self.min = [math.inf] * columns
+        self.max = [-math.inf] * columns
+        self.sum = [0.0] * columns
+        self.count = [0] * columns
+
+    def add(self, values):
+        for k, value in enumerate(values):
+            if value is None or value == ERROR_VALUE:
+                continue
+            if value < self.min[k]:
+                self.min[k] = value
+            if value > self.max[k]:
+                self.max[k] = value
+            self.sum[k] += value
+            self.count[k] += 1
+
+    def merge(self, other):
+        for k in range(len(self.count)):
+            if not other.count[k]:
+                continue
+            self.min[k] = min(self.min[k], other.min[k])
+            self.max[k] = max(self.max[k], other.max[k])
+            self.sum[k] += other.sum[k]
+            self.count[k] += other.count[k]
+
+    def get_state(self):
+        # the min/max of a column without values are infinite, which is not JSON
+        return {
+            'start': self.start,
+            'min': [v if c else None for v, c in zip(list(self.min), self.count)],
+            'max': [v if c else None for v, c in zip(list(self.max), self.count)],
+            'sum': list(self.sum),
+            'count': list(self.count),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        window = cls(state['start'], len(state['count']))
+        window.min = [math.inf if v is None else v for v in state['min']]
+        window.max = [-math.inf if v is None else v for v in state['max']]
+        window.sum = list(state['sum'])
+        window.count = list(state['count'])
+        return window
+
+    def row(self):
+        row = [datetime.fromtimestamp(self.start).strftime("%Y-%m-%d %H:%M:%S")]
+        for k, count in enumerate(self.count):
+            if count:
+                row += [round(self.min[k], 3), round(self.max[k], 3), round(self.sum[k] / count, 3), count]
+            else:
+                row += [ERROR_VALUE, ERROR_VALUE, ERROR_VALUE, 0]
+        return row
+
+class _Tier:
+    def __init__(self, name, period, columns):
+        self.name = name
+        self.period = period
+        self.columns = columns
+        self.window = None  # open _Window
+
+    def add(self, timestamp, merge=None, values=None):
+        """
+        Adds a sample (values) or a closed window of the previous tier (merge) to the window of the timestamp.
+
+        Returns:
+            _Window: The window that was closed by this sample, or None.
+        """
+        start = timestamp // self.period * self.period
+        closed = None
+        if self.window is not None and self.window.start != start:
+            closed = self.window
+            self.window = None
+        if self.window is None:
+            self.window = _Window(start, self.columns)
+        if merge is not None:
+            self.window.merge(merge)
+        else:
+            self.window.add(values)
+        return closed
+
+class RollupLogger:
+    """
+    Incremental downsampling of the sample stream into rollup tiers (by default 1 s, 1 min and 15 min windows aligned to the clock).
+
+    Each tier keeps the min, max, mean and count of every column per window and writes a row to its CSV day file
+    (<directory>/<tier>/dc_currents_<tier>_YYYYMMDD.csv) as soon as the window closes. Only the first tier sees every sample;
+    each closed window is merged into the next tier, so the cost per sample does not grow with the number of tiers.
+    Every tier has its own retention in days and quota in bytes, enforced (together with compression of closed days) by a
+    LogArchiver, so the rollups stay bounded on /data next to the quota of the sample logs.
+    The open windows are written on close as well, and continued when the next run starts within the same window (see close()).
+    """
+    # name -> (window in seconds, retention in days or None to keep forever, quota in bytes or None for no quota),
+    # from the shortest to the longest window
+    DEFAULT_TIERS = {
+        '1s': (1, 30, 100 * 1024 * 1024),
+        '1min': (60, 365, 50 * 1024 * 1024),
+        '15min': (900, None, 50 * 1024 * 1024),
+    }
+    STATISTICS = ('min', 'max', 'mean', 'count')
+    RESUME_NAME = '.open_windows.json'  # the windows that were open at close, see close()
+
+    def __init__(self, directory, columns, tiers=None, flush_interval=60, compression='gzip'):
+        """
+        Args:
+            directory (str): Directory of the tier directories.
+            columns (list): Names of the logged columns (without timestamp).
+            tiers (dict): Tier name -> (window in seconds, retention in days or None[, quota in bytes or None]). When the
+                quota is exceeded the oldest closed days of the tier are deleted. Each window must be a multiple of the
+                previous one. Default is DEFAULT_TIERS.
+            flush_interval (float): Seconds between writes. Default is 60.
+            compression (str): Compression of closed days: 'gzip', 'lzma' or None. Default is 'gzip'.
+        """
+        self.logger = logging.getLogger(__name__)
+        tiers = tiers if tiers is not None else self.DEFAULT_TIERS
+        periods = [period for period, *_ in tiers.values()]
+        if any(b % a for a, b in zip(periods, periods[1:])):
+            raise ValueError(f"Each rollup window must be a multiple of the previous one, got {periods}")
+        if not os.path.isabs(directory):
+            directory = os.path.abspath(directory)
+        self.directory = directory
+        self.columns = columns
+        self.header = ['timestamp'] + [f'{c}_{s}' for c in columns for s in self.STATISTICS]
+        self.tiers = [_Tier(name, period, len(columns)) for name, (period, *_) in tiers.items()]
+        self.archivers = {}
+        for name, (period, retention, *max_bytes) in tiers.items():
+            tier_directory = os.path.join(directory, name)
+            os.makedirs(tier_directory, exist_ok=True)
+            self.archivers[name] = LogArchiver(tier_directory, self._prefix(name), compression,
+                                               max_bytes=max_bytes[0] if max_bytes else None, max_days=retention,
+                                               grace=max(LogArchiver.DEFAULT_GRACE, 2 * flush_interval + period))
+        self.resume_path = os.path.join(directory, self.RESUME_NAME)
+        self._resume = self._load_resume()
+        self.last_day = {}  # tier name -> day of the last written row
+        self.filepaths = {}  # tier name -> file of that day
+        self.logger.info(f"Rollups {list(tiers)} in {directory}")
+        self.writer = BackgroundWriter(self._write, flush_interval, name="RollupLogger writer")
+
+    @staticmethod
+    def _prefix(name):
+        return f'dc_currents_{name}_'
+
+    def add(self, timestamp, values):
+        """
+        Adds one sample to the rollups.
+
+        Args:
+            timestamp (float): time.time() of the sample.
+            values (list): One value per column, ERROR_VALUE or None for missing values.
+        """
+        if self._resume is not None:
+            self._resume_windows(timestamp)
+        closed = self.tiers[0].add(timestamp, values=values)
+        if closed is not None:
+            self._close_window(0, closed)
+
+    def _close_window(self, index, window):
+        # queue the row of the closed window and merge the window into the next tier
+        self.writer.put((self.tiers[index].name, window.row()))
+        if index + 1 < len(self.tiers):
+            closed = self.tiers[index + 1].add(window.start, merge=window)
+            if closed is not None:
+                self._close_window(index + 1, closed)
+
+    def _write(self, rows):
+        # Called from the writer thread. Rows are (tier name, row), split by tier and the day of the window start
+        rows = sorted(rows, key=lambda r: r[0])  # stable, keeps the rows of each tier in order
+        for (name, date), tier_rows in itertools.groupby(rows, key=lambda r: (r[0], r[1][0][:10])):
+            day = date.replace('-', '')
+            if day != self.last_day.get(name):
+                if name in self.last_day:
+                    self.archivers[name].notify()
+                self.last_day[name] = day
+                # a file written with other columns (e.g. after changing the channels) is continued in a _N file
+                self.filepaths[name] = find_day_file(os.path.join(self.directory, name), self._prefix(name), day, self.header)
+            filepath = self.filepaths[name]
+            new = not os.path.exists(filepath)
+            with open(filepath, mode='a', newline='') as f:
+                writer = csv.writer(f)
+                if new:
+                    writer.writerow(self.header)
+                writer.writerows(row for _, row in tier_rows)
+
+    def flush(self):
+        self.writer.flush()
+
+    def get_metrics(self):
+        metrics = self.writer.get_metrics()
+        for name, archiver in self.archivers.items():
+            metrics[name] = archiver.get_metrics()
+        return metrics
+
+    def _load_resume(self):
+        # the windows that were open at the last close(), resumed at the first add()
+        try:
+            with open(self.resume_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            self.logger.exception(f"Invalid {self.resume_path}, the open windows of the last run are not resumed")
+            os.remove(self.resume_path)
+            return None
+        if state.get('columns') != self.columns or set(state['tiers']) - {tier.name for tier in self.tiers}:
+            os.remove(self.resume_path)    # the partial rows written at close stand
+            return None
+        return state
+
+    def _resume_windows(self, timestamp):
+        """
+        Resumes the windows that were open at the last close(). A window that is still open at the first sample is
+        continued: its partial row is cut from the end of the day file, so the window is written once when it closes.
+        The partial row of a window that has closed since is its final row. Each window is kept without the windows of the
+        lower tiers that were merged into it at close, so those are merged again once, either when the lower window closes
+        or here when it is not continued.
+        """
+        state, self._resume = self._resume, None
+        carry = None    # lower tier windows that are not continued and not in the pre-merge window of this tier
+        continued = []
+        for tier in self.tiers:
+            entry = state['tiers'].get(tier.name)
+            if entry is None:
+                continue
+            window = _Window.from_state(entry['window']) if entry['window'] is not None else _Window(entry['start'], len(self.columns))
+            if carry is not None:
+                window.merge(carry)
+            if entry['start'] == timestamp // tier.period * tier.period:
+                if self._truncate(entry['path'], entry['offset'], entry['size']):
+                    tier.window = window
+                    continued.append(tier.name)
+                    carry = None
+                    continue
+                self.logger.warning(f"Cannot cut the partial {tier.name} row from {entry['path']}, the window will have two rows")
+            carry = window
+        os.remove(self.resume_path)
+        self.logger.info(f"Continued the open rollup windows of {continued}")
+
+    @staticmethod
+    def _truncate(path, offset, size):
+        # cuts the row written at close from the end of the file, unless the file was changed since
+        try:
+            if os.path.getsize(path) != offset + size:
+                return False
+            os.truncate(path, offset)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def close(self):
+        """
+        Writes the closed windows and then the open (partial) windows of all tiers, and stops the writer and housekeeping threads.
+        The open windows are saved as well, so a restart within the same window continues it instead of writing it twice.
+        Call after the last add().
+        """
+        # the windows as they are before the lower tiers are merged into them, see _resume_windows()
+        unmerged = {tier.name: (tier.window, tier.window.get_state()) for tier in self.tiers if tier.window is not None}
+        partial = []
+        for index, tier in enumerate(self.tiers):
+            if tier.window is None:
+                continue
+            window, tier.window = tier.window, None
+            partial.append((tier.name, window))
+            if index + 1 < len(self.tiers):
+                # merging can close the window of the next tier, when no lower window was closed into it yet
+                closed = self.tiers[index + 1].add(window.start, merge=window)
+                if closed is not None:
+                    self._close_window(index + 1, closed)
+        self.writer.close()
+        tiers = {}
+        for name, window in partial:
+            row = window.row()
+            self._write([(name, row)])
+            line = io.StringIO()
+            csv.writer(line).writerow(row)
+            path = self.filepaths[name]
+            size = len(line.getvalue().encode())
+            own, state = unmerged.get(name, (None, None))
+            tiers[name] = {'start': window.start, 'window': state if own is window else None,
+                           'path': path, 'offset': os.path.getsize(path) - size, 'size': size}
+        if tiers:
+            tmp_path = self.resume_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'columns': self.columns, 'tiers': tiers}, f)
+            os.replace(tmp_path, self.resume_path)
+        for archiver in self.archivers.values():
+            archiver.close(timeout=5)
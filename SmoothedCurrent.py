@@ -1,12 +1,123 @@
+from array import array
+from bisect import bisect_left, insort
+from typing import NamedTuple
+
+class SmoothedCurrentSnapshot(NamedTuple):
+    """
+    Immutable state of a SmoothedCurrent at one point in time, published by the acquisition thread for lock free readers.
+    """
+    value: float             # smoothed current, None if the quality is too low
+    baseline_current: float  # expected current (battery current divided by number of channels)
+    voltage: float           # battery voltage
+    quality: float           # percentage of valid samples in the window
+    timestamp: float         # time.time() of the sample
+
+class _SmaFilter:
+    """
+    Simple moving average over a ring buffer with an incrementally maintained sum.
+    The sum is recomputed each time the ring wraps around to stop floating point errors from accumulating.
+    """
+
+    def __init__(self, window_size):
+        self.buffer = array('d', [0.0] * window_size)
+        self.index = 0
+        self.sum = 0.0
+
+    def update(self, value):
+        self.sum += value - self.buffer[self.index]
+        self.buffer[self.index] = value
+        self.index += 1
+        if self.index == len(self.buffer):
+            self.index = 0
+            self.sum = sum(self.buffer)
+
+    def value(self):
+        return self.sum / len(self.buffer)
+
+    def get_state(self):
+        return {'buffer': list(self.buffer), 'index': self.index}
+
+    def restore_state(self, state):
+        self.buffer = array('d', state['buffer'])
+        self.index = state['index']
+        self.sum = sum(self.buffer)
+
+class _EmaFilter:
+    """
+    Exponential moving average with the same center of mass as a simple moving average over the window (alpha = 2 / (N + 1)).
+    """
+
+    def __init__(self, window_size):
+        self.alpha = 2 / (window_size + 1)
+        self.ema = None
+
+    def update(self, value):
+        self.ema = value if self.ema is None else self.ema + self.alpha * (value - self.ema)
+
+    def value(self):
+        return self.ema if self.ema is not None else 0.0
+
+    def get_state(self):
+        return {'ema': self.ema}
+
+    def restore_state(self, state):
+        self.ema = state['ema']
+
+class _MedianFilter:
+    """
+    Median over a ring buffer, kept in a sorted list alongside the ring so that an update is a binary search plus
+    a memmove instead of a full sort. Robust against single spikes from the ADC.
+    """
+
+    def __init__(self, window_size):
+        self.buffer = array('d', [0.0] * window_size)
+        self.sorted = [0.0] * window_size
+        self.index = 0
+
+    def update(self, value):
+        del self.sorted[bisect_left(self.sorted, self.buffer[self.index])]
+        insort(self.sorted, value)
+        self.buffer[self.index] = value
+        self.index = (self.index + 1) % len(self.buffer)
+
+    def value(self):
+        n = len(self.sorted)
+        if n % 2:
+            return self.sorted[n // 2]
+        return (self.sorted[n // 2 - 1] + self.sorted[n // 2]) / 2
+
+    def get_state(self):
+        return {'buffer': list(self.buffer), 'index': self.index}
+
+    def restore_state(self, state):
+        self.buffer = array('d', state['buffer'])
+        self.sorted = sorted(self.buffer)
+        self.index = state['index']
+
 class SmoothedCurrent:
     """
     A class to maintain a smoothed current value over a sliding window.
     It keeps track of the last N values and the quality of the value defined as the percentage of non-None values in the window.
+
+    Values and quality flags are stored in fixed size ring buffers with incrementally maintained sums, so update and
+    read cost the same regardless of the window size. The smoothing filter is selectable:
+    'sma' (simple moving average, default), 'ema' (exponential moving average) or 'median' (windowed median).
     """
+    FILTERS = {
+        'sma': _SmaFilter,
+        'ema': _EmaFilter,
+        'median': _MedianFilter,
+    }
 
-    def __init__(self, window_size=10):
-        self.buffer = [0] * window_size
-        self.quality = [0] * window_size  # Quality of the current values in the buffer
+    def __init__(self, window_size=10, filter='sma'):
+        if filter not in self.FILTERS:
+            raise ValueError(f"Unknown filter {filter}, expected one of {list(self.FILTERS)}")
+        self.window_size = window_size
+        self.filter_name = filter
+        self.filter = self.FILTERS[filter](window_size)
+        self.quality = bytearray(window_size)  # 1 for each valid value in the window, 0 for each None
+        self.quality_index = 0
+        self.quality_count = 0  # number of valid values in the window
         self.BaselineCurrent = 0  # latest baseline current
         self.Voltage = 0         # latest battery voltage
 
@@ -15,36 +126,34 @@ class SmoothedCurrent:
         Also updates the BaselineCurrent and Voltage
         If the value is None, the value is not added to the buffer, and the quality is decreased.
         """
+        valid = 0 if value is None else 1
+        self.quality_count += valid - self.quality[self.quality_index]
+        self.quality[self.quality_index] = valid
+        self.quality_index = (self.quality_index + 1) % self.window_size
         if value is None:
-            self.quality.pop(0)
-            self.quality.append(0)  # Append a quality of 0 for None values
             return
-        self.quality.pop(0)
-        self.quality.append(100)  # Assume new value has full quality
-        self.buffer.pop(0)
-        self.buffer.append(value)
+        self.filter.update(value)
         self.BaselineCurrent = baseline_current
         self.Voltage = voltage
 
     def get_value(self, default=None):
-        """Returns the average of the values in the buffer.
-        This is a simple moving average.
+        """Returns the filtered value of the values in the buffer.
         """
-        if not self.buffer:
+        if not self.window_size:
             return default
 
         if self.get_quality() < 50:
             # If the quality is below 50%, return the default value
             return default
-        return sum(self.buffer) / len(self.buffer)
+        return self.filter.value()
 
     def get_quality(self):
         """Returns the percentage quality of the values in the buffer.
-        The quality is calculated as the average of the quality values in the buffer.
+        The quality is calculated as the percentage of valid values in the buffer.
         """
-        if not self.quality:
+        if not self.window_size:
             return 0
-        return sum(self.quality) / len(self.quality)
+        return self.quality_count * 100 / self.window_size
 
     def get_baseline_current(self):
         """
@@ -56,4 +165,42 @@ class SmoothedCurrent:
         """
         Returns the current Voltage value for this instance.
         """
-        return self.Voltage
\ No newline at end of file
+        return self.Voltage
+
+    def snapshot(self, timestamp):
+        """
+        Returns the current state as an immutable SmoothedCurrentSnapshot.
+        """
+        return SmoothedCurrentSnapshot(self.get_value(), self.BaselineCurrent, self.Voltage, self.get_quality(), timestamp)
+
+    def get_state(self):
+        """
+        Returns the window, filter and quality state as a JSON serializable dict, for a warm restart.
+        """
+        return {
+            'filter': self.filter_name,
+            'window_size': self.window_size,
+            'values': self.filter.get_state(),
+            'quality': list(self.quality),
+            'quality_index': self.quality_index,
+            'baseline_current': self.BaselineCurrent,
+            'voltage': self.Voltage,
+        }
+
+    def restore_state(self, state):
+        """
+        Restores the state returned by get_state(), unless it was saved with another filter or window size.
+        The sums are recomputed, so a state that was read while a value was added is still consistent.
+
+        Returns:
+            bool: True if the state was restored.
+        """
+        if state.get('filter') != self.filter_name or state.get('window_size') != self.window_size:
+            return False
+        self.filter.restore_state(state['values'])
+        self.quality = bytearray(state['quality'])
+        self.quality_index = state['quality_index']
+        self.quality_count = sum(self.quality)
+        self.BaselineCurrent = state['baseline_current']
+        self.Voltage = state['voltage']
+        return True
@@ -0,0 +1,130 @@
+import os
+import csv
+import itertools
+import time
+from datetime import datetime
+import logging
+from background_writer import BackgroundWriter
+from log_archive import LogArchiver, find_day_file
+
+class TempLogger:
+    """
+    Time series log of the temperature sensors (1Wire, BLE and CPU), written by a background writer thread.
+
+    Each reading becomes one compact row timestamp,sensor,temperature,humidity,battery in the day file of the time of the
+    reading, temps_YYYYMMDD.csv (or a temps_YYYYMMDD_N.csv continuation file, see log_archive.find_day_file), with the sensor id dictionary encoded as a small number. The numbers are assigned when a sensor
+    is first seen and appended to sensors.csv (sensor,id,connection) in the same directory, so they stay the same across
+    days and restarts. Missing values (e.g. the humidity of a 1Wire sensor) are left empty.
+    A reading that was already logged is skipped, since BLETemps returns the last advertisement until the next one arrives.
+    Closed days are compressed and the oldest days deleted to stay within max_bytes by a LogArchiver.
+    """
+    DEFAULT_LOG_PATH = '/data/VenusOS-SensorMonitor/logs/temps'
+    DEFAULT_FLUSH_INTERVAL = 300  # seconds, a few rows per sensor per minute do not need frequent writes
+    DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+    FILE_PREFIX = 'temps_'
+    SENSORS_NAME = 'sensors.csv'
+    HEADER = ['timestamp', 'sensor', 'temperature', 'humidity', 'battery']
+
+    def __init__(self, directory: str = None, flush_interval: float = None, compression: str = 'gzip', max_bytes: int = None, max_days: int = None):
+        """
+        Args:
+            directory (str): Directory of the temps_YYYYMMDD.csv files. Default is '/data/VenusOS-SensorMonitor/logs/temps'.
+            flush_interval (float): Seconds between writes. Default is 300.
+            compression (str): Compression of closed days: 'gzip', 'lzma' or None. Default is 'gzip'.
+            max_bytes (int): Quota for all day files in bytes. Default is 100 MB.
+            max_days (int): Number of days to keep before today, None to keep all days. Default is None.
+        """
+        self.logger = logging.getLogger(__name__)
+        directory = directory if directory is not None else self.DEFAULT_LOG_PATH
+        flush_interval = flush_interval if flush_interval is not None else self.DEFAULT_FLUSH_INTERVAL
+        max_bytes = max_bytes if max_bytes is not None else self.DEFAULT_MAX_BYTES
+        if not os.path.isabs(directory):
+            directory = os.path.abspath(directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+            self.logger.info(f"Created directory: {directory}")
+        self.directory = directory
+        self.logger.info(f"Using directory: {self.directory}")
+        self.sensors_path = os.path.join(directory, self.SENSORS_NAME)
+        self.sensors = self._load_sensors()  # sensor id -> number
+        self.last_logged = {}   # sensor id -> last logged TempSensorData
+        self.day = None         # day of the last written row
+        self.filepath = None    # file of that day
+        self.archiver = LogArchiver(directory, self.FILE_PREFIX, compression, max_bytes,
+                                    grace=max(LogArchiver.DEFAULT_GRACE, 2 * flush_interval), max_days=max_days)
+        self.writer = BackgroundWriter(self._write, flush_interval, name="TempLogger writer")
+
+    def _load_sensors(self):
+        sensors = {}
+        if os.path.exists(self.sensors_path):
+            with open(self.sensors_path, newline='') as f:
+                for row in itertools.islice(csv.reader(f), 1, None):
+                    if len(row) >= 2:
+                        sensors[row[1]] = int(row[0])
+        return sensors
+
+    def log(self, sensor_data):
+        """
+        Queues one reading, unless it is the reading that was logged last for the sensor.
+        The row gets the time of the reading, or the current time if the reading has none.
+
+        Args:
+            sensor_data (TempSensorData): The reading, with id and connection set.
+        """
+        if sensor_data is None or self.last_logged.get(sensor_data.id) is sensor_data:
+            return
+        self.last_logged[sensor_data.id] = sensor_data
+        timestamp = sensor_data.timestamp.timestamp() if sensor_data.timestamp is not None else time.time()
+        self.writer.put((timestamp, sensor_data.id, sensor_data.connection,
+                         sensor_data.temperature, sensor_data.humidity, sensor_data.battery))
+
+    def _encode(self, id, connection):
+        # called from the writer thread: number of the sensor, adding new sensors to the dictionary first
+        number = self.sensors.get(id)
+        if number is None:
+            number = max(self.sensors.values(), default=0) + 1
+            new = not os.path.exists(self.sensors_path)
+            with open(self.sensors_path, mode='a', newline='') as f:
+                writer = csv.writer(f)
+                if new:
+                    writer.writerow(['sensor', 'id', 'connection'])
+                writer.writerow([number, id, connection])
+            self.sensors[id] = number
+        return number
+
+    def _write(self, rows):
+        # Called from the writer thread. Rows are split by the day of their timestamp
+        self.logger.debug(f"Writing {len(rows)} temperature rows")
+        lines = [[datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"), self._encode(id, connection),
+                  '' if temperature is None else temperature, '' if humidity is None else humidity, '' if battery is None else battery]
+                 for timestamp, id, connection, temperature, humidity, battery in rows]
+        lines.sort(key=lambda line: line[0][:10])  # stable, keeps the rows of each day in order
+        for date, day_lines in itertools.groupby(lines, key=lambda line: line[0][:10]):
+            day = date.replace('-', '')
+            if day != self.day:
+                if self.day is not None:
+                    self.archiver.notify()  # the previous day is closed
+                self.day = day
+                self.filepath = None
+            if self.filepath is None or not os.path.exists(self.filepath):
+                # a day that was already compressed (a late reading) or written with another header is continued in a _N file
+                self.filepath = find_day_file(self.directory, self.FILE_PREFIX, day, self.HEADER)
+            new = not os.path.exists(self.filepath)
+            with open(self.filepath, mode='a', newline='') as f:
+                writer = csv.writer(f)
+                if new:
+                    writer.writerow(self.HEADER)
+                writer.writerows(day_lines)
+
+    def flush(self):
+        """
+        Writes the queued rows now and waits until they are written.
+        """
+        self.writer.flush()
+
+    def get_metrics(self):
+        return {**self.writer.get_metrics(), **self.archiver.get_metrics()}
+
+    def close(self):
+        self.writer.close()
+        self.archiver.close(timeout=5)
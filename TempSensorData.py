@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 
 @dataclass
@@ -11,7 +11,7 @@ class TempSensorData():
     battery: float = None
     temperature: float = None
     humidity: float = None
-    timestamp: datetime = datetime.now()
+    timestamp: datetime = field(default_factory=datetime.now)  # time of the reading
 
     def __str__(self):
         return f"Connection: {self.connection}, Battery: {self.battery}, Temperature: {self.temperature}, Humidity: {self.humidity}, Timestamp: {self.timestamp}"
\ No newline at end of file
@@ -0,0 +1,282 @@
+from dataclasses import dataclass
+import logging
+import random
+import threading
+import time
+import lgpio
+from ads1115 import ADS1115, ADS1115Scanner
+
+@dataclass(frozen=True)
+class AdcChannel:
+    """
+    Location of a current sensor input: I2C bus, ADS1115 address (0x48-0x4B) and single ended input pin (0-3),
+    optionally with its own ADS1115 data rate (8-860 samples per second) instead of the default data rate.
+    """
+    bus: int = 1
+    address: int = ADS1115.DEFAULT_ADDRESS
+    pin: int = 0
+    data_rate: int = None
+
+class _ConversionReadyDevice:
+    """
+    An ADS1115 running in continuous-conversion mode with its ALERT/RDY pin wired to a GPIO.
+    """
+
+    def __init__(self, ads: ADS1115, gpio_handle: int, gpio: int):
+        self.ads = ads
+        self.gpio = gpio
+        self.ready_tick = 0
+        self.ready = threading.Event()
+        self.ads.open()
+        self.ads.enable_conversion_ready()
+        lgpio.gpio_claim_alert(gpio_handle, gpio, lgpio.FALLING_EDGE)
+        self.callback = lgpio.callback(gpio_handle, gpio, lgpio.FALLING_EDGE, self._on_conversion_ready)
+
+    def _on_conversion_ready(self, chip, gpio, level, tick):
+        # Called from the lgpio notification thread, so only record the edge and wake up the reader
+        self.ready_tick = tick
+        self.ready.set()
+
+    def select(self, pin: int, data_rate: int = None) -> int:
+        """
+        Switches the input multiplexer to the pin (restarting the conversion) unless it is already selected.
+
+        Returns:
+            int: The lgpio timestamp (ns) that the conversion ready edge has to be later than.
+        """
+        if self.ads.pin == pin:
+            return self.ready_tick + 1  # same pin, wait for the next conversion
+        self.ready.clear()
+        started = time.time_ns()
+        self.ads.start_continuous(pin, data_rate)
+        return started
+
+    def read_raw(self, started: int) -> int:
+        """
+        Waits for the ALERT/RDY pin to signal a finished conversion and returns the result as raw count.
+        """
+        timeout = 10 * self.ads.conversion_time(self.ads.active_data_rate)
+        # ignore edges from conversions that finished before the mux switch but were delivered late
+        while self.ready_tick < started:
+            if not self.ready.wait(timeout):
+                raise TimeoutError(f"No conversion ready signal on GPIO{self.gpio} within {timeout:.3f} s")
+            self.ready.clear()
+        return self.ads.read_raw()
+
+    def close(self, gpio_handle: int):
+        self.callback.cancel()
+        try:
+            lgpio.gpio_free(gpio_handle, self.gpio)
+        except Exception:
+            pass
+        self.ads.close()
+
+class AdcBus:
+    """
+    Reads the ADS1115 channels connected to one I2C bus.
+
+    DcCurrents creates one AdcBus and one acquisition thread per bus, so adding a bus does not slow down the
+    sampling of the others. When every ADC on the bus has its ALERT/RDY pin wired to a GPIO the ADCs run in
+    continuous-conversion mode, otherwise all channels are scanned in single-shot mode with batched I2C transactions.
+    In both cases the ADCs on the bus convert in parallel.
+    """
+    DEFAULT_GPIOCHIP = 0  # gpiochip used for the ALERT/RDY pins
+    GAIN = 2/3  # +/-6.144V full scale range, the current sensors output 0-5V
+    SCAN_FAILURE_LIMIT = 3  # consecutive scans without any channel read before the bus is reconnected
+    CHANNEL_ERROR_WARNING = 100  # consecutive errors on one channel before warning about it
+    RECONNECT_MIN_DELAY = 0.5  # seconds, backoff after the first failed reconnect
+    RECONNECT_MAX_DELAY = 60  # seconds, upper limit of the exponential backoff
+
+    def __init__(self, bus: int, channels: dict, alert_gpios: dict = None, data_rate: int = 128):
+        """
+        Args:
+            bus (int): I2C bus number.
+            channels (dict): Channel id -> AdcChannel for the channels on this bus.
+            alert_gpios (dict): ADS1115 address -> GPIO wired to its ALERT/RDY pin. Default is None (polling).
+            data_rate (int): Default ADS1115 data rate in samples per second for channels without their own data rate. Default is 128.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.bus = bus
+        self.channels = channels
+        self.addresses = sorted({c.address for c in channels.values()})
+        self.alert_gpios = alert_gpios or {}
+        self.data_rate = data_rate
+        wired = [a for a in self.addresses if a in self.alert_gpios]
+        if wired and len(wired) != len(self.addresses):
+            raise ValueError(f"Either all or none of the ADCs on I2C bus {bus} must have an ALERT/RDY GPIO")
+        self.interrupt_driven = len(wired) > 0
+        for channel in channels.values():
+            ADS1115.check_data_rate(channel.data_rate or data_rate)
+        self.lsb = ADS1115.GAINS[self.GAIN][1] / 32768  # volts per count
+        self.connected = False
+        self.fail_count = 0     # consecutive failed connection attempts
+        self.next_attempt = 0.0 # time.monotonic() of the next allowed connection attempt
+        self.scan_failures = 0  # consecutive scans without any channel read
+        self.disconnected_since = None  # time.monotonic() the connection was lost or first failed, None while connected
+        self.channel_errors = dict.fromkeys(channels, 0)        # total read errors per channel id
+        self.consecutive_errors = dict.fromkeys(channels, 0)    # read errors since the last good read per channel id
+        # Recovery metrics
+        self.reconnect_attempts = 0
+        self.recoveries = 0
+        self.last_time_to_recover = None    # seconds from losing the connection to recovering it
+        self.max_time_to_recover = None
+        # Diagnostics, updated by DcCurrents
+        self.input_rate = 0.0   # achieved conversions per second per channel
+        self.output_rate = 0.0  # achieved decimated output samples per second
+        self.last_output = None  # time.monotonic() of the last output sample
+        self._scanner = None    # ADS1115Scanner, when polling
+        self._devices = {}      # address -> _ConversionReadyDevice, when interrupt driven
+        self._gpio_handle = None
+
+    def try_connect(self, now: float) -> bool:
+        """
+        Non-blocking reconnect: attempts to connect if the bus is disconnected and the backoff delay has passed.
+        Failed attempts are retried forever with exponential backoff (with jitter, so several buses do not retry in lockstep).
+
+        Args:
+            now (float): time.monotonic()
+
+        Returns:
+            bool: True if the bus is connected.
+        """
+        if self.connected:
+            return True
+        if now < self.next_attempt:
+            return False
+        self.reconnect_attempts += 1
+        try:
+            self.connect()
+        except Exception as e:
+            self.close()
+            self.fail_count += 1
+            if self.disconnected_since is None:
+                self.disconnected_since = now   # e.g. the ADC is missing at start-up, its recovery counts as well
+            delay = min(self.RECONNECT_MAX_DELAY, self.RECONNECT_MIN_DELAY * 2 ** (self.fail_count - 1))
+            delay *= random.uniform(0.5, 1.0)
+            self.next_attempt = now + delay
+            # only log the first failure and then every power of two to not flood the log while the bus is down
+            if self.fail_count & (self.fail_count - 1) == 0:
+                self.logger.warning(f"Connecting I2C bus {self.bus} failed {self.fail_count} times ({e}), retrying in {delay:.1f} s")
+            return False
+
+        if self.disconnected_since is not None:
+            self.recoveries += 1
+            self.last_time_to_recover = now - self.disconnected_since
+            self.max_time_to_recover = max(self.max_time_to_recover or 0, self.last_time_to_recover)
+            self.logger.info(f"I2C bus {self.bus} recovered after {self.last_time_to_recover:.1f} s and {self.fail_count + 1} attempts")
+        self.fail_count = 0
+        self.scan_failures = 0
+        self.disconnected_since = None
+        return True
+
+    def _lost_connection(self, reason: str):
+        self.logger.warning(f"Lost connection to I2C bus {self.bus}: {reason}")
+        self.close()
+        self.disconnected_since = time.monotonic()
+        self.next_attempt = 0.0
+
+    def get_metrics(self) -> dict:
+        return {
+            'connected': self.connected,
+            'reconnect_attempts': self.reconnect_attempts,
+            'recoveries': self.recoveries,
+            'last_time_to_recover': self.last_time_to_recover,
+            'max_time_to_recover': self.max_time_to_recover,
+            'channel_errors': dict(self.channel_errors),
+        }
+
+    def connect(self):
+        """
+        Opens the I2C bus and initializes all ADCs on it. Raises on failure.
+        """
+        self.close()  # release anything left over from a previous failed connection
+        adcs = {address: ADS1115(bus=self.bus, address=address, gain=self.GAIN, data_rate=self.data_rate) for address in self.addresses}
+        if self.interrupt_driven:
+            self._gpio_handle = lgpio.gpiochip_open(self.DEFAULT_GPIOCHIP)
+            for address, ads in adcs.items():
+                self._devices[address] = _ConversionReadyDevice(ads, self._gpio_handle, self.alert_gpios[address])
+                self.logger.info(f"ADS1115 0x{address:02x} on bus {self.bus} in continuous mode at {self.data_rate} SPS, "
+                                 f"ALERT/RDY on GPIO{self.alert_gpios[address]}")
+        else:
+            pins = {address: [c.pin for c in self.channels.values() if c.address == address] for address in self.addresses}
+            data_rates = {(c.address, c.pin): c.data_rate for c in self.channels.values() if c.data_rate is not None}
+            self._scanner = ADS1115Scanner(list(adcs.values()), pins, data_rates)
+            self._scanner.open()
+            self.logger.debug(f"Scanning {len(self.channels)} channels on bus {self.bus} at {self.data_rate} SPS")
+        self.connected = True
+
+    def close(self):
+        self.connected = False
+        if self._scanner is not None:
+            try:
+                self._scanner.close()
+            except Exception:
+                self.logger.debug(f"Failed to close I2C bus {self.bus}")
+            self._scanner = None
+        for device in self._devices.values():
+            try:
+                device.close(self._gpio_handle)
+            except Exception:
+                self.logger.debug(f"Failed to close ADS1115 0x{device.ads.address:02x}")
+        self._devices = {}
+        if self._gpio_handle is not None:
+            try:
+                lgpio.gpiochip_close(self._gpio_handle)
+            except Exception:
+                self.logger.debug("Failed to close gpiochip")
+            self._gpio_handle = None
+
+    def read_raw(self) -> dict:
+        """
+        Reads all channels on the bus once.
+        Channels that fail to read are left out of the result and counted per channel. Only when no channel
+        could be read for SCAN_FAILURE_LIMIT scans in a row the bus is considered lost and will be reconnected.
+
+        Returns:
+            dict: Channel id -> raw signed 16-bit ADC count. Multiply by lsb to get volts.
+        """
+        if self.interrupt_driven:
+            counts = self._read_interrupt_driven()
+        else:
+            scanned = self._scanner.scan()
+            counts = {id: scanned[(c.address, c.pin)] for id, c in self.channels.items() if (c.address, c.pin) in scanned}
+
+        for id in self.channels:
+            if id in counts:
+                self.consecutive_errors[id] = 0
+                continue
+            self.channel_errors[id] += 1
+            self.consecutive_errors[id] += 1
+            if self.consecutive_errors[id] == self.CHANNEL_ERROR_WARNING:
+                self.logger.warning(f"Channel {id} failed to read {self.CHANNEL_ERROR_WARNING} times in a row")
+
+        if counts:
+            self.scan_failures = 0
+        else:
+            self.scan_failures += 1
+            if self.scan_failures >= self.SCAN_FAILURE_LIMIT:
+                self._lost_connection(f"no channel could be read in {self.scan_failures} scans")
+        return counts
+
+    def _read_interrupt_driven(self):
+        # Group the channels by input pin so that all ADCs on the bus convert in parallel
+        by_pin = {}
+        for id, channel in self.channels.items():
+            by_pin.setdefault(channel.pin, []).append((id, channel, self._devices[channel.address]))
+        counts = {}
+        for pin, entries in by_pin.items():
+            started = {}
+            for id, channel, device in entries:
+                try:
+                    started[id] = device.select(pin, channel.data_rate)
+                except Exception:
+                    self.logger.debug(f"Error selecting channel {id}")
+            for id, channel, device in entries:
+                if id not in started:
+                    continue
+                try:
+                    counts[id] = device.read_raw(started[id])
+                except Exception:
+                    device.ads.pin = None   # force a config write (restarting the conversion) on the next read
+                    self.logger.debug(f"Error reading channel {id}") # happens often, so just log it as debug
+        return counts
@@ -0,0 +1,259 @@
+import logging
+import time
+import lgpio
+
+class ADS1115:
+    """
+    Minimal register level driver for the TI ADS1115 16-bit ADC using the vendored lgpio I2C functions.
+
+    Keeps full control of the config register so the ADC can either run in continuous-conversion mode and pulse
+    ALERT/RDY low each time a result is ready, or be scanned in single-shot mode by ADS1115Scanner.
+    All results are returned as raw signed 16-bit counts; use raw_to_voltage() or lsb() to convert.
+
+    Datasheet: https://www.ti.com/lit/ds/symlink/ads1115.pdf
+    """
+    DEFAULT_ADDRESS = 0x48
+
+    # Register pointers
+    REG_CONVERSION = 0x00
+    REG_CONFIG = 0x01
+    REG_LO_THRESH = 0x02
+    REG_HI_THRESH = 0x03
+
+    # Config register bits
+    CONFIG_OS_SINGLE = 0x8000
+    CONFIG_MODE_CONTINUOUS = 0x0000
+    CONFIG_MODE_SINGLE = 0x0100
+    CONFIG_COMP_QUE_1 = 0x0000          # assert ALERT/RDY after every conversion
+    CONFIG_COMP_QUE_DISABLE = 0x0003
+
+    # Programmable gain -> (config bits, full scale range in volts)
+    GAINS = {
+        2/3: (0x0000, 6.144),
+        1: (0x0200, 4.096),
+        2: (0x0400, 2.048),
+        4: (0x0600, 1.024),
+        8: (0x0800, 0.512),
+        16: (0x0A00, 0.256),
+    }
+
+    # Data rate in samples per second -> config bits
+    DATA_RATES = {
+        8: 0x0000,
+        16: 0x0020,
+        32: 0x0040,
+        64: 0x0060,
+        128: 0x0080,
+        250: 0x00A0,
+        475: 0x00C0,
+        860: 0x00E0,
+    }
+
+    def __init__(self, bus: int = 1, address: int = DEFAULT_ADDRESS, gain: float = 2/3, data_rate: int = 128):
+        """
+        Args:
+            bus (int): I2C bus number, i.e. /dev/i2c-<bus>. Default is 1.
+            address (int): I2C address of the ADC. Default is 0x48 (ADDR pin tied to GND).
+            gain (float): Programmable gain, one of the keys in GAINS. Default is 2/3 (+/-6.144V).
+            data_rate (int): Default conversion rate in samples per second, one of the keys in DATA_RATES. Default is 128.
+                Can be overridden per conversion.
+        """
+        if gain not in self.GAINS:
+            raise ValueError(f"Unsupported gain {gain}, expected one of {list(self.GAINS)}")
+        self.check_data_rate(data_rate)
+        self.logger = logging.getLogger(__name__)
+        self.bus = bus
+        self.address = address
+        self.gain = gain
+        self.data_rate = data_rate
+        self.handle = None
+        self.pin = None     # pin currently selected by the input multiplexer
+        self.active_data_rate = data_rate  # data rate of the ongoing continuous conversions
+
+    @classmethod
+    def check_data_rate(cls, data_rate: int):
+        if data_rate not in cls.DATA_RATES:
+            raise ValueError(f"Unsupported data rate {data_rate}, expected one of {list(cls.DATA_RATES)}")
+
+    def open(self):
+        if self.handle is None:
+            self.handle = lgpio.i2c_open(self.bus, self.address)
+            self.logger.debug(f"Opened ADS1115 at 0x{self.address:02x} on bus {self.bus}")
+
+    def close(self):
+        if self.handle is not None:
+            try:
+                # put the ADC back into power-down single-shot mode
+                self._write_register(self.REG_CONFIG, self._config(self.pin or 0, continuous=False))
+            except Exception:
+                self.logger.debug("Failed to power down ADS1115 before closing")
+            lgpio.i2c_close(self.handle)
+            self.handle = None
+            self.pin = None
+
+    def enable_conversion_ready(self):
+        """
+        Turns the ALERT/RDY pin into a conversion ready pin by setting the MSB of the high threshold register
+        to 1 and the MSB of the low threshold register to 0 (datasheet 9.3.8).
+        """
+        self._write_register(self.REG_HI_THRESH, 0x8000)
+        self._write_register(self.REG_LO_THRESH, 0x0000)
+
+    def start_continuous(self, pin: int, data_rate: int = None):
+        """
+        Selects the single ended input pin (0-3) and starts continuous conversions on it.
+        A config write restarts the ongoing conversion, so the next ALERT/RDY pulse belongs to the new pin.
+        """
+        self._write_register(self.REG_CONFIG, self._config(pin, continuous=True, data_rate=data_rate))
+        self.pin = pin
+        self.active_data_rate = data_rate or self.data_rate
+
+    def read_raw(self) -> int:
+        """
+        Returns the latest conversion result as a signed 16-bit count.
+        """
+        return self._read_register(self.REG_CONVERSION)
+
+    def raw_to_voltage(self, raw: int) -> float:
+        return raw * self.lsb()
+
+    def lsb(self) -> float:
+        """
+        Returns the voltage of one count at the configured gain.
+        """
+        return self.GAINS[self.gain][1] / 32768
+
+    def conversion_time(self, data_rate: int = None) -> float:
+        """
+        Returns the nominal time in seconds for one conversion at the data rate (default: the configured data rate).
+        """
+        return 1.0 / (data_rate or self.data_rate)
+
+    def config_bytes(self, pin: int, continuous: bool, data_rate: int = None) -> list:
+        """
+        Returns the config register value for the pin as [msb, lsb]. In single-shot mode the OS bit is set so
+        writing it starts a conversion.
+        """
+        config = self._config(pin, continuous, data_rate)
+        if not continuous:
+            config |= self.CONFIG_OS_SINGLE
+        return [(config >> 8) & 0xFF, config & 0xFF]
+
+    def _config(self, pin: int, continuous: bool, data_rate: int = None) -> int:
+        config = 0x4000 | (pin << 12)      # MUX = AINp / GND
+        config |= self.GAINS[self.gain][0]
+        config |= self.DATA_RATES[data_rate or self.data_rate]
+        config |= self.CONFIG_MODE_CONTINUOUS if continuous else self.CONFIG_MODE_SINGLE
+        config |= self.CONFIG_COMP_QUE_1 if continuous else self.CONFIG_COMP_QUE_DISABLE
+        return config
+
+    def _write_register(self, reg: int, value: int):
+        lgpio.i2c_write_i2c_block_data(self.handle, reg, [(value >> 8) & 0xFF, value & 0xFF])
+
+    def _read_register(self, reg: int) -> int:
+        count, data = lgpio.i2c_read_i2c_block_data(self.handle, reg, 2)
+        if count != 2:
+            raise IOError(f"Short read from ADS1115 register {reg}: {count} bytes")
+        return int.from_bytes(data, byteorder='big', signed=True)
+
+class ADS1115Scanner:
+    """
+    Scans the single ended inputs of one or more ADS1115 on the same I2C bus in single-shot mode.
+
+    Each step of a scan is one lgpio i2c_zip transaction list that, for every ADC on the bus, reads the result of the
+    previous conversion and starts the conversion of the next pin. All ADCs therefore convert in parallel and a scan
+    of N pins per ADC costs N+1 I2C transactions plus N conversion times, instead of a config write, a busy-wait on
+    the config register and a result read per channel as done by the Adafruit AnalogIn.voltage.
+    """
+    # i2c_zip command codes
+    _ZIP_END = 0
+    _ZIP_ADDRESS = 2
+    _ZIP_READ = 4
+    _ZIP_WRITE = 5
+
+    def __init__(self, devices: list, pins: dict, data_rates: dict = None):
+        """
+        Args:
+            devices (list): ADS1115 instances, all on the same I2C bus.
+            pins (dict): ADS1115 address -> list of input pins to scan on that ADC.
+            data_rates (dict): (address, pin) -> data rate in samples per second for pins that should not use
+                the default data rate of their ADC. Default is None.
+        """
+        if len({d.bus for d in devices}) != 1:
+            raise ValueError("All ADS1115 of a scanner must be on the same I2C bus")
+        self.logger = logging.getLogger(__name__)
+        self.devices = devices
+        self.pins = pins
+        self.data_rates = data_rates or {}
+        self.bus = devices[0].bus
+        self.handle = None
+        self.steps = max(len(pins[d.address]) for d in devices)
+        self._transactions = [self._build_step(step) for step in range(self.steps + 1)]
+        # time to wait before each step for the conversions started in the previous step to finish,
+        # the internal oscillator has a tolerance of 10%
+        self._waits = [0.0] + [self._conversion_wait(step) for step in range(self.steps)]
+
+    def open(self):
+        if self.handle is None:
+            self.handle = lgpio.i2c_open(self.bus, self.devices[0].address)
+
+    def close(self):
+        if self.handle is not None:
+            lgpio.i2c_close(self.handle)
+            self.handle = None
+
+    def scan(self) -> dict:
+        """
+        Converts every configured pin once.
+        A failing step only loses the pins read in that step and the pins it should have started, the scan continues.
+
+        Returns:
+            dict: (address, pin) -> raw signed 16-bit count, for the pins that were read successfully.
+        """
+        counts = {}
+        started = True  # whether the conversions read in this step were started by the previous step
+        for step, transaction in enumerate(self._transactions):
+            if step > 0:
+                time.sleep(self._waits[step])
+            try:
+                count, data = lgpio.i2c_zip(self.handle, transaction)
+            except Exception as e:
+                self.logger.debug(f"ADS1115 scan step {step} failed on bus {self.bus}: {e}")
+                started = False
+                continue
+            if step > 0 and started:
+                pins = [(d.address, self.pins[d.address][step - 1]) for d in self.devices if step <= len(self.pins[d.address])]
+                if count != 2 * len(pins):
+                    self.logger.debug(f"Short read from ADS1115 scan on bus {self.bus}: {count} of {2 * len(pins)} bytes")
+                else:
+                    for n, key in enumerate(pins):
+                        counts[key] = int.from_bytes(data[2 * n:2 * n + 2], byteorder='big', signed=True)
+            started = True
+        return counts
+
+    def _build_step(self, step: int) -> list:
+        """
+        Builds the i2c_zip command list that reads the result of pin step-1 and starts pin step on every ADC.
+        """
+        commands = []
+        for device in self.devices:
+            device_pins = self.pins[device.address]
+            if step > len(device_pins):
+                continue
+            commands += [self._ZIP_ADDRESS, device.address]
+            if step > 0:
+                commands += [self._ZIP_WRITE, 1, ADS1115.REG_CONVERSION, self._ZIP_READ, 2]
+            if step < len(device_pins):
+                pin = device_pins[step]
+                data_rate = self.data_rates.get((device.address, pin))
+                commands += [self._ZIP_WRITE, 3, ADS1115.REG_CONFIG] + device.config_bytes(pin, continuous=False, data_rate=data_rate)
+        commands.append(self._ZIP_END)
+        return commands
+
+    def _conversion_wait(self, step: int) -> float:
+        """
+        Returns the time the slowest conversion started in the step takes to finish.
+        """
+        times = [device.conversion_time(self.data_rates.get((device.address, self.pins[device.address][step])))
+                 for device in self.devices if step < len(self.pins[device.address])]
+        return 1.1 * max(times) + 0.0001
@@ -1,25 +1,50 @@
 #!/usr/bin/env python
 import logging
 import time
-from gpiozero import Buzzer, Button # type: ignore
+
+DIFF_ALARM_MIN_CURRENT = 1      # smoothed currents below this (A) are shown and checked as 0
+DIFF_ALARM_MIN_BASELINE = 2     # below this baseline (A) the difference in percent is not meaningful
+DIFF_ALARM_HIGH_CURRENT = 3     # ... and a current above this (A) is an alarm by itself
+
+def diff_alarm_value(current, baseline):
+    """
+    Returns the value checked against the DiffAlarm threshold of a current channel: the difference between the smoothed
+    current and the baseline current in percent of the baseline. When the baseline is too low, 100 if the current is high
+    anyway and None (no check) otherwise.
+    """
+    if current is None or abs(current) < DIFF_ALARM_MIN_CURRENT:
+        current = 0
+    if baseline is None or baseline < DIFF_ALARM_MIN_BASELINE:
+        return 100 if abs(current) > DIFF_ALARM_HIGH_CURRENT else None
+    return abs((current - baseline) / baseline) * 100
 
 class AlarmBuzzer:
     # buzzerPin = 20 #38 is GPIO20
     # buttonPin = 16 #36 is GPIO16
-    def __init__(self, buzzerPin = 20, buttonPin = 16):
+    def __init__(self, buzzerPin = 20, buttonPin = 16, buzzer = None, clock = None):
+        """
+        Args:
+            buzzer: Object with the gpiozero Buzzer interface (beep, off, is_active) used instead of the buzzer and button
+                on the GPIO pins, e.g. by replay_currents.py. Default is None.
+            clock: Function returning the current time in seconds, e.g. a simulated clock. Default is time.time.
+        """
         self.logger = logging.getLogger(__name__) # create logger
-        
-        self.buzzer = Buzzer(buzzerPin) # set up buzzer
-        self.button = Button(buttonPin, hold_time=3) # set up button
-        self.button.when_pressed = self.silence_all_alarms
-        self.button.when_held = self.test_buzzer
+        self.clock = clock or time.time
+
+        if buzzer is None:
+            from gpiozero import Buzzer, Button # type: ignore
+            buzzer = Buzzer(buzzerPin) # set up buzzer
+            self.button = Button(buttonPin, hold_time=3) # set up button
+            self.button.when_pressed = self.silence_all_alarms
+            self.button.when_held = self.test_buzzer
+        self.buzzer = buzzer
 
         self.active_alarms = {}    # dictionary to keep track of sensors that are currently active
         self.silence_time = 30*60 # seconds to keep sensor silent after it has been silenced
 
         # prevent alarm during the first minute after initialization to prevent false alarms due to sensor initialization
         self.initialization_time = 1*60
-        self.initialization_start = time.time()
+        self.initialization_start = self.clock()
         self.logger.info("AlarmBuzzer initialized")
 
     def test_buzzer(self):
@@ -34,7 +59,7 @@ class AlarmBuzzer:
         self.buzzer.beep(on_time=1, off_time=1, n=1, background=True)   # beep once to indicate that all active alarms have been silenced
         # set all time values in dict to current time meaning all currently active sensors will be turned off for X seconds
         for key in self.active_alarms:
-            self.active_alarms[key] = time.time()
+            self.active_alarms[key] = self.clock()
             self.logger.info("Sensor " + str(key) + " has been turned off for " + str(self.silence_time) + " seconds")
 
     def check_value(self, value, valueThreshold, sensorId):
@@ -51,19 +76,20 @@ class AlarmBuzzer:
             return
         
         if value > valueThreshold:
-            if time.time() - self.initialization_start < self.initialization_time:
+            now = self.clock()
+            if now - self.initialization_start < self.initialization_time:
                 self.logger.debug("AlarmBuzzer: Preventing alarm during initialization")
                 return
             
             self.logger.info("Alarm for sensor " + str(sensorId))
 
             # check dictonary value for sensorId and if it is there then check if it is within self.SensorSilenceTime seconds
-            if sensorId in self.active_alarms and time.time() - self.active_alarms[sensorId] < self.silence_time:
+            if sensorId in self.active_alarms and now - self.active_alarms[sensorId] < self.silence_time:
                 self.logger.debug("Sensor " + str(sensorId) + " has already started buzz within " + str(self.silence_time) + " seconds")
                 return
             
             # add sensorId to dict with current time
-            self.active_alarms[sensorId] = time.time()
+            self.active_alarms[sensorId] = now
             self.logger.info("Sensor " + str(sensorId) + " has active alarm")
 
             # start buzz on separate thread unless it is already started
@@ -80,3 +106,20 @@ class AlarmBuzzer:
                 if len(self.active_alarms) == 0:
                     self.buzzer.off()
                     self.logger.info("Buzzer has been turned off since no alarm is active")
+
+    def get_state(self):
+        """
+        Returns the active (and silenced) alarms and whether the buzzer is on as a JSON serializable dict, for a warm restart.
+        """
+        return {'active_alarms': dict(self.active_alarms), 'buzzing': bool(self.buzzer.is_active)}
+
+    def restore_state(self, state):
+        """
+        Restores the alarms of a recent snapshot. The restored sensor values are valid, so there is no initialization
+        time without alarms, and the buzzer is turned back on if it was on, while silenced alarms stay silent.
+        """
+        self.active_alarms.update(state['active_alarms'])
+        self.initialization_start = self.clock() - self.initialization_time
+        self.logger.info(f"Restored {len(state['active_alarms'])} active alarms")
+        if state['buzzing'] and self.active_alarms and not self.buzzer.is_active:
+            self.buzzer.beep(on_time=.25, off_time=.25, n=None, background=True)
@@ -0,0 +1,324 @@
+from collections import deque
+import itertools
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+
+class FsyncPolicy:
+    """
+    When the log files are fsync'ed after a write, so the written rows survive a power cut:
+      - 'never': leave it to the operating system (on Linux typically within 30 seconds).
+      - 'flush': after every write of the background writer.
+      - a number: after a write when the last fsync is at least that many seconds ago.
+    """
+
+    def __init__(self, policy='never'):
+        if policy in ('never', 'flush'):
+            self.interval = None if policy == 'never' else 0.0
+        else:
+            try:
+                self.interval = float(policy)
+            except (TypeError, ValueError):
+                raise ValueError(f"Unknown fsync policy {policy}, expected 'never', 'flush' or a number of seconds") from None
+        self.policy = policy
+        self.last_sync = None
+
+    def due(self) -> bool:
+        """
+        Returns True if the files written now should be fsync'ed.
+        """
+        if self.interval is None:
+            return False
+        now = time.monotonic()
+        if self.last_sync is not None and now - self.last_sync < self.interval:
+            return False
+        self.last_sync = now
+        return True
+
+    @staticmethod
+    def sync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+class Journal:
+    """
+    Crash recovery journal of a BackgroundWriter. The queued rows are appended to the journal (and fsync'ed) every
+    interval seconds, and the journal is cleared when the rows have been written, so the write must also fsync them. After a crash or power cut the logger
+    recovers the rows from the journal at the next start, so at most `interval` seconds of rows are lost instead of up
+    to a whole flush interval. A row can be written twice when the process stops between a write and clearing the journal.
+    The BackgroundWriter rewrites the journal with its queue when it would grow beyond the queue's row budget (e.g. while
+    the writes keep failing), so the journal is bounded like the queue and drops the same rows.
+
+    Each frame is a length prefixed pickle of (epoch offset in ns, rows), the epoch offset being time.time_ns() minus
+    time.monotonic_ns() when the frame was written, for rows with monotonic timestamps.
+    """
+    FRAME_HEADER = struct.Struct('<I')
+
+    def __init__(self, path: str, interval: float):
+        """
+        Args:
+            path (str): Journal file.
+            interval (float): Seconds between appends to the journal.
+        """
+        self.path = path
+        self.interval = interval
+        self.rows = 0   # rows appended since the journal was last cleared or rewritten
+
+    def _frame(self, rows):
+        data = pickle.dumps((time.time_ns() - time.monotonic_ns(), rows), protocol=pickle.HIGHEST_PROTOCOL)
+        return self.FRAME_HEADER.pack(len(data)) + data
+
+    def append(self, rows):
+        with open(self.path, 'ab') as f:
+            f.write(self._frame(rows))
+            FsyncPolicy.sync(f)
+        self.rows += len(rows)
+
+    def rewrite(self, rows):
+        """
+        Atomically replaces the journal with the rows, or clears it when there are none.
+        """
+        if not rows:
+            self.clear()
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._frame(rows))
+            FsyncPolicy.sync(f)
+        os.replace(tmp_path, self.path)
+        self.rows = len(rows)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.rows = 0
+
+    def recover(self):
+        """
+        Returns the frames in the journal as a list of (epoch offset in ns, rows), leaving out a partially written last frame.
+        """
+        frames = []
+        try:
+            with open(self.path, 'rb') as f:
+                while True:
+                    header = f.read(self.FRAME_HEADER.size)
+                    if len(header) < self.FRAME_HEADER.size:
+                        break
+                    data = f.read(self.FRAME_HEADER.unpack(header)[0])
+                    try:
+                        frames.append(pickle.loads(data))
+                    except Exception:
+                        break   # torn write at the crash
+        except FileNotFoundError:
+            pass
+        return frames
+
+class BackgroundWriter:
+    """
+    Writes buffered rows to storage from a dedicated thread, so the thread producing the rows never waits for file I/O.
+
+    Rows are queued with put() and handed to the write function in one batch every flush interval. The queue is bounded:
+    when it is full (e.g. because the file system keeps failing) rows are dropped according to the overflow policy
+    and counted, instead of letting the buffer grow without limit:
+      - 'drop_oldest': the oldest queued row is dropped for every new row.
+      - 'downsample': every other queued row is dropped, so the queue still covers the whole period at half the resolution.
+    Rows of a failed write are put back in front of the queue and retried at the next flush.
+    The queue can also be bounded by a memory budget (max_bytes) given the estimated memory of one queued row (row_size).
+    With a Journal the queued rows are also appended to a crash recovery journal every journal interval, and the rows
+    recovered from the journal are queued (and journaled again) before the writer thread starts.
+    """
+    OVERFLOW_POLICIES = ('drop_oldest', 'downsample')
+    DEFAULT_OVERFLOW_POLICY = 'drop_oldest'
+    DEFAULT_MAX_PENDING = 36000  # rows, one hour at 10 samples per second
+
+    def __init__(self, write, flush_interval: float, max_pending: int = None, overflow_policy: str = None, name: str = 'BackgroundWriter',
+                 max_bytes: int = None, row_size: int = None, journal: Journal = None, recovered: list = None):
+        """
+        Args:
+            write (callable): Called from the writer thread with a list of rows to write. Raises on failure.
+            flush_interval (float): Seconds between writes.
+            max_pending (int): Maximum number of queued rows. Default is 36000.
+            overflow_policy (str): 'drop_oldest' or 'downsample'. Default is 'drop_oldest'.
+            name (str): Name of the writer thread.
+            max_bytes (int): Memory budget of the queue in bytes, lowers max_pending to max_bytes / row_size. Default is None.
+            row_size (int): Estimated memory of one queued row in bytes, required with max_bytes.
+            journal (Journal): Crash recovery journal, cleared after every successful write, so write must fsync the rows.
+                Default is None.
+            recovered (list): Rows recovered from the journal, queued first. The journal is rewritten with them. Default is None.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.overflow_policy = overflow_policy if overflow_policy is not None else self.DEFAULT_OVERFLOW_POLICY
+        if self.overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {self.overflow_policy}, expected one of {list(self.OVERFLOW_POLICIES)}")
+        self.write = write
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending if max_pending is not None else self.DEFAULT_MAX_PENDING
+        if max_bytes is not None:
+            self.max_pending = max(1, min(self.max_pending, max_bytes // row_size))
+        self.journal = journal
+        self.pending = deque(recovered or ())
+        self.journaled = 0          # number of rows at the front of the queue that are in the journal
+        self.condition = threading.Condition()
+        self.flush_requested = 0    # generation of the last flush() request
+        self.flushed = 0            # generation of the last completed write pass
+        self.closing = False
+        # Metrics
+        self.written_rows = 0
+        self.dropped_rows = 0
+        self.write_errors = 0
+        self.journal_errors = 0
+        self.max_write_time = 0.0   # seconds
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        if len(self.pending) > self.max_pending:
+            self._trim()
+        if self.journal is not None:
+            # replaces the journal they were recovered from, so they survive another crash before the next write
+            self._append_journal(list(self.pending), rewrite=True)
+            self.journaled = len(self.pending)
+        self.thread.start()
+
+    def put(self, row):
+        with self.condition:
+            self.pending.append(row)
+            if len(self.pending) > self.max_pending:
+                self._trim()
+
+    def _trim(self):
+        # called with the condition held
+        before = len(self.pending)
+        if self.overflow_policy == 'drop_oldest':
+            while len(self.pending) > self.max_pending:
+                self.pending.popleft()
+        else:
+            while len(self.pending) > self.max_pending:
+                self.pending = deque(list(self.pending)[::2])
+        previous = self.dropped_rows
+        self.dropped_rows += before - len(self.pending)
+        # the dropped rows stay in the journal until the next write, only the count of journaled rows in the queue changes
+        if self.overflow_policy == 'drop_oldest':
+            self.journaled = max(0, self.journaled - (before - len(self.pending)))
+        else:
+            self.journaled = min(self.journaled * len(self.pending) // before, len(self.pending))
+        # only warn at the first drop and then every time the count passes a power of two, to not flood the log
+        if previous.bit_length() != self.dropped_rows.bit_length():
+            self.logger.warning(f"Write queue of {self.thread.name} full, dropped {self.dropped_rows} rows ({self.overflow_policy})")
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            with self.condition:
+                timeout = next_flush - time.monotonic()
+                if self.journal is not None:
+                    timeout = min(timeout, self.journal.interval)
+                self.condition.wait_for(lambda: self.closing or self.flush_requested > self.flushed, timeout=max(timeout, 0))
+                now = time.monotonic()
+                generation = self.flush_requested
+                closing = self.closing
+                flush = closing or generation > self.flushed or now >= next_flush
+                if flush:
+                    rows = list(self.pending)
+                    unjournaled = len(rows) - self.journaled
+                    self.pending = deque()
+                    self.journaled = 0
+                else:
+                    # between writes only the new rows go to the journal, unless that would make it larger than the queue
+                    rows = list(itertools.islice(self.pending, self.journaled, None))
+                    rewrite = self.journal is not None and self.journal.rows + len(rows) > self.max_pending
+                    if rewrite:
+                        rows = list(self.pending)
+                    self.journaled = len(self.pending)
+            if not flush:
+                if self.journal is not None and (rows or rewrite):
+                    self._append_journal(rows, rewrite)
+                continue
+            next_flush = now + self.flush_interval
+            if rows:
+                self._write(rows, unjournaled)
+            with self.condition:
+                self.flushed = generation
+                self.condition.notify_all()
+            if closing:
+                break
+
+    def _write(self, rows, unjournaled):
+        start = time.monotonic()
+        try:
+            self.write(rows)
+        except Exception:
+            self.write_errors += 1
+            if self.write_errors & (self.write_errors - 1) == 0:
+                self.logger.exception(f"Failed to write {len(rows)} rows ({self.write_errors} failures), retrying at the next flush")
+            journal_rows, rewrite = None, False
+            with self.condition:
+                self.pending.extendleft(reversed(rows))
+                self.journaled = len(rows)
+                if len(self.pending) > self.max_pending:
+                    self._trim()
+                if self.journal is not None:
+                    if self.journal.rows + unjournaled > self.max_pending:
+                        # the journal would outgrow the queue, e.g. while /data is full: replace it with the trimmed queue
+                        journal_rows, rewrite = list(self.pending), True
+                        self.journaled = len(self.pending)
+                    elif unjournaled:
+                        journal_rows = rows[-unjournaled:]
+            if journal_rows is not None:
+                self._append_journal(journal_rows, rewrite)
+            return
+        self.written_rows += len(rows)
+        self.max_write_time = max(self.max_write_time, time.monotonic() - start)
+        if self.journal is not None:
+            try:
+                self.journal.clear()
+            except OSError:
+                self._journal_failed()
+
+    def _append_journal(self, rows, rewrite=False):
+        try:
+            if rewrite:
+                self.journal.rewrite(rows)
+            else:
+                self.journal.append(rows)
+        except OSError:
+            self._journal_failed()
+
+    def _journal_failed(self):
+        self.journal_errors += 1
+        if self.journal_errors & (self.journal_errors - 1) == 0:
+            self.logger.exception(f"Failed to update the journal {self.journal.path} ({self.journal_errors} failures)")
+
+    def flush(self, timeout: float = None):
+        """
+        Writes all queued rows now and waits until they are written (or failed).
+        """
+        with self.condition:
+            if not self.thread.is_alive():
+                return
+            self.flush_requested += 1
+            generation = self.flush_requested
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self.flushed >= generation or not self.thread.is_alive(), timeout=timeout)
+
+    def close(self, timeout: float = None):
+        """
+        Writes all queued rows and stops the writer thread.
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def get_metrics(self) -> dict:
+        return {
+            'pending_rows': len(self.pending),
+            'written_rows': self.written_rows,
+            'dropped_rows': self.dropped_rows,
+            'write_errors': self.write_errors,
+            'journal_errors': self.journal_errors,
+            'max_write_time': self.max_write_time,
+        }
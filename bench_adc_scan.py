@@ -0,0 +1,47 @@
+from ads1115 import ADS1115, ADS1115Scanner
+import sys
+import time
+
+# Compares the achieved samples/s per channel of the Adafruit AnalogIn.voltage reads (as used before)
+# with the batched lgpio ADS1115Scanner, on the same bus, ADC and channels as DcCurrents uses by default.
+# Run on the device with the service stopped: python bench_adc_scan.py [seconds per run]
+
+CHANNELS = [1, 2, 3]
+DATA_RATE = 128
+
+def bench_analog_in(duration):
+    import board
+    import busio
+    import adafruit_ads1x15.ads1115 as ADS # type: ignore
+    from adafruit_ads1x15.analog_in import AnalogIn # type: ignore
+    ads = ADS.ADS1115(busio.I2C(board.SCL, board.SDA), gain=2/3, data_rate=DATA_RATE)
+    inputs = [AnalogIn(ads, getattr(ADS, 'P' + str(i))) for i in CHANNELS]
+    scans = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for analog_in in inputs:
+            analog_in.voltage
+        scans += 1
+    return scans / (time.perf_counter() - start)
+
+def bench_scanner(duration):
+    scanner = ADS1115Scanner([ADS1115(gain=2/3, data_rate=DATA_RATE)], {ADS1115.DEFAULT_ADDRESS: CHANNELS})
+    scanner.open()
+    try:
+        scans = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            scanner.scan()
+            scans += 1
+        return scans / (time.perf_counter() - start)
+    finally:
+        scanner.close()
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for name, bench in [("AnalogIn.voltage", bench_analog_in), ("ADS1115Scanner", bench_scanner)]:
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        rate = bench(duration)
+        cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 100
+        print(f"{name:18s}: {rate:7.1f} samples/s per channel ({len(CHANNELS)} channels, {DATA_RATE} SPS), {cpu:5.1f}% CPU")
@@ -0,0 +1,55 @@
+from dc_currents import DcCurrents
+from gi.repository import GLib # type: ignore
+from dbus.mainloop.glib import DBusGMainLoop # type: ignore
+import inspect
+import sys
+import time
+
+# Measures how late the GLib main loop runs its timer ticks (like the 1 s tick of monitor.update_current_services) while
+# the acquisition threads are running, including sample log and rollup flushes, plus the longest time the acquisition
+# threads held the lock to publish (max_publish_time), i.e. the worst case wait of a consumer that takes the lock.
+# The main loop also dispatches the battery signals, so the samples are logged as on the device.
+# Only get_latest_smoothed_values() and the constructor arguments of the baseline are relied on; the newer arguments and
+# metrics are used when DcCurrents has them, so the same script runs on the baseline and on this commit. Run on the device
+# with the service stopped, on both commits to compare:
+#   python bench_main_loop_wait.py [seconds] [flush interval]
+TICK = 0.1  # seconds, far more often than the 1 s tick to catch the worst case
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 120
+    flush_interval = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    DBusGMainLoop(set_as_default=True)
+    mainloop = GLib.MainLoop()
+    kwargs = {'log_abs_path': '/tmp/bench_main_loop_wait/dc_currents', 'flush_interval': flush_interval}
+    if 'rollup_path' in inspect.signature(DcCurrents).parameters:
+        kwargs['rollup_path'] = '/tmp/bench_main_loop_wait/rollups'
+    dc_currents = DcCurrents(**kwargs)
+    dc_currents.start_background_thread()
+    lateness = []
+    read_times = []  # seconds per get_latest_smoothed_values() call, including any wait for the lock
+    due = time.monotonic() + TICK
+
+    def tick():
+        global due
+        lateness.append(time.monotonic() - due)
+        start = time.perf_counter()
+        dc_currents.get_latest_smoothed_values()
+        read_times.append(time.perf_counter() - start)
+        due += TICK
+        GLib.timeout_add(max(0, int((due - time.monotonic()) * 1000)), tick)
+        return False    # one-shot, the next tick is added above
+
+    GLib.timeout_add(int(TICK * 1000), tick)
+    GLib.timeout_add(int(duration * 1000), mainloop.quit)
+    try:
+        mainloop.run()
+    finally:
+        dc_currents.shutdown()
+    for name, values in (('ticks late', lateness), ('get_latest_smoothed_values', read_times)):
+        values.sort()
+        print(f"{len(values)} {name}: median {values[len(values) // 2] * 1e3:.2f} ms, "
+              f"p99 {values[int(len(values) * 0.99)] * 1e3:.2f} ms, worst {values[-1] * 1e3:.2f} ms")
+    if hasattr(dc_currents, 'max_publish_time'):
+        print(f"max_publish_time: {dc_currents.max_publish_time * 1e6:.1f} us")
+    if hasattr(dc_currents, 'get_diagnostics'):
+        print(f"Diagnostics: {dc_currents.get_diagnostics()}")
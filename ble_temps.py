@@ -127,6 +127,23 @@ class BLETemps:
         with self.Lock:
             self.values[device.name] = sensor_data
 
+    def get_state(self):
+        """
+        Returns the last advertisement of each device as a JSON serializable dict, for a warm restart.
+        """
+        with self.Lock:
+            return {name: {'battery': v.battery, 'temperature': v.temperature, 'humidity': v.humidity, 'timestamp': v.timestamp.timestamp()}
+                    for name, v in self.values.items() if v is not None}
+
+    def restore_state(self, state):
+        """
+        Restores the last advertisements with their original timestamps, so they still expire 5 minutes after they were received.
+        """
+        with self.Lock:
+            for name, v in state.items():
+                self.values.setdefault(name, TempSensorData(id=name, connection='BLE', battery=v['battery'], temperature=v['temperature'],
+                                                            humidity=v['humidity'], timestamp=datetime.fromtimestamp(v['timestamp'])))
+
     def get_values(self):
         with self.Lock:
             # remove values older than 5 minutes before returning
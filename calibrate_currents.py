@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+Offline calibration of the per-channel gain (A/V) and offset (A) of the DC current sensors.
+
+Streams the dc_currents_YYYYMMDD.csv day files written by CSVLogger (or the binary files written by BinaryLogger) in chunks and fits, by linear least squares, the gain and
+offset of every channel so that the channel currents (gain * ADS1115 voltage + offset) sum up to the battery shunt current.
+Only the normal equations (a few numbers per channel) are kept in memory, so months of 10 Hz logs can be processed.
+
+The sum constraint alone can only determine the sum of the offsets, so the fit is regularized towards the current calibration:
+of all solutions that explain the data equally well, the one closest to the current gains and offsets is chosen.
+
+The result is written as a JSON settings file that DcCurrents loads at start-up:
+    python calibrate_currents.py /data/VenusOS-SensorMonitor/logs/dc_currents
+"""
+import argparse
+import csv
+import glob
+import itertools
+import json
+import logging
+import os
+import re
+from datetime import datetime
+try:
+    import numpy as np
+except ImportError:  # only needed for the fit, not by DcCurrents to load the calibration on the device
+    np = None
+import BinaryLogger
+from deadband import log_settings
+from log_archive import open_log, base_name
+
+# Same defaults as DcCurrents, which is not imported so the fitter can also run off the device
+DEFAULT_CALIBRATION_PATH = '/data/VenusOS-SensorMonitor/calibration.json'
+DEFAULT_LOG_PATH = '/data/VenusOS-SensorMonitor/logs/dc_currents'
+DEFAULT_AMP_PER_VOLTAGE = 22
+DEFAULT_OFFSETS = {1: 1.453, 2: -0.847, 3: 0.008}
+DEFAULT_CHUNK_SIZE = 100000  # rows per chunk
+DEFAULT_RIDGE = 1e-6  # regularization towards the prior calibration, relative to the number of samples
+ERROR_VALUE = -999
+
+logger = logging.getLogger(__name__)
+
+class NormalEquations:
+    """
+    Accumulates X'X and X'y of the least squares problem  current = sum_k(gain_k * v_k + offset_k)  chunk by chunk.
+    The parameter vector is [gain_1 .. gain_n, offset_1 .. offset_n].
+    """
+
+    def __init__(self, channels):
+        self.channels = channels
+        n = 2 * len(channels)
+        self.xtx = np.zeros((n, n))
+        self.xty = np.zeros(n)
+        self.yty = 0.0
+        self.count = 0
+
+    def add(self, voltages, currents):
+        """
+        Args:
+            voltages (ndarray): rows x channels ADS1115 voltages.
+            currents (ndarray): rows shunt currents.
+        """
+        x = np.hstack([voltages, np.ones_like(voltages)])
+        self.xtx += x.T @ x
+        self.xty += x.T @ currents
+        self.yty += currents @ currents
+        self.count += len(currents)
+
+    def solve(self, prior, ridge=DEFAULT_RIDGE):
+        """
+        Solves for the parameters closest to the prior parameters (ridge regression on the deviation from the prior).
+
+        Returns:
+            tuple: (parameters, rms error in A)
+        """
+        lam = ridge * max(self.count, 1)
+        # minimize |y - X(prior + d)|^2 + lam |d|^2  =>  (X'X + lam I) d = X'y - X'X prior
+        delta = np.linalg.solve(self.xtx + lam * np.eye(len(prior)), self.xty - self.xtx @ prior)
+        params = prior + delta
+        sse = self.yty - 2 * params @ self.xty + params @ self.xtx @ params
+        rms = float(np.sqrt(max(sse, 0.0) / max(self.count, 1)))
+        return params, rms
+
+def read_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields (channels, voltages, currents) numpy chunks of the rows in one (compressed) CSV or binary log file where every channel was read.
+    """
+    if base_name(path).endswith('.bin'):
+        yield from read_binary_chunks(path, chunk_size)
+        return
+    with open_log(path, 'rt', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        channels = [int(m.group(1)) for m in (re.fullmatch(r'b(\d+)_voltage', h) for h in header) if m]
+        columns = [header.index('current')] + [header.index(f'b{c}_voltage') for c in channels]
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if not rows:
+                break
+            data = np.array([[row[c] for c in columns] for row in rows], dtype=float)
+            valid = np.all(data != ERROR_VALUE, axis=1)
+            data = data[valid]
+            if len(data):
+                yield channels, data[:, 1:], data[:, 0]
+
+def read_binary_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    records, _ = BinaryLogger.open_memmap(path)
+    names = records.dtype.names
+    channels = [int(m.group(1)) for m in (re.fullmatch(r'b(\d+)_voltage', n) for n in names) if m]
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        data = np.column_stack([chunk['current']] + [chunk[f'b{c}_voltage'] for c in channels]).astype(float)
+        data = data[np.all(data != ERROR_VALUE, axis=1)]
+        if len(data):
+            yield channels, data[:, 1:], data[:, 0]
+
+def fit(paths, prior_gains, prior_offsets, chunk_size=DEFAULT_CHUNK_SIZE, ridge=DEFAULT_RIDGE):
+    """
+    Fits per-channel gains and offsets over all rows of the given CSV day files.
+
+    Args:
+        paths (list): CSV or binary log files.
+        prior_gains (dict): Channel id -> current gain (A/V).
+        prior_offsets (dict): Channel id -> current offset (A).
+
+    Returns:
+        dict: The calibration settings, or None if the files contain no usable rows.
+
+    Raises:
+        ValueError: A file was logged with change-only compression (log_deadband), which would under-weight the steady periods.
+    """
+    compressed = [path for path in paths if log_settings(path)]
+    if compressed:
+        raise ValueError(f"{len(compressed)} files were logged with log_deadband (change points only, e.g. {compressed[0]}): "
+                         f"the fit needs every sample. Select other days, or log with log_deadband off")
+    equations = None
+    for path in paths:
+        logger.info(f"Reading {path}")
+        for channels, voltages, currents in read_chunks(path, chunk_size):
+            if equations is None:
+                equations = NormalEquations(channels)
+            elif channels != equations.channels:
+                logger.warning(f"Skipping {path}: channels {channels} differ from {equations.channels}")
+                break
+            equations.add(voltages, currents)
+    if equations is None or equations.count == 0:
+        return None
+
+    channels = equations.channels
+    prior = np.array([prior_gains.get(c, 0.0) for c in channels] + [prior_offsets.get(c, 0.0) for c in channels])
+    params, rms = equations.solve(prior, ridge)
+    n = len(channels)
+    return {
+        'amp_per_voltage': {str(c): round(float(params[k]), 6) for k, c in enumerate(channels)},
+        'offsets': {str(c): round(float(params[n + k]), 6) for k, c in enumerate(channels)},
+        'samples': equations.count,
+        'rms_error': round(rms, 4),
+        'created': datetime.now().isoformat(timespec='seconds'),
+    }
+
+def load_calibration(path=DEFAULT_CALIBRATION_PATH):
+    """
+    Returns the per-channel gains and offsets from a calibration file as ({channel: gain}, {channel: offset}),
+    or (None, None) if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None, None
+    with open(path) as f:
+        settings = json.load(f)
+    gains = {int(c): float(v) for c, v in settings.get('amp_per_voltage', {}).items()}
+    offsets = {int(c): float(v) for c, v in settings.get('offsets', {}).items()}
+    return gains, offsets
+
+def save_calibration(settings, path=DEFAULT_CALIBRATION_PATH):
+    # write to a temporary file and rename, so DcCurrents never reads a half written file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(settings, f, indent=2)
+    os.replace(tmp_path, path)
+
+def log_files(directory, since=None, until=None):
+    """
+    Returns the CSV and binary day files in the directory, optionally limited to the days since/until (YYYYMMDD), in order.
+    The index sidecars of the CSV files are left out.
+    """
+    paths = []
+    for path in sorted(glob.glob(os.path.join(directory, 'dc_currents_*.csv*')) + glob.glob(os.path.join(directory, 'dc_currents_*.bin*'))):
+        if not base_name(path).endswith(('.csv', '.bin')):
+            continue
+        day = os.path.basename(path)[len('dc_currents_'):len('dc_currents_') + 8]
+        if (since and day < since) or (until and day > until):
+            continue
+        paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit per-channel gain and offset of the DC current sensors from CSV logs")
+    parser.add_argument('log_dir', nargs='?', default=DEFAULT_LOG_PATH, help="directory with dc_currents_YYYYMMDD*.csv/.bin(.gz/.xz) files")
+    parser.add_argument('--since', help="first day to use, YYYYMMDD")
+    parser.add_argument('--until', help="last day to use, YYYYMMDD")
+    parser.add_argument('--output', default=DEFAULT_CALIBRATION_PATH, help="calibration file to write")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--ridge', type=float, default=DEFAULT_RIDGE, help="regularization towards the current calibration")
+    parser.add_argument('--dry-run', action='store_true', help="print the result instead of writing it")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(name)-8s %(levelname)s: %(message)s")
+
+    paths = log_files(args.log_dir, args.since, args.until)
+
+    prior_gains, prior_offsets = load_calibration(args.output)
+    if prior_gains is None:
+        prior_gains = {c: DEFAULT_AMP_PER_VOLTAGE for c in DEFAULT_OFFSETS}
+        prior_offsets = DEFAULT_OFFSETS
+    try:
+        settings = fit(paths, prior_gains, prior_offsets, args.chunk_size, args.ridge)
+    except ValueError as e:
+        logger.error(e)
+        return 1
+    if settings is None:
+        logger.error(f"No usable samples found in {len(paths)} files in {args.log_dir}")
+        return 1
+    print(json.dumps(settings, indent=2))
+    if not args.dry_run:
+        save_calibration(settings, args.output)
+        logger.info(f"Calibration written to {args.output}, restart the service to apply it")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,34 +1,130 @@
 import os
 import sys
+import time
+import logging
+import threading
 import dbus
+from dbus.mainloop.glib import DBusGMainLoop # type: ignore
+from gi.repository import GLib # type: ignore
 # import victron package for updating dbus (using lib from built in service)
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), '/opt/victronenergy/dbus-modem'))
 from vedbus import VeDbusItemImport
 
-# Connect to the sessionbus. Note that on ccgx we use systembus instead.
-dbusConn = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
-
 class DbusBatteryReader:
-    def __init__(self, service_name="com.victronenergy.battery.ttyUSB1"):
+    """
+    Keeps the latest battery voltage and current of a battery service on dbus.
+
+    The values are updated from the PropertiesChanged and ItemsChanged signals of the battery service (dispatched by the
+    GLib main loop) and cached together with the time they were received, so get_batt_voltage_current() never blocks on dbus.
+    Venus only signals a value when it changes, so a cached value stays valid as long as the battery service is on the bus;
+    max_age seconds after the service left the bus (NameOwnerChanged) the values are unavailable. A value without a signal
+    for max_age seconds is refreshed with an asynchronous GetValue on the main loop. Without a running main loop (e.g.
+    test_dc_currents.py) the cache is not refreshed and keeps the last values.
+    """
+    VOLTAGE_PATH = "/Dc/0/Voltage"
+    CURRENT_PATH = "/Dc/0/Current"
+    DEFAULT_MAX_AGE = 10  # seconds
+
+    def __init__(self, service_name="com.victronenergy.battery.ttyUSB1", max_age: float = None):
+        self.logger = logging.getLogger(__name__)
         self.service_name = service_name
-        dbusConn = dbus.SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.SystemBus()
+        self.max_age = max_age if max_age is not None else self.DEFAULT_MAX_AGE
+        self.lock = threading.Lock()
+        self.values = {}    # path -> (value, time.monotonic() when received)
+        self.service_lost = None    # time.monotonic() the service left the bus, None while it is on the bus
+        self.refresh_pending = False    # a refresh is queued on the main loop
+        self.last_refresh = 0.0         # time.monotonic() the last refresh was queued
+
+        # Use a private connection attached to the GLib main loop, so signals are dispatched even though
+        # the reader is created before monitor.py sets the default main loop
+        busType = dbus.bus.BusConnection.TYPE_SESSION if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else dbus.bus.BusConnection.TYPE_SYSTEM
+        self.dbusConn = dbus.bus.BusConnection(busType, mainloop=DBusGMainLoop())
 
         self.voltage_item = VeDbusItemImport(
-            bus=dbusConn,
+            bus=self.dbusConn,
             serviceName=self.service_name,
-            path="/Dc/0/Voltage",
-            eventCallback=None,
-            createsignal=False
+            path=self.VOLTAGE_PATH,
+            eventCallback=self._handle_value_changed,
+            createsignal=True
         )
         self.current_item = VeDbusItemImport(
-            bus=dbusConn,
+            bus=self.dbusConn,
             serviceName=self.service_name,
-            path="/Dc/0/Current",
-            eventCallback=None,
-            createsignal=False
+            path=self.CURRENT_PATH,
+            eventCallback=self._handle_value_changed,
+            createsignal=True
         )
+        # Venus services also (and newer ones only) send the changes of all paths in one ItemsChanged signal on the root
+        self.dbusConn.add_signal_receiver(self._handle_items_changed,
+            dbus_interface='com.victronenergy.BusItem', signal_name='ItemsChanged', path='/', bus_name=self.service_name)
+        self.dbusConn.add_signal_receiver(self._handle_name_owner_changed,
+            dbus_interface='org.freedesktop.DBus', signal_name='NameOwnerChanged', arg0=self.service_name)
+        self.proxies = {path: self.dbusConn.get_object(self.service_name, path, introspect=False)
+                        for path in (self.VOLTAGE_PATH, self.CURRENT_PATH)}
+
+        # Seed the cache with the values read when the items were imported
+        self._store(self.VOLTAGE_PATH, self.voltage_item.get_value())
+        self._store(self.CURRENT_PATH, self.current_item.get_value())
+
+    def _handle_value_changed(self, serviceName, path, changes):
+        self._store(path, changes.get('Value'))
+
+    def _handle_items_changed(self, items):
+        for path in (self.VOLTAGE_PATH, self.CURRENT_PATH):
+            if path in items:
+                self._store(path, items[path].get('Value'))
+
+    def _handle_name_owner_changed(self, name, old_owner, new_owner):
+        if new_owner:
+            self.logger.info(f"Battery service {name} is on the bus")
+            with self.lock:
+                self.service_lost = None
+            self._refresh()
+        else:
+            self.logger.warning(f"Battery service {name} left the bus")
+            with self.lock:
+                self.service_lost = time.monotonic()
+
+    def _refresh(self):
+        # on the main loop: asynchronously read the values, the replies are dispatched by the main loop as well
+        self.refresh_pending = False
+        for path, proxy in self.proxies.items():
+            proxy.GetValue(dbus_interface='com.victronenergy.BusItem',
+                           reply_handler=lambda value, path=path: self._store(path, value),
+                           error_handler=self._handle_refresh_error)
+        return False    # one-shot idle callback
+
+    def _handle_refresh_error(self, error):
+        if error.get_dbus_name() == 'org.freedesktop.DBus.Error.ServiceUnknown':
+            with self.lock:
+                if self.service_lost is None:
+                    self.service_lost = time.monotonic()
+        else:
+            self.logger.debug(f"Failed to refresh the battery values: {error}")
+
+    def _store(self, path, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = None    # invalid values are sent as an empty array
+        with self.lock:
+            self.values[path] = (value, time.monotonic())
+
+    def _get(self, path, now):
+        if self.service_lost is not None and now - self.service_lost > self.max_age:
+            return None
+        value, received = self.values.get(path, (None, 0))
+        if now - received > self.max_age and now - self.last_refresh > self.max_age and not self.refresh_pending:
+            self.refresh_pending = True
+            self.last_refresh = now
+            GLib.idle_add(self._refresh)
+        return value
 
     def get_batt_voltage_current(self):
-        voltage = self.voltage_item.get_value()
-        current = self.current_item.get_value()
-        return float(voltage), float(current)
+        """
+        Returns the cached battery voltage and current. Either is None if it is invalid, or if the battery service left
+        the bus more than max_age seconds ago.
+        """
+        now = time.monotonic()
+        with self.lock:
+            return self._get(self.VOLTAGE_PATH, now), self._get(self.CURRENT_PATH, now)
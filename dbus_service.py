@@ -1,6 +1,7 @@
 import logging
 import sys
 import os
+import time
 import traceback
 import dbus # type: ignore
 # import victron package for updating dbus (using lib from built in service)
@@ -24,9 +25,57 @@ class SessionBus(dbus.bus.BusConnection):
     def __new__(cls):
         return dbus.bus.BusConnection.__new__(cls, dbus.bus.BusConnection.TYPE_SESSION)
 
+class CustomNameIndex:
+    """
+    CustomName -> services with that name, kept current by the services when they are renamed (from the GUI or in the
+    settings), so a service can be found by its name without reading the settings of every service.
+    """
+
+    def __init__(self):
+        self.services = {}  # CustomName -> list of services, in the order they got the name
+        self.names = {}     # service -> CustomName
+
+    def update(self, service, name):
+        old = self.names.get(service)
+        if old == name:
+            return
+        if old is not None:
+            self.services[old].remove(service)
+            if not self.services[old]:
+                del self.services[old]
+        self.names[service] = name
+        self.services.setdefault(name, []).append(service)
+
+    def get(self, name):
+        """
+        Returns the first service with the CustomName, or None.
+        """
+        services = self.services.get(name)
+        return services[0] if services else None
+
 class DbusService:
-    def __init__(self, type, connection, id, deviceInstance):
+    """
+    Base class of the dbus services. The measured values are published with _publish(), which skips writes of values that
+    moved less than the deadband of their path (every write emits a PropertiesChanged signal that the GUI, systemcalc and
+    the MQTT bridge wake up for), unless the last write is more than `heartbeat` seconds ago. Changes to and from None
+    (disconnected) are always written.
+    """
+    DEADBANDS = {}  # path -> deadband in the unit of the path, paths that are not listed are written on every update
+    DEFAULT_HEARTBEAT = 60  # seconds, maximum time between writes of a path with a deadband
+
+    def __init__(self, type, connection, id, deviceInstance, deadbands=None, heartbeat=None, name_index=None):
+        """
+        Args:
+            deadbands (dict): Path -> deadband, overrides DEADBANDS of the service class. Default is None.
+            heartbeat (float): Maximum seconds between writes of a path with a deadband. Default is 60.
+            name_index (CustomNameIndex): Index to keep the CustomName of this service in. Default is None.
+        """
         self.logger = logging.getLogger(__name__) # create logger
+        self.deadbands = {**self.DEADBANDS, **(deadbands or {})}
+        self.heartbeat = heartbeat if heartbeat is not None else self.DEFAULT_HEARTBEAT
+        self.published = {}  # path -> (value, time.monotonic()) of the last write of paths with a deadband
+        self.suppressed_writes = 0
+        self.name_index = name_index
         self.type = type
         self.name = f'{connection}_{id}'
         self.servicename = f'com.victronenergy.{type}.{self.name}'
@@ -74,6 +123,11 @@ class DbusService:
             value = self.settings[settingName]
             self.logger.debug(f"Setting {settingName} to {self.settings[settingName]}")
             self.dbusservice['/' + settingName] = value
+        self._update_name_index()
+
+    def _update_name_index(self, name=None):
+        if self.name_index is not None and 'CustomName' in self.supportedSettings:
+            self.name_index.update(self, name if name is not None else self.settings['CustomName'])
 
     def _handle_value_changed(self, path, value):
         self.logger.info(f"Updated value of {path} to {value}")
@@ -82,14 +136,36 @@ class DbusService:
                 setting_name = path.replace('/', '')
                 self.settings[setting_name] = value
                 self.logger.debug(f"Updated setting {setting_name} to {value}")  
+                if setting_name == 'CustomName':
+                    self._update_name_index(value)  # now, the settings callback follows when localsettings has stored it
         except Exception as e:
             self.logger.exception(f"Failed to update setting {path} to {value}")
         return True # accept the change
     
     def _handle_setting_changed(self, setting, old, new):
         self.logger.info(f"Setting {setting} changed from {old} to {new}")
+        if setting == 'CustomName':
+            self._update_name_index(new)
         return True # accept the change
     
+    def _publish(self, path, value):
+        """
+        Writes the value to the path unless it is within the deadband of the last written value and the heartbeat has not expired.
+        """
+        deadband = self.deadbands.get(path)
+        if deadband is not None:
+            now = time.monotonic()
+            last = self.published.get(path)
+            if (last is not None and value is not None and last[0] is not None
+                    and abs(value - last[0]) <= deadband and now - last[1] < self.heartbeat):
+                self.suppressed_writes += 1
+                return
+            self.published[path] = (value, now)
+        self.dbusservice[path] = value
+
+    def get_metrics(self) -> dict:
+        return {'suppressed_writes': self.suppressed_writes}
+
     def dbusconnection(self):
         return SessionBus() if 'DBUS_SESSION_BUS_ADDRESS' in os.environ else SystemBus()
     
@@ -103,8 +179,14 @@ class DbusService:
             self.logger.info(f"Reconnecting service {self.servicename}")
     
 class TemperatureService(DbusService):
-    def __init__(self, connection, id, deviceInstance):
-        super().__init__('temperature', connection, id, deviceInstance)
+    DEADBANDS = {
+        '/Temperature': 0.2,    # 'C, the sensors resolve 0.1
+        '/Humidity': 1.0,       # %
+        '/Battery': 1.0,        # %
+    }
+
+    def __init__(self, connection, id, deviceInstance, deadbands=None, heartbeat=None, name_index=None):
+        super().__init__('temperature', connection, id, deviceInstance, deadbands, heartbeat, name_index)
 
         self.dbusservice.add_path('/Temperature', None, gettextcallback=TEMPERATURE_TEXT)
         self.dbusservice.add_path('/Humidity', None, gettextcallback=HUMIDITY_TEXT)
@@ -117,24 +199,29 @@ class TemperatureService(DbusService):
 
     def update(self, tempValue, humidityValue = None, batteryValue = None):
         super().update()
-        self.dbusservice['/Temperature'] = tempValue
+        self._publish('/Temperature', tempValue)
         self.logger.debug(f"Updated temperature to {tempValue}")
         
         if humidityValue is not None:
-            self.dbusservice['/Humidity'] = humidityValue
+            self._publish('/Humidity', humidityValue)
             self.logger.debug(f"Updated humidity to {humidityValue}")
         
         if batteryValue is not None:
-            self.dbusservice['/Battery'] = batteryValue
+            self._publish('/Battery', batteryValue)
             self.logger.debug(f"Updated battery to {batteryValue}")
 
     def disconnect(self):
-        self.dbusservice['/Temperature'] = None
+        self._publish('/Temperature', None)
         super().disconnect()
     
 class DCSourceService(DbusService):
-    def __init__(self, connection, id, deviceInstance):
-        super().__init__('dcsource', connection, id, deviceInstance)
+    DEADBANDS = {
+        '/Dc/0/Current': 0.5,       # A, shown in whole amps
+        '/Dc/0/Temperature': 0.2,   # 'C
+    }
+
+    def __init__(self, connection, id, deviceInstance, deadbands=None, heartbeat=None, name_index=None):
+        super().__init__('dcsource', connection, id, deviceInstance, deadbands, heartbeat, name_index)
         self.dbusservice.add_path('/CustomName', None, writeable=True, onchangecallback = self._handle_value_changed)
 
         # self._dbusservice.add_path("/Dc/0/Voltage", None, gettextcallback=VOLTAGE_TEXT)
@@ -154,15 +241,24 @@ class DCSourceService(DbusService):
         
     def update(self, current, temperature):
         super().update()
-        self.dbusservice['/Dc/0/Current'] = current
-        self.dbusservice['/Dc/0/Temperature'] = temperature
+        self._publish('/Dc/0/Current', current)
+        self._publish('/Dc/0/Temperature', temperature)
         if self.dbusservice['/History/MaximumCurrent'] < current:
             self.dbusservice['/History/MaximumCurrent'] = current
             self.logger.debug(f"Updated maximum current to {current}")
         
         self.logger.debug(f"Updated current to {current} and temperature to {temperature}")
 
+    def get_state(self):
+        return {'MaximumCurrent': self.dbusservice['/History/MaximumCurrent']}
+
+    def restore_state(self, state):
+        """
+        Restores the state returned by get_state() after a warm restart.
+        """
+        self.dbusservice['/History/MaximumCurrent'] = max(self.dbusservice['/History/MaximumCurrent'], state['MaximumCurrent'])
+
     def disconnect(self):
-        self.dbusservice['/Dc/0/Current'] = None
-        self.dbusservice['/Dc/0/Temperature'] = None
+        self._publish('/Dc/0/Current', None)
+        self._publish('/Dc/0/Temperature', None)
         super().disconnect()
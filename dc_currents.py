@@ -1,13 +1,13 @@
 from SmoothedCurrent import SmoothedCurrent
-import copy
-import board
-import busio
-# https://docs.circuitpython.org/projects/ads1x15/en/latest/index.html
-import adafruit_ads1x15.ads1115 as ADS # type: ignore
-from adafruit_ads1x15.analog_in import AnalogIn # type: ignore
+from types import MappingProxyType
 import logging
 import CSVLogger  # Assuming you have a CSVLogger class for logging to CSV
+import BinaryLogger
+import RollupLogger
+from deadband import DeadbandCompressor
 from dbus_battery_reader import DbusBatteryReader
+from adc_bus import AdcBus, AdcChannel
+from calibrate_currents import load_calibration
 import threading
 import time
 
@@ -15,176 +15,423 @@ class DcCurrents:
     DEFAULT_CHANNELS = [1, 2, 3] # Channels 0 is not used in current wiring
     DEFAULT_AMP_PER_VOLTAGE = 22  # theoretically 150A/5V=30A/V, but we use 22A/V since it turns out to be more accurate in practice
     DEFAULT_LOG_PATH = '/data/VenusOS-SensorMonitor/logs/dc_currents'
+    DEFAULT_CALIBRATION_PATH = '/data/VenusOS-SensorMonitor/calibration.json'  # written by calibrate_currents.py
     DEFAULT_FLUSH_INTERVAL = 60  # seconds
+    DEFAULT_LOG_FORMAT = 'csv'  # sample log backend, one of LOG_FORMATS
+    DEFAULT_LOG_COMPRESSION = 'gzip'  # compression of closed day files: 'gzip', 'lzma' or 'none'
+    DEFAULT_LOG_MAX_BYTES = 500 * 1024 * 1024  # quota of the day files, the oldest days are deleted when exceeded
+    DEFAULT_LOG_RETENTION_DAYS = 7  # days of raw samples to keep, the rollups are kept longer
+    DEFAULT_ROLLUP_PATH = '/data/VenusOS-SensorMonitor/logs/dc_currents_rollups'
+    DEFAULT_LOG_BUFFER_BYTES = 16 * 1024 * 1024  # memory budget of the samples waiting to be written, well below the softlimit in service/run
+    DEFAULT_LOG_FSYNC = 'flush'  # fsync the sample log after every write: 'never', 'flush' or every N seconds
+    DEFAULT_LOG_JOURNAL_INTERVAL = 10  # seconds of samples that can be lost on a crash or power cut
+    DEFAULT_LOG_DEADBAND_MODE = 'deadband'  # change-only logging when log_deadband is set: 'deadband' or 'swinging_door'
+    DEFAULT_LOG_MAX_GAP = 60  # seconds, maximum time between logged rows with change-only logging
+    LOG_FORMATS = {
+        'csv': CSVLogger.CSVLogger,
+        'binary': BinaryLogger.BinaryLogger,
+    }
     DEFAULT_SMOOTHED_WINDOW = 10  # Default window size for SmoothedValue
+    DEFAULT_SMOOTHED_FILTER = 'sma'  # Default filter kind for SmoothedValue
     DEFAULT_OFFSETS = {1: 1.453, 2: -0.847, 3: 0.008}  # Default offsets (in Amps) for each channel
-    I2C_RETRY_LIMIT = 10
+    DEFAULT_DATA_RATE = 128  # ADS1115 samples per second
+    DEFAULT_OUTPUT_RATE = 10  # decimated samples per second fed to SmoothedValue and the sample log
     ERROR_VALUE = -999
 
-    def __init__(self, 
-                 channels: list = None, 
-                 amp_per_voltage: float = None, 
-                 log_abs_path: str = None, 
+    def __init__(self,
+                 channels = None,
+                 amp_per_voltage: float = None,
+                 log_abs_path: str = None,
                  flush_interval: int = None,
                  smoothed_window: int = None,
-                 offsets: dict = None):
+                 offsets: dict = None,
+                 alert_gpio = None,
+                 data_rate: int = None,
+                 smoothed_filter: str = None,
+                 output_rate: float = None,
+                 calibration_path: str = None,
+                 log_format: str = None,
+                 log_compression: str = None,
+                 log_max_bytes: int = None,
+                 log_retention_days: int = None,
+                 rollup_path: str = None,
+                 rollup_tiers: dict = None,
+                 extra_log_columns: dict = None,
+                 log_buffer_bytes: int = None,
+                 log_fsync = None,
+                 log_journal_interval: float = None,
+                 log_deadband: dict = None,
+                 log_deadband_mode: str = None,
+                 log_max_gap: float = None):
         """
         Initializes the DcCurrents class to read DC currents from specified channels.
 
         Args:
-            channels (list): List of channels to read from. Default is [1, 2, 3]. Channel 0 is not used in current wiring
-            amp_per_voltage (float): Conversion factor from voltage to current. Default is 22 from practical calibration.
-            log_abs_path (str): Path for CSV logs. Default is '/data/VenusOS-SensorMonitor/logs/dc_currents'.
-            flush_interval (int): CSV log flush interval in seconds. Default is 60.
+            channels (list | dict): Either a list of input pins on the ADS1115 at 0x48 on I2C bus 1, or a dict mapping channel id to
+                an AdcChannel (bus, address, pin) to spread the channels over several ADS1115 chips and I2C buses. Default is [1, 2, 3].
+                Channel 0 is not used in current wiring
+            amp_per_voltage (float): Conversion factor from voltage to current for all channels. Default is the per-channel gain from
+                the calibration file, or 22 from practical calibration.
+            log_abs_path (str): Path for the sample logs. Default is '/data/VenusOS-SensorMonitor/logs/dc_currents'.
+            flush_interval (int): Sample log flush interval in seconds. Default is 60.
             smoothed_window (int): Window size for SmoothedValue. Default is 10.
-            offsets (dict): Per-channel offsets to be applied to currents. Default is {1: +1.453, 2: -0.847, 3: +0.008} from practical calibration.
+            offsets (dict): Per-channel offsets to be applied to currents. Default is the offsets from the calibration file,
+                or {1: +1.453, 2: -0.847, 3: +0.008} from practical calibration.
+            alert_gpio (int | dict): GPIO wired to the ADS1115 ALERT/RDY pin, or a dict mapping (bus, address) to GPIO when using several ADCs.
+                When set, the ADCs run in continuous-conversion mode and each channel is read when the pin signals a finished conversion
+                instead of polling every 100 ms. Default is None (polling).
+            data_rate (int): Default ADS1115 data rate in samples per second (8-860). Channels can override it with AdcChannel.data_rate.
+                Default is 128.
+            smoothed_filter (str): Filter used by SmoothedValue: 'sma', 'ema' or 'median'. Default is 'sma'.
+            output_rate (float): Output samples per second. All ADC conversions during an output period are averaged (decimated)
+                into one output sample, so a higher data rate gives less noise instead of more samples. Default is 10.
+            calibration_path (str): Per-channel gain and offset settings written by calibrate_currents.py, used when amp_per_voltage
+                or offsets are not given. Default is '/data/VenusOS-SensorMonitor/calibration.json'.
+            log_format (str): Sample log backend: 'csv' (human readable) or 'binary' (fixed width records, much cheaper to write,
+                convert with BinaryLogger.py). Default is 'csv'.
+            log_compression (str): Compression of the sample logs of closed days: 'gzip', 'lzma' or 'none'. Default is 'gzip'.
+            log_max_bytes (int): Quota for the sample logs in bytes, the oldest days are deleted when it is exceeded. 0 for no quota.
+                Default is 500 MB.
+            log_retention_days (int): Days of raw samples to keep before today. 0 to keep all days. Default is 7.
+            rollup_path (str): Path for the min/max/mean/count rollups of the samples. Default is '/data/VenusOS-SensorMonitor/logs/dc_currents_rollups'.
+            rollup_tiers (dict): Rollup tier name -> (window in seconds, retention in days or None[, quota in bytes or None]).
+                Default is RollupLogger.DEFAULT_TIERS: 1 s windows for 30 days, 1 min windows for a year and 15 min windows
+                forever, within a quota of 100 MB, 50 MB and 50 MB.
+            extra_log_columns (dict): Additional logged columns, column name -> function returning the latest value (e.g. a temperature).
+                The functions are called for every sample by the acquisition thread, so they must return a cached value. Default is None.
+            log_buffer_bytes (int): Memory budget of the samples waiting to be written. When it is exceeded (e.g. because the log
+                directory is not writable) the oldest samples are dropped. Default is 16 MB.
+            log_fsync (str | float): When the sample log is fsync'ed: 'never', 'flush' (after every write) or every N seconds.
+                Default is 'flush'.
+            log_journal_interval (float): Seconds between appends of the queued samples to a crash recovery journal, i.e. the samples
+                that can be lost on a crash or power cut. 0 for no journal. Requires log_fsync='flush'. Default is 10.
+            log_deadband (dict): Change-only logging: column name or pattern (e.g. '*_current') -> tolerance. A sample is only
+                logged when a value moves beyond its tolerance, or after log_max_gap seconds. The rollups still get every sample.
+                Default is None (log every sample).
+            log_deadband_mode (str): 'deadband' (values hold until the next logged row) or 'swinging_door' (values are
+                interpolated linearly between the logged rows, logged one sample late). Default is 'deadband'.
+            log_max_gap (float): Maximum seconds between logged rows with change-only logging. Default is 60.
         """
         self.logger = logging.getLogger(__name__)
         self.logger.info("Initializing")
-        self.channels = channels if channels is not None else self.DEFAULT_CHANNELS
+        channels = channels if channels is not None else self.DEFAULT_CHANNELS
+        if isinstance(channels, dict):
+            self.channel_map = {id: AdcChannel(*c) if isinstance(c, tuple) else c for id, c in channels.items()}
+        else:
+            self.channel_map = {i: AdcChannel(pin=i) for i in channels}
+        self.channels = list(self.channel_map)
         self.amp_per_ad_voltage = amp_per_voltage if amp_per_voltage is not None else self.DEFAULT_AMP_PER_VOLTAGE
+        calibrated_gains, calibrated_offsets = self._load_calibration(calibration_path if calibration_path is not None else self.DEFAULT_CALIBRATION_PATH)
+        if amp_per_voltage is None:
+            self.gains = {i: calibrated_gains.get(i, self.amp_per_ad_voltage) for i in self.channels}
+        else:
+            self.gains = dict.fromkeys(self.channels, amp_per_voltage)
         log_abs_path = log_abs_path if log_abs_path is not None else self.DEFAULT_LOG_PATH
         flush_interval = flush_interval if flush_interval is not None else self.DEFAULT_FLUSH_INTERVAL
         smoothed_window = smoothed_window if smoothed_window is not None else self.DEFAULT_SMOOTHED_WINDOW
-        self.offsets = offsets if offsets is not None else self.DEFAULT_OFFSETS.copy()
-        self.csvLogger = CSVLogger.CSVLogger(log_abs_path, flush_interval=flush_interval)
-        self.i2cConnected = False
-        self.smoothed_values = {str(i): SmoothedCurrent(window_size=smoothed_window) for i in self.channels}
+        smoothed_filter = smoothed_filter if smoothed_filter is not None else self.DEFAULT_SMOOTHED_FILTER
+        self.offsets = offsets if offsets is not None else {**self.DEFAULT_OFFSETS, **calibrated_offsets}
+        self.data_rate = data_rate if data_rate is not None else self.DEFAULT_DATA_RATE
+        self.output_period = 1.0 / (output_rate if output_rate is not None else self.DEFAULT_OUTPUT_RATE)
+        if isinstance(alert_gpio, int):
+            alert_gpio = {(AdcChannel().bus, AdcChannel().address): alert_gpio}
+        self.alert_gpios = alert_gpio or {}
+        log_format = log_format if log_format is not None else self.DEFAULT_LOG_FORMAT
+        if log_format not in self.LOG_FORMATS:
+            raise ValueError(f"Unknown log format {log_format}, expected one of {list(self.LOG_FORMATS)}")
+        log_compression = log_compression if log_compression is not None else self.DEFAULT_LOG_COMPRESSION
+        log_compression = None if log_compression == 'none' else log_compression
+        log_max_bytes = log_max_bytes if log_max_bytes is not None else self.DEFAULT_LOG_MAX_BYTES
+        log_retention_days = log_retention_days if log_retention_days is not None else self.DEFAULT_LOG_RETENTION_DAYS
+        log_buffer_bytes = log_buffer_bytes if log_buffer_bytes is not None else self.DEFAULT_LOG_BUFFER_BYTES
+        log_fsync = log_fsync if log_fsync is not None else self.DEFAULT_LOG_FSYNC
+        log_journal_interval = log_journal_interval if log_journal_interval is not None else self.DEFAULT_LOG_JOURNAL_INTERVAL
+        # Log schema: battery current and voltage, (ADS1115 voltage, current, smoothed current) per channel and the extra columns
+        self.extra_log_columns = extra_log_columns or {}
+        self.log_columns = (['current', 'voltage'] + [f'b{i}_{v}' for i in self.channels for v in ('voltage', 'current', 'smoothed')]
+                            + list(self.extra_log_columns))
+        self._log_keys = [(i, str(i)) for i in self.channels]
+        self._log_sources = list(self.extra_log_columns.values())
+        if log_deadband:
+            self.log_compressor = DeadbandCompressor(self.log_columns, log_deadband,
+                                                     log_deadband_mode if log_deadband_mode is not None else self.DEFAULT_LOG_DEADBAND_MODE,
+                                                     log_max_gap if log_max_gap is not None else self.DEFAULT_LOG_MAX_GAP)
+        else:
+            self.log_compressor = None
+        self.sampleLogger = self.LOG_FORMATS[log_format](log_abs_path, self.log_columns, flush_interval=flush_interval, compression=log_compression,
+                                                         max_bytes=log_max_bytes or None, max_days=log_retention_days or None,
+                                                         max_buffer_bytes=log_buffer_bytes, fsync=log_fsync, journal_interval=log_journal_interval or None,
+                                                         deadband=self.log_compressor.get_settings() if self.log_compressor is not None else None)
+        rollup_path = rollup_path if rollup_path is not None else self.DEFAULT_ROLLUP_PATH
+        self.rollups = RollupLogger.RollupLogger(rollup_path, self.log_columns, rollup_tiers,
+                                                 flush_interval=flush_interval, compression=log_compression)
+        self.smoothed_values = {str(i): SmoothedCurrent(window_size=smoothed_window, filter=smoothed_filter) for i in self.channels}
+        # Latest SmoothedCurrentSnapshot per channel id and latest (ADS1115 voltage, unsmoothed current) per channel id.
+        # Replaced (never modified) by the acquisition threads, so readers can use them without taking the lock
+        self._snapshots = MappingProxyType({})
+        self._readings = MappingProxyType({})
+        self.max_publish_time = 0.0  # longest time the lock was held to publish, i.e. the worst case wait for the lock
         self.batt_reader = DbusBatteryReader()
         self.lock = threading.Lock()
         self._stop_event = threading.Event()
-        self._bg_thread = threading.Thread(target=self._background_reader, daemon=True)
+
+        # One AdcBus and acquisition thread per I2C bus, so the sample rate does not drop with the number of buses
+        self.buses = {}
+        for bus in sorted({c.bus for c in self.channel_map.values()}):
+            bus_channels = {id: c for id, c in self.channel_map.items() if c.bus == bus}
+            bus_alert_gpios = {address: gpio for (b, address), gpio in self.alert_gpios.items() if b == bus}
+            self.buses[bus] = AdcBus(bus, bus_channels, bus_alert_gpios, self.data_rate)
+        self._primary_bus = next(iter(self.buses), None)  # the bus whose thread writes the sample log
+        self._bg_threads = [threading.Thread(target=self._background_reader, args=(bus,), name=f"DcCurrents I2C-{bus}", daemon=True)
+                            for bus in self.buses]
+
+    def _load_calibration(self, path):
+        """
+        Returns the per-channel gains and offsets from the calibration file as ({channel: gain}, {channel: offset}).
+        Both are empty if there is no (valid) calibration file.
+        """
+        try:
+            gains, offsets = load_calibration(path)
+            if gains is None:
+                return {}, {}
+        except Exception:
+            self.logger.exception(f"Invalid calibration file {path}, using default calibration")
+            return {}, {}
+        self.logger.info(f"Loaded calibration from {path}: gains {gains}, offsets {offsets}")
+        return gains, offsets
+
+    @property
+    def i2cConnected(self):
+        return all(adc_bus.connected for adc_bus in self.buses.values())
 
     def start_background_thread(self):
         """
-        Starts the background thread to read currents.
+        Starts the background threads (one per I2C bus) to read currents.
         This method should be called after initializing the DcCurrents instance.
         """
-        if not self._bg_thread.is_alive():
-            self._bg_thread.start()
-            self.logger.info("Background thread started")
-        else:
-            self.logger.warning("Background thread is already running")
+        for thread in self._bg_threads:
+            if not thread.is_alive():
+                thread.start()
+                self.logger.info(f"Background thread {thread.name} started")
+            else:
+                self.logger.warning(f"Background thread {thread.name} is already running")
 
-    def ensure_i2c_connected(self):
-        if hasattr(self, '_i2c_fail_count'):
-            pass
-        else:
-            self._i2c_fail_count = 0
-        if self.i2cConnected:
-            return
-        if self._i2c_fail_count >= self.I2C_RETRY_LIMIT:
-            self.logger.error("I2C initialization failed too many times (" + str(self._i2c_fail_count) + "), stopping background thread.")
-            self.shutdown()  # Clean up resources
-            return
-        try:
-            self.logger.debug("Initializing I2C")
-            # Initialize the I2C interface
-            i2c = busio.I2C(board.SCL, board.SDA)
-            
-            # Create an ADS1115 object
-            ads = ADS.ADS1115(i2c, gain=2/3)
-
-            for i in self.channels:
-                setattr(self, 'channel' + str(i), AnalogIn(ads, getattr(ADS, 'P' + str(i))))
-                self.logger.debug("Channel " + str(i) + " initialized")
-
-            self.i2cConnected = True
-            self._i2c_fail_count = 0  # Reset on success
-        except Exception as e:
-            self.logger.exception("Error initializing I2C")
-            self.i2cConnected = False
-            self._i2c_fail_count += 1
-            if self._i2c_fail_count > 1:
-                self.logger.warning(f"I2C initialization failed {self._i2c_fail_count} times.")
-            time.sleep(1)  # Delay before next retry
+    def ensure_i2c_connected(self, bus):
+        """
+        Reconnects the I2C bus if needed. Never blocks: while the bus is down, reconnects are attempted
+        with exponential backoff by AdcBus.try_connect().
+
+        Returns:
+            bool: True if the bus is connected.
+        """
+        return self.buses[bus].try_connect(time.monotonic())
 
-    def read_currents(self):
-        ads_voltages = {}
-        raw_currents = {}
+    def read_currents(self, bus=None):
+        """
+        Reads the battery current and produces one decimated output sample for the channels on one I2C bus (or on all buses)
+        and updates the smoothed values. Takes one output period when the channels are read.
+
+        Returns:
+            bool: True if the ADC channels were read, False if the reading was skipped.
+        """
+        if bus is None:
+            return all([self.read_currents(b) for b in self.buses])
+        adc_bus = self.buses[bus]
 
         # Read voltage and current from dbus
+        timestamp = time.time()
         try:
             batt_voltage, batt_current = self.batt_reader.get_batt_voltage_current()
         except Exception as e:
             self.logger.exception("Error reading battery voltage and current from dbus")
             raise
-        
+
         if(batt_current is None or abs(batt_current) < 1):
             self.logger.debug("Battery current is None or less than 1, skipping current reading")
             # Update smoothed values with None
-            for i in self.channels:
-                self.smoothed_values[str(i)].update(None, 0, batt_voltage)
-            return
-        
-        # Set baseline current as battery current divided by number of channels
+            self._publish(adc_bus, timestamp, self._filter(adc_bus, {}, 0, batt_voltage))
+            return False
+
+        # Set baseline current as battery current divided by number of channels (on all buses)
         baseline = batt_current / len(self.channels) if len(self.channels) > 0 else batt_current
-        
-        self.ensure_i2c_connected()
-        if not self.i2cConnected:
-            self.logger.debug("I2C not initialized, waiting 1 second before retrying")
-            for i in self.channels:
+
+        if not self.ensure_i2c_connected(bus):
+            self.logger.debug(f"I2C bus {bus} not connected, next attempt in {adc_bus.next_attempt - time.monotonic():.1f} s")
+            self._publish(adc_bus, timestamp, self._filter(adc_bus, {}, baseline, batt_voltage))
+            return False
+
+        # The reading is split in stages so that only the publish step takes the lock:
+        # acquisition (I2C), filtering (SmoothedCurrent, owned by this thread), publication (lock) and logging (file I/O)
+        counts = self._read_decimated(adc_bus)
+        readings = self._filter(adc_bus, counts, baseline, batt_voltage)
+        self._publish(adc_bus, timestamp, readings)
+
+        if bus == self._primary_bus:
+            # Log the values if the battery current is significant
+            self._log(timestamp, batt_current, batt_voltage)
+        return True
+
+    def _filter(self, adc_bus, counts, baseline, batt_voltage):
+        """
+        Converts the counts to currents and updates the smoothed values of the channels on the bus.
+        Each channel belongs to exactly one bus thread, so no lock is needed.
+
+        Returns:
+            dict: Channel id -> (ADS1115 voltage, unsmoothed current), for the channels that were read.
+        """
+        readings = {}
+        for i in adc_bus.channels:
+            if i not in counts:
                 self.smoothed_values[str(i)].update(None, baseline, batt_voltage)
-            # sleep to avoid busy-waiting
-            time.sleep(1)
-            return
-        
-        for i in self.channels:
+                continue
+            current = counts[i] * adc_bus.lsb * self.gains[i]
+            offset = self.offsets.get(i, 0.0)
+            current_with_offset = current + offset
+            readings[i] = (counts[i] * adc_bus.lsb, current_with_offset)
+            self.smoothed_values[str(i)].update(current_with_offset, baseline, batt_voltage)
+        return readings
+
+    def _log(self, timestamp, batt_current, batt_voltage):
+        """
+        Builds one row in the order of log_columns and passes it to the sample logger and the rollups.
+        """
+        snapshots = self._snapshots
+        readings = self._readings
+        missing = (self.ERROR_VALUE, self.ERROR_VALUE)
+        values = [batt_current, batt_voltage if batt_voltage is not None else self.ERROR_VALUE]
+        for i, key in self._log_keys:
+            snapshot = snapshots.get(key)
+            smoothed = snapshot.value if snapshot is not None and snapshot.value is not None else self.ERROR_VALUE
+            values.extend(readings.get(i, missing))
+            values.append(smoothed)
+        for source in self._log_sources:
             try:
-                ads_voltage = getattr(self, 'channel' + str(i)).voltage
-                ads_voltages[i] = ads_voltage
-                current = ads_voltage * self.amp_per_ad_voltage
-                offset = self.offsets.get(i, 0.0)
-                current_with_offset = current + offset
-                raw_currents[i] = current_with_offset
-                self.smoothed_values[str(i)].update(current_with_offset, baseline, batt_voltage)
-            except Exception as e:
-                self.i2cConnected = False
-                # self.logger.exception(f"Error reading channel {i}")
-                self.logger.debug(f"Error reading channel {i}, setting smoothed value to None") # happens often, so just log it as debug
-                self.smoothed_values[str(i)].update(None, baseline, batt_voltage)
-        
-        # Log the battery voltage and current
-        # self.logger.debug(f"Battery Voltage: {batt_voltage} V, "
-        #                  f"Battery Current: {batt_current} A, "
-        #                  f"Channel 1 Smoothed Current: {self.smoothed_values.get('1', SmoothedCurrent()).get_value(self.ERROR_VALUE)} A ({self.smoothed_values.get('1', SmoothedCurrent()).get_quality()} %), "
-        #                  f"Channel 2 Smoothed Current: {self.smoothed_values.get('2', SmoothedCurrent()).get_value(self.ERROR_VALUE)} A ({self.smoothed_values.get('2', SmoothedCurrent()).get_quality()} %), "
-        #                  f"Channel 3 Smoothed Current: {self.smoothed_values.get('3', SmoothedCurrent()).get_value(self.ERROR_VALUE)} A ({self.smoothed_values.get('3', SmoothedCurrent()).get_quality()} %)")
-
-        # Log the values to CSV if the battery current is significant
-        self.csvLogger.log(batt_current, batt_voltage,
-                            ads_voltages.get(1, self.ERROR_VALUE), raw_currents.get(1, self.ERROR_VALUE), self.smoothed_values.get('1', SmoothedCurrent()).get_value(self.ERROR_VALUE),
-                            ads_voltages.get(2, self.ERROR_VALUE), raw_currents.get(2, self.ERROR_VALUE), self.smoothed_values.get('2', SmoothedCurrent()).get_value(self.ERROR_VALUE),
-                            ads_voltages.get(3, self.ERROR_VALUE), raw_currents.get(3, self.ERROR_VALUE), self.smoothed_values.get('3', SmoothedCurrent()).get_value(self.ERROR_VALUE))
-
-    def _background_reader(self):
+                value = source()
+            except Exception:
+                value = None
+            values.append(value if value is not None else self.ERROR_VALUE)
+        row = tuple(values)
+        if self.log_compressor is None:
+            self.sampleLogger.log(row, timestamp)
+        else:
+            for logged_timestamp, logged_row in self.log_compressor.add(timestamp, row):
+                self.sampleLogger.log(logged_row, logged_timestamp)
+        self.rollups.add(timestamp, row)
+
+    def _read_decimated(self, adc_bus):
+        """
+        Scans the bus back to back for one output period and averages the conversions per channel.
+        The scan rate is set by the ADS1115 data rates (conversion waits or ALERT/RDY pulses), there is no sleep in between.
+
+        Returns:
+            dict: Channel id -> average raw count. Channels without any successful conversion are left out.
+        """
+        sums = dict.fromkeys(adc_bus.channels, 0)
+        n = dict.fromkeys(adc_bus.channels, 0)
+        start = time.monotonic()
+        deadline = start + self.output_period
+        scans = 0
+        while True:
+            counts = adc_bus.read_raw()
+            scans += 1
+            for i, count in counts.items():
+                sums[i] += count
+                n[i] += 1
+            now = time.monotonic()
+            if now >= deadline or not adc_bus.connected or self._stop_event.is_set():
+                break
+
+        adc_bus.input_rate = scans / (now - start) if now > start else 0.0
+        if adc_bus.last_output is not None:
+            adc_bus.output_rate = 1.0 / (now - adc_bus.last_output)
+        adc_bus.last_output = now
+        return {i: sums[i] / n[i] for i in sums if n[i] > 0}
+
+    def get_diagnostics(self):
+        """
+        Returns per I2C bus the achieved ADC conversions per second per channel (input rate), decimated samples per second (output rate)
+        and the connection recovery metrics (reconnect attempts, recoveries, time to recover, read errors per channel),
+        plus the longest time the lock was held to publish (max_publish_time, seconds) and the sample log writer metrics
+        (sample_log: queued, written and dropped rows, write errors, longest write, compressed and deleted day files).
+        """
+        diagnostics = {bus: {'input_rate': adc_bus.input_rate, 'output_rate': adc_bus.output_rate, **adc_bus.get_metrics()}
+                       for bus, adc_bus in self.buses.items()}
+        diagnostics['max_publish_time'] = self.max_publish_time
+        diagnostics['sample_log'] = self.sampleLogger.get_metrics()
+        if self.log_compressor is not None:
+            diagnostics['sample_log'].update(self.log_compressor.get_metrics())
+        diagnostics['rollups'] = self.rollups.get_metrics()
+        return diagnostics
+
+    def _background_reader(self, bus):
         while not self._stop_event.is_set():
-            self._read_and_update_smoothed()
-            time.sleep(0.1)  # 100 ms
+            sampled = self.read_currents(bus)
+            # When the channels were read, the output period has already passed while scanning.
+            # Otherwise sleep for one output period to avoid busy-waiting
+            if not sampled:
+                time.sleep(self.output_period)
 
-    def _read_and_update_smoothed(self):
-        # This method is called from the background thread
+    def _publish(self, adc_bus, timestamp, readings):
+        """
+        Publishes new snapshots and readings for the channels of the bus by swapping the mappings.
+        The snapshots are created before taking the lock; the lock only serializes the merge and swap
+        so concurrent buses do not lose each others updates.
+        """
+        updates = {str(i): self.smoothed_values[str(i)].snapshot(timestamp) for i in adc_bus.channels}
         with self.lock:
-            self.read_currents()
+            start = time.perf_counter()
+            snapshots = dict(self._snapshots)
+            snapshots.update(updates)
+            latest = {i: r for i, r in self._readings.items() if i not in adc_bus.channels}
+            latest.update(readings)
+            self._snapshots = MappingProxyType(snapshots)
+            self._readings = MappingProxyType(latest)
+            self.max_publish_time = max(self.max_publish_time, time.perf_counter() - start)
 
     def get_latest_smoothed_values(self):
         """
-        Thread-safe method to retrieve the latest smoothed current.
+        Returns the latest smoothed currents as a read-only mapping of channel id -> SmoothedCurrentSnapshot.
+        The mapping is never modified after it is published, so it is safe to use without locking or copying.
         """
-        with self.lock:
-            return copy.deepcopy(self.smoothed_values)
+        return self._snapshots
+
+    def get_state(self):
+        """
+        Returns the smoothing state of the channels as a JSON serializable dict, for a warm restart.
+        Read without stopping the acquisition threads, restore_state() copes with a value added while it was read.
+        """
+        return {'smoothed_values': {id: smoothed.get_state() for id, smoothed in self.smoothed_values.items()}}
+
+    def restore_state(self, state):
+        """
+        Restores the smoothing state of the channels that are still configured and publishes their smoothed values,
+        so they are valid right away instead of after a full window. Call before start_background_thread().
+        """
+        restored = [id for id, smoothed_state in state.get('smoothed_values', {}).items()
+                    if id in self.smoothed_values and self.smoothed_values[id].restore_state(smoothed_state)]
+        timestamp = time.time()
+        for adc_bus in self.buses.values():
+            self._publish(adc_bus, timestamp, {})
+        self.logger.info(f"Restored the smoothed values of channels {restored}")
 
     def stop_background_thread(self):
         self._stop_event.set()
-        if self._bg_thread.is_alive():
-            self._bg_thread.join()
+        for thread in self._bg_threads:
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join()
 
     def shutdown(self):
         """
-        Cleanly stop the background thread and flush the CSV logger.
+        Cleanly stop the background thread and flush the sample logger.
         Call this method explicitly when you are done with the DcCurrents instance.
         """
         self.stop_background_thread()
-        if self.csvLogger:
-            self.csvLogger.flush()
-            self.logger.info("CSV logger flushed")
+        for adc_bus in self.buses.values():
+            adc_bus.close()
+        if self.sampleLogger:
+            if self.log_compressor is not None:
+                for logged_timestamp, logged_row in self.log_compressor.flush():
+                    self.sampleLogger.log(logged_row, logged_timestamp)
+            self.sampleLogger.close()
+            self.rollups.close()
+            self.logger.info("Sample logger flushed")
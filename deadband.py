@@ -0,0 +1,200 @@
+from fnmatch import fnmatch
+import csv
+import json
+import math
+
+def timestamp_column(settings):
+    """
+    Returns the name of the timestamp column of a CSV log written with the change-only compression settings
+    (DeadbandCompressor.get_settings(), None for every sample): 'timestamp', followed by the settings as JSON, so a reader
+    can tell that the rows are change points.
+    """
+    return 'timestamp' if not settings else 'timestamp ' + json.dumps(settings, separators=(',', ':'))
+
+def header_settings(column):
+    """
+    Returns the change-only compression settings recorded in the timestamp column of a CSV log, None if every sample was logged.
+    """
+    _, _, settings = column.partition(' ')
+    return json.loads(settings) if settings else None
+
+def log_settings(path):
+    """
+    Returns the change-only compression settings of a (compressed) CSV or binary sample log, None if every sample was logged.
+    """
+    import BinaryLogger  # imports this module
+    from log_archive import base_name, open_log
+    if base_name(path).endswith('.bin'):
+        return BinaryLogger.read_header(path).get('deadband')
+    with open_log(path, 'rt', newline='') as f:
+        column = next(csv.reader(f), [''])[0]
+    return header_settings(column)
+
+class _Deadband:
+    """
+    Logs a row when any value moved more than its tolerance away from the value in the last logged row.
+    Holding the last logged value reconstructs every value within its tolerance.
+    """
+
+    def __init__(self, tolerances):
+        self.tolerances = tolerances
+        self.last = None    # last logged row
+
+    def add(self, timestamp, row):
+        if self.last is not None and all(abs(v - l) <= t for v, l, t in zip(row, self.last, self.tolerances)):
+            return []
+        self.last = row
+        return [(timestamp, row)]
+
+    def archive(self, timestamp, row):
+        self.last = row
+        return [(timestamp, row)]
+
+    def flush(self):
+        return []
+
+class _SwingingDoor:
+    """
+    Swinging door compression per column: the rows between two logged rows are dropped as long as a straight line
+    between the logged rows passes every value within its tolerance. When a value falls outside the "door" of any column,
+    the previous row is logged and becomes the new anchor, so linear interpolation between the logged rows reconstructs
+    every value within its tolerance. A row is therefore logged one sample late.
+    """
+
+    def __init__(self, tolerances):
+        self.tolerances = tolerances
+        self.anchor = None  # (timestamp, row) of the last logged row
+        self.held = None    # (timestamp, row) of the last row that was not logged
+        self.upper = None   # per column the lowest upper slope of the door from the anchor
+        self.lower = None   # per column the highest lower slope
+
+    def _open_door(self, timestamp, row):
+        self.anchor = (timestamp, row)
+        self.held = None
+        self.upper = [math.inf] * len(row)
+        self.lower = [-math.inf] * len(row)
+
+    def _narrow(self, timestamp, row):
+        """
+        Narrows the doors to the row, returns False (leaving the doors unchanged) if the row falls outside any door.
+        The line from the anchor to the row must itself stay inside the doors, which bounds the interpolation error.
+        """
+        anchor_time, anchor_row = self.anchor
+        dt = timestamp - anchor_time
+        if dt <= 0:
+            return False
+        upper = list(self.upper)
+        lower = list(self.lower)
+        for k, (value, start, tolerance) in enumerate(zip(row, anchor_row, self.tolerances)):
+            slope = (value - start) / dt
+            if not lower[k] <= slope <= upper[k]:
+                return False
+            upper[k] = min(upper[k], (value + tolerance - start) / dt)
+            lower[k] = max(lower[k], (value - tolerance - start) / dt)
+        self.upper = upper
+        self.lower = lower
+        return True
+
+    def add(self, timestamp, row):
+        if self.anchor is not None and self._narrow(timestamp, row):
+            self.held = (timestamp, row)
+            return []
+        # the row is outside the door: log the previous row and start the doors from there
+        return self.archive(timestamp, row)
+
+    def archive(self, timestamp, row):
+        """
+        Logs the previous row and starts the doors from there, or logs the row itself if it does not fit the new doors.
+        """
+        if self.held is None:
+            self._open_door(timestamp, row)
+            return [(timestamp, row)]
+        logged = [self.held]
+        self._open_door(*self.held)
+        if not self._narrow(timestamp, row):
+            self._open_door(timestamp, row)
+            return logged + [(timestamp, row)]
+        self.held = (timestamp, row)
+        return logged
+
+    def flush(self):
+        """
+        Returns the held row, which ends the line from the last logged row.
+        """
+        if self.held is None:
+            return []
+        held = self.held
+        self._open_door(*held)
+        return [held]
+
+class DeadbandCompressor:
+    """
+    Change-only compression of the sample log: a row is only logged when a value moves beyond the tolerance of its column,
+    and at least about every max_gap seconds (heartbeat), so a quiet period costs one row per max_gap instead of one per sample
+    while the values between logged rows stay within their tolerance:
+      - 'deadband': the logged value holds until the next logged row.
+      - 'swinging_door': the values are on the straight line between the logged rows. Fewer rows for slow drifts,
+        but each row is logged one sample late.
+    """
+    MODES = {
+        'deadband': _Deadband,
+        'swinging_door': _SwingingDoor,
+    }
+
+    def __init__(self, columns, tolerances, mode='deadband', max_gap=60):
+        """
+        Args:
+            columns (list): Names of the logged columns.
+            tolerances (dict): Column name or fnmatch pattern (e.g. '*_current') -> tolerance in the unit of the column.
+                The first matching pattern applies; columns without a match are logged on every change.
+            mode (str): 'deadband' or 'swinging_door'. Default is 'deadband'.
+            max_gap (float): Maximum seconds between logged rows. Default is 60.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown deadband mode {mode}, expected one of {list(self.MODES)}")
+        self.deadband = dict(tolerances)
+        self.tolerances = [next((t for pattern, t in tolerances.items() if fnmatch(c, pattern)), 0.0) for c in columns]
+        self.mode = mode
+        self.max_gap = max_gap
+        self.compressor = self.MODES[mode](self.tolerances)
+        self.last_logged = None  # timestamp of the last logged row
+        self.input_rows = 0
+        self.logged_rows = 0
+
+    def add(self, timestamp, row):
+        """
+        Adds one sample.
+
+        Returns:
+            list: The (timestamp, row) tuples to log, usually none.
+        """
+        self.input_rows += 1
+        if self.last_logged is not None and timestamp - self.last_logged >= self.max_gap:
+            logged = self.compressor.archive(timestamp, row)  # heartbeat
+        else:
+            logged = self.compressor.add(timestamp, row)
+        return self._logged(logged)
+
+    def flush(self):
+        """
+        Returns the rows that are held back (with 'swinging_door'), e.g. before shutting down.
+        """
+        return self._logged(self.compressor.flush())
+
+    def _logged(self, logged):
+        if logged:
+            self.last_logged = logged[-1][0]
+            self.logged_rows += len(logged)
+        return logged
+
+    def get_settings(self) -> dict:
+        """
+        Returns the mode, heartbeat and tolerances, recorded in the header of the sample log (see timestamp_column()).
+        """
+        return {'mode': self.mode, 'max_gap': self.max_gap, 'deadband': self.deadband}
+
+    def get_metrics(self) -> dict:
+        return {
+            'input_rows': self.input_rows,
+            'logged_rows': self.logged_rows,
+        }
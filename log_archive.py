@@ -0,0 +1,366 @@
+import csv
+import gzip
+import lzma
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+import logging
+
+# Compressed file extension -> open function, used to open closed day files transparently
+OPENERS = {
+    '.gz': gzip.open,
+    '.xz': lzma.open,
+}
+COMPRESSIONS = {
+    'gzip': '.gz',
+    'lzma': '.xz',
+}
+# Compressed file extension -> (compress function, decompressing reader of an open file object)
+MEMBER_CODECS = {
+    '.gz': (gzip.compress, lambda f: gzip.GzipFile(fileobj=f, mode='rb')),
+    '.xz': (lzma.compress, lzma.LZMAFile),
+}
+INDEX_SUFFIX = '.idx'  # sidecar time index of a day file, see index_path()
+
+def open_log(path, mode='rb', **kwargs):
+    """
+    Opens a log file for reading, decompressing it if it ends with .gz or .xz.
+    Text mode arguments (newline, encoding) are passed on as with open().
+    """
+    opener = OPENERS.get(os.path.splitext(path)[1])
+    if opener is None:
+        return open(path, mode, **kwargs)
+    if 'b' not in mode and 't' not in mode:
+        mode += 't'
+    return opener(path, mode, **kwargs)
+
+def base_name(path):
+    """
+    Returns the file name without compression extension, e.g. dc_currents_20250101.csv for dc_currents_20250101.csv.gz.
+    """
+    name = os.path.basename(path)
+    root, ext = os.path.splitext(name)
+    return root if ext in OPENERS else name
+
+def index_path(path):
+    """
+    Returns the path of the sidecar time index of a (compressed) day file, e.g. dc_currents_20250101.csv.idx.
+
+    Each line of the index is "timestamp,offset" of the row starting at that byte offset of the uncompressed file; the rows
+    up to the next line are sorted and at or after the timestamp. Where the rows go back in time (rows written after newer
+    rows) the timestamp goes back as well, so each ascending run of the index covers a sorted sequence of rows. When the
+    file is compressed the index is rewritten to "timestamp,member offset,skip": the file then consists of independently
+    compressed members, and the row starts `skip` bytes into the member starting at `member offset` of the compressed file.
+    """
+    return os.path.join(os.path.dirname(path), base_name(path) + INDEX_SUFFIX)
+
+def read_index(path):
+    """
+    Returns the entries of a sidecar index as a list of (timestamp, offset, skip) tuples, or an empty list if there is none.
+    """
+    entries = []
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.rstrip('\n').split(',')
+                if len(fields) == 2:
+                    entries.append((fields[0], int(fields[1]), 0))
+                elif len(fields) == 3:
+                    entries.append((fields[0], int(fields[1]), int(fields[2])))
+    except FileNotFoundError:
+        pass
+    return entries
+
+def reader_at(raw, path, offset, skip=0):
+    """
+    Returns a reader of the open (compressed) log file `raw` positioned at an index entry (see index_path()).
+    The caller closes `raw`.
+    """
+    raw.seek(offset)
+    extension = os.path.splitext(path)[1]
+    if extension not in MEMBER_CODECS:
+        return raw
+    f = MEMBER_CODECS[extension][1](raw)
+    f.read(skip)
+    return f
+
+def find_day_file(directory, prefix, day, header):
+    """
+    Returns the path of the CSV day file <prefix>YYYYMMDD.csv to append rows with the header to. When that file was written
+    with another header (e.g. after changing the channels) or has already been compressed, returns the next free
+    <prefix>YYYYMMDD_N.csv instead, so rows never end up under the wrong header.
+    """
+    n = 0
+    while True:
+        filepath = os.path.join(directory, prefix + day + (f'_{n}' if n else '') + '.csv')
+        if any(os.path.exists(filepath + extension) for extension in OPENERS):
+            n += 1
+            continue
+        if not os.path.exists(filepath):
+            return filepath
+        with open(filepath, newline='') as f:
+            if next(csv.reader(f), None) == header:
+                return filepath
+        n += 1
+
+class LogArchiver:
+    """
+    Housekeeping of a directory of day files named <prefix>YYYYMMDD*, run by a background thread so that neither
+    sampling nor log writing waits for it:
+      - Day files of closed days (an earlier day, not written for `grace` seconds) are compressed with gzip or lzma.
+        A day file with a sidecar time index is compressed in independent members of about MEMBER_SIZE bytes,
+        so a reader can seek to a time without decompressing the file from the start.
+      - Closed files older than max_days days are deleted (retention).
+      - When the files take more than max_bytes, the oldest closed files are deleted until they fit.
+    The housekeeping runs every CHECK_INTERVAL seconds and when notify() is called, e.g. by the logger on a day change.
+    All LogArchivers of the process share one housekeeping thread (see _Housekeeper), so each logger and rollup tier does
+    not keep a mostly idle thread of its own.
+    """
+    CHECK_INTERVAL = 3600  # seconds
+    DEFAULT_GRACE = 3600   # seconds a file of an earlier day must be unmodified before it is considered closed
+    MEMBER_SIZE = 1024 * 1024  # bytes of uncompressed data per compressed member of an indexed file
+
+    def __init__(self, directory: str, prefix: str, compression: str = 'gzip', max_bytes: int = None, grace: float = None,
+                 max_days: int = None):
+        """
+        Args:
+            directory (str): Directory of the day files.
+            prefix (str): File name prefix of the day files, followed by the day as YYYYMMDD.
+            compression (str): 'gzip', 'lzma' or None to keep closed days uncompressed. Default is 'gzip'.
+            max_bytes (int): Quota for all day files in bytes, None for no quota. Default is None.
+            grace (float): Seconds a file of an earlier day must be unmodified before it is closed. Default is 3600.
+            max_days (int): Number of days to keep before today, None to keep all days. Default is None.
+        """
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, expected one of {list(COMPRESSIONS)} or None")
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.grace = grace if grace is not None else self.DEFAULT_GRACE
+        self.max_days = max_days
+        self.compressed_files = 0
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self._stop_event = threading.Event()
+        self._notified = False
+        self.next_run = time.monotonic()  # monotonic time of the next periodic housekeeping, the first one right away
+        _housekeeper.register(self)
+
+    def notify(self):
+        self._notified = True
+        _housekeeper.wakeup.set()
+
+    def close(self, timeout: float = None):
+        """
+        Stops the housekeeping of the directory, waiting for a running housekeeping for up to timeout seconds.
+        A compression that is still running after the timeout is abandoned (the thread is a daemon) and redone after the next start.
+        """
+        self._stop_event.set()
+        _housekeeper.unregister(self, timeout)
+
+    def _is_due(self, now):
+        return self._notified or now >= self.next_run
+
+    def _run(self):
+        # called by the housekeeping thread
+        self._notified = False
+        self.next_run = time.monotonic() + self.CHECK_INTERVAL
+        try:
+            self.housekeeping()
+        except Exception:
+            self.logger.exception(f"Housekeeping of {self.directory} failed")
+
+    def day_files(self):
+        """
+        Returns the (path, day, size, mtime) of all day files, oldest first. The size includes the sidecar index of the file,
+        which is deleted with it. An index whose day file no longer exists is deleted.
+        """
+        names = os.listdir(self.directory)
+        day_names = {base_name(name) for name in names if not name.endswith(INDEX_SUFFIX)}
+        files = []
+        for name in names:
+            if self._is_tmp_file(name):
+                os.remove(os.path.join(self.directory, name))  # left over from an abandoned compression
+                continue
+            if not name.startswith(self.prefix):
+                continue
+            path = os.path.join(self.directory, name)
+            if name.endswith(INDEX_SUFFIX):
+                if name[:-len(INDEX_SUFFIX)] not in day_names and not os.path.exists(path[:-len(INDEX_SUFFIX)]):
+                    os.remove(path)
+                    self.logger.info(f"Deleted {path}, its day file no longer exists")
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            size = stat.st_size
+            try:
+                size += os.path.getsize(index_path(path))
+            except FileNotFoundError:
+                pass
+            files.append((path, name[len(self.prefix):len(self.prefix) + 8], size, stat.st_mtime))
+        return sorted(files, key=lambda f: (f[1], f[3]))
+
+    def _is_tmp_file(self, name):
+        # only the temporary files of _compress() (.<prefix>YYYYMMDD....tmp), not e.g. the journal of a logger being rewritten
+        day = name[len(self.prefix) + 1:len(self.prefix) + 9]
+        return name.startswith('.' + self.prefix) and name.endswith('.tmp') and len(day) == 8 and day.isdigit()
+
+    def _is_closed(self, path, day, mtime, today, now):
+        # compressed files are closed by definition, their mtime is the time of the compression
+        return day < today and (os.path.splitext(path)[1] in OPENERS or now - mtime > self.grace)
+
+    def housekeeping(self):
+        today = datetime.now().strftime("%Y%m%d")
+        now = time.time()
+        if self.max_days is not None:
+            cutoff = (datetime.now() - timedelta(days=self.max_days)).strftime("%Y%m%d")
+            for path, day, size, mtime in self.day_files():
+                if day < cutoff and self._is_closed(path, day, mtime, today, now):
+                    self._evict(path, size, f"older than {self.max_days} days")
+        if self.compression is not None:
+            for path, day, size, mtime in self.day_files():
+                if self._stop_event.is_set():
+                    return
+                if os.path.splitext(path)[1] not in OPENERS and self._is_closed(path, day, mtime, today, now):
+                    self._compress(path)
+        if self.max_bytes is not None:
+            files = self.day_files()
+            total = sum(f[2] for f in files)
+            for path, day, size, mtime in files:
+                if total <= self.max_bytes:
+                    break
+                if not self._is_closed(path, day, mtime, today, now):
+                    continue
+                self._evict(path, size, f"to stay within the quota of {self.max_bytes} bytes")
+                total -= size
+
+    def _evict(self, path, size, reason):
+        os.remove(path)
+        if os.path.exists(index_path(path)):
+            os.remove(index_path(path))
+        self.evicted_files += 1
+        self.evicted_bytes += size
+        self.logger.info(f"Deleted {path} ({size} bytes) {reason}")
+
+    def _compress(self, path):
+        extension = COMPRESSIONS[self.compression]
+        target = path + extension
+        n = 1
+        while os.path.exists(target):  # a late row reopened an already compressed day
+            root, ext = os.path.splitext(path)
+            target = f"{root}_{n}{ext}{extension}"
+            n += 1
+        # compress to a hidden temporary file and rename, so readers never see a partial file
+        tmp_path = os.path.join(self.directory, '.' + os.path.basename(target) + '.tmp')
+        start = time.monotonic()
+        entries = read_index(index_path(path))
+        if target != path + extension or any(skip for _, _, skip in entries):
+            entries = []    # the index cannot be moved to a renamed file
+            if os.path.exists(index_path(path)):
+                os.remove(index_path(path))
+        if entries:
+            index = self._compress_members(path, tmp_path, extension, entries)
+            index_tmp_path = os.path.join(self.directory, '.' + os.path.basename(index_path(path)) + '.tmp')
+            with open(index_tmp_path, 'w') as f:
+                f.writelines(f"{timestamp},{offset},{skip}\n" for timestamp, offset, skip in index)
+            os.replace(tmp_path, target)
+            os.replace(index_tmp_path, index_path(path))
+        else:
+            with open(path, 'rb') as src, OPENERS[extension](tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(tmp_path, target)
+        os.remove(path)
+        self.compressed_files += 1
+        self.logger.info(f"Compressed {path} to {target} in {time.monotonic() - start:.1f} s "
+                         f"({os.path.getsize(target)} bytes)")
+
+    def _compress_members(self, path, tmp_path, extension, entries):
+        """
+        Compresses the file as a series of independent members that start at index entries and returns the rewritten index.
+        """
+        compress = MEMBER_CODECS[extension][0]
+        index = []
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            member_offset = 0   # offset of the current member in the compressed file
+            member_start = 0    # offset of the current member in the uncompressed file
+            for timestamp, offset, _ in entries:
+                if offset - member_start >= self.MEMBER_SIZE:
+                    dst.write(compress(src.read(offset - member_start)))
+                    member_offset = dst.tell()
+                    member_start = offset
+                index.append((timestamp, member_offset, offset - member_start))
+            while True:
+                data = src.read(self.MEMBER_SIZE)
+                if not data:
+                    break
+                dst.write(compress(data))
+        return index
+
+    def get_metrics(self) -> dict:
+        return {
+            'compressed_files': self.compressed_files,
+            'evicted_files': self.evicted_files,
+            'evicted_bytes': self.evicted_bytes,
+        }
+
+
+class _Housekeeper:
+    """
+    The one daemon thread that runs the housekeeping of all LogArchivers, one directory after the other. It is started by
+    the first LogArchiver and ends when the last one is closed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)  # notified when the housekeeping of an archiver finished
+        self.wakeup = threading.Event()
+        self.archivers = []
+        self.current = None     # archiver whose housekeeping is running
+        self.thread = None
+
+    def register(self, archiver):
+        with self.lock:
+            self.archivers.append(archiver)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="LogArchiver", daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def unregister(self, archiver, timeout=None):
+        with self.lock:
+            if archiver in self.archivers:
+                self.archivers.remove(archiver)
+            if self.thread is not threading.current_thread():
+                self.idle.wait_for(lambda: self.current is not archiver, timeout)
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                if not self.archivers:
+                    self.thread = None
+                    return
+                archivers = list(self.archivers)
+            for archiver in archivers:
+                with self.lock:
+                    if archiver not in self.archivers or not archiver._is_due(time.monotonic()):
+                        continue
+                    self.current = archiver
+                try:
+                    archiver._run()
+                finally:
+                    with self.lock:
+                        self.current = None
+                        self.idle.notify_all()
+            with self.lock:
+                delay = min((a.next_run for a in self.archivers), default=0) - time.monotonic()
+            self.wakeup.wait(max(0.0, delay))
+
+_housekeeper = _Housekeeper()
@@ -1,126 +1,175 @@
 #!/usr/bin/env python
 import logging
+import signal
 from gi.repository import GLib # type: ignore
 from dbus.mainloop.glib import DBusGMainLoop # type: ignore
-from cpu_temp import CPUTemp
-from w1_temps import W1Temps
-from ble_temps import BLETemps
-from dc_currents import DcCurrents
-from alarm import AlarmBuzzer
-from dbus_service import DCSourceService, TemperatureService
+from TempLogger import TempLogger
+from alarm import AlarmBuzzer, diff_alarm_value
+from dbus_service import DCSourceService, TemperatureService, CustomNameIndex
+from scheduler import Scheduler
+from sources import load_config, create_sources
+from state_snapshot import StateSnapshot
 
 # Create a dictionary to keep track of the services that are currently active, one for temperature services and one for current services
 tempServices = {}
 currentServices = {}
+serviceSources = {}  # service id -> name of the source that reads it
+tempServicesByName = CustomNameIndex()  # CustomName -> temperature service, to pair current and temperature services
 
-# Create the sensors that will be monitored and exposed to dbus
+# Create the enabled sensor sources (see sources.py and /data/VenusOS-SensorMonitor/sources.json)
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(name)-8s %(levelname)s: %(message)s")
-cpu_temp = CPUTemp()
-w1_temps = W1Temps()
-ble_temps = BLETemps()
-dc_currents = DcCurrents()
+config = load_config()
+sources = create_sources(config)
 alarm = AlarmBuzzer()
+temp_logger = TempLogger()
+scheduler = Scheduler()  # polls the sources from the main loop, blocking reads go to its worker pool
+state_snapshot = StateSnapshot()  # runtime state saved periodically for a warm restart
+restored = {}  # state of the snapshot restored at start-up
 
-def update_temp_services():
-    logging.debug('Updating temperature services...')
-    newTemps = ble_temps.get_values() # get BLE temperatures
-    newTemps.update(w1_temps.read_temperatures())   # add w1 temperatures
-    newTemps['rpi'] = cpu_temp.read_temperature()   # add CPU temperature
-    
+def update_temp_services(source, newTemps):
+    logging.debug(f'Updating temperature services of {source}...')
     for id in list(newTemps):
         data = newTemps[id]
         if data is None:
             continue
 
-        create_temp_service_if_not_exists(data)
+        create_temp_service_if_not_exists(source, data)
 
         # get SensorData and update service
         service = tempServices[id]
         service.update(data.temperature, data.humidity, data.battery)
+        temp_logger.log(data)  # queued, written to disk by the logger thread
 
         # check if temperature is above the high temperature alarm
         alarm.check_value(data.temperature, service.settings['HighTempAlarm'], id)
 
-    # disconnect services that are no longer available by checking if the id is in the newTemps dictionary
+    # disconnect services of this source that are no longer available by checking if the id is in the newTemps dictionary
     for id in list(tempServices):
-        if id not in newTemps:
+        if serviceSources[id] == source and id not in newTemps:
             tempServices[id].disconnect()
     
     return True
 
-def create_temp_service_if_not_exists(sensorData):
+def create_temp_service_if_not_exists(source, sensorData):
     id = sensorData.id
     if id not in tempServices:
-        instance = 1000 + len(tempServices)
-        tempServices[id] = TemperatureService(sensorData.connection, sensorData.id, instance)
+        instance = config['instances']['temperature'] + len(tempServices)
+        tempServices[id] = TemperatureService(sensorData.connection, sensorData.id, instance, name_index=tempServicesByName,
+                                              **config['sources'][source].get('service', {}))
+        serviceSources[id] = source
 
-def update_current_services():
-    logging.debug('Updating current services...')
-    latestSmoothedCurrents = dc_currents.get_latest_smoothed_values()  # Get the latest smoothed values from the dc_currents instance
+def update_current_services(source, latestSmoothedCurrents):
+    logging.debug(f'Updating current services of {source}...')
     for id in latestSmoothedCurrents:
-        create_current_service_if_not_exist(id)
+        create_current_service_if_not_exist(source, id)
         temp = find_temp_for_current(id)
-        current = latestSmoothedCurrents[id].get_value()  # Get the latest smoothed current value
+        current = latestSmoothedCurrents[id].value  # Get the latest smoothed current value
         if current is None or abs(current) < 1:    # ignore small currents
             current = 0
         currentServices[id].update(current, temp)
 
-        # Anomaly detection: trigger alarm if difference > 50% of baseline
+        # Anomaly detection: trigger alarm if difference > DiffAlarm % of baseline
         if currentServices[id].settings['DiffAlarm'] == 0:
             continue    # skip diff check if alarm is disabled
-        # For baseline and other SmoothedCurrent methods, use dc_currents.smoothed_values
-        baseline = latestSmoothedCurrents[id].get_baseline_current() if latestSmoothedCurrents[id].get_baseline_current() is not None else 0
-
-        if baseline is None or baseline < 2:  # if baseline is None or too low, skip diff check
-            if abs(current) > 3 :  # unless current is actually high, then trigger alarm
-                alarm.check_value(100, currentServices[id].settings['DiffAlarm'], id)
+        baseline = latestSmoothedCurrents[id].baseline_current
+        diffPercent = diff_alarm_value(current, baseline)
+        if diffPercent is None:  # baseline is None or too low and the current is not high, skip diff check
             logging.debug(f"Skipping diff check for id {id} because baseline is None or too low: {baseline}")
             continue
-
-        diffPercent = abs((current - baseline) / baseline) * 100
         alarm.check_value(diffPercent, currentServices[id].settings['DiffAlarm'], id)
 
-    # disconnect services that are no longer available
+    # disconnect services of this source that are no longer available
     for id in list(currentServices):
-        if id not in latestSmoothedCurrents:
+        if serviceSources[id] == source and id not in latestSmoothedCurrents:
             currentServices[id].disconnect()
     
     return True
 
 def find_temp_for_current(id):
-    # get name of service that has the same CustomName as the CustomName of the current service
-    customName = currentServices[id].settings['CustomName']
-    for tempService in tempServices.values():
-        if tempService.settings['CustomName'] == customName:
-            return tempService.dbusservice['/Temperature']
-    return None
-
-def create_current_service_if_not_exist(id):
+    # get the temperature service that has the same CustomName as the current service
+    tempService = tempServicesByName.get(currentServices[id].settings['CustomName'])
+    return tempService.dbusservice['/Temperature'] if tempService is not None else None
+
+def create_current_service_if_not_exist(source, id):
     if id in currentServices:
         return
-    instance = 2000 + len(currentServices)
-    currentServices[id] = DCSourceService('I2C', id, instance)
+    instance = config['instances']['current'] + len(currentServices)
+    currentServices[id] = DCSourceService(sources[source].connection, id, instance, **config['sources'][source].get('service', {}))
+    serviceSources[id] = source
+    if id in restored.get('currents', {}):
+        currentServices[id].restore_state(restored['currents'][id])
+
+UPDATES = {
+    'temperature': update_temp_services,
+    'current': update_current_services,
+}
+
+def add_source_job(name, plugin):
+    settings = config['sources'][name]
+    update = UPDATES[plugin.kind]
+    if plugin.blocking:
+        callback, blocking = lambda values: update(name, values), plugin.read
+    else:
+        callback, blocking = lambda: update(name, plugin.read()), None
+    scheduler.add(name, settings['interval'], callback, settings.get('priority', 0), settings.get('deadline'), blocking)
+
+def get_state():
+    # on the main loop, so the services and alarms do not change while they are read
+    return {
+        'sources': {name: plugin.get_state() for name, plugin in sources.items()},
+        'currents': {id: service.get_state() for id, service in currentServices.items()},
+        'alarm': alarm.get_state(),
+    }
+
+def save_state():
+    scheduler.submit(state_snapshot.save, get_state())  # the fsync is done in the worker pool, not on the main loop
+    return True
+
+def restore_state():
+    global restored
+    restored = state_snapshot.load() or {}
+    try:
+        if 'alarm' in restored:
+            alarm.restore_state(restored['alarm'])
+        for name, plugin in sources.items():
+            if restored.get('sources', {}).get(name) is not None:
+                plugin.restore_state(restored['sources'][name])
+    except Exception:
+        logging.exception('Failed to restore the state snapshot, continuing with what was restored')
 
 def main():
     # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
     DBusGMainLoop(set_as_default=True)
     mainloop = GLib.MainLoop()
 
-    # Start the BLE scanner
-    ble_temps.start_scanner()
-    logging.info('BLE scanner started, moving on')
-
-    # make initial call
-    update_temp_services()
-    # and then every 5 seconds
-    GLib.timeout_add_seconds(5, lambda: update_temp_services())
-
-    dc_currents.start_background_thread()  # Start the background thread for reading currents
-    GLib.timeout_add_seconds(1, lambda: update_current_services())
+    # Restore the state of a recent snapshot, so the values and alarms are valid right away after a restart
+    restore_state()
+
+    # Start the sources (BLE scanner, current acquisition threads) and poll each at its interval, starting now
+    for name, plugin in sources.items():
+        plugin.start()
+        add_source_job(name, plugin)
+        logging.info(f'Source {name} started, polled every {config["sources"][name]["interval"]} s')
+    # not at start-up: a service that keeps crashing right away must not keep refreshing the restored snapshot
+    scheduler.add('state_snapshot', state_snapshot.interval, save_state, priority=2, delay=state_snapshot.interval)
+    scheduler.start()
+
+    # daemontools stops the service with SIGTERM (svc -d): leave the main loop, so the logs are flushed and the state is saved
+    def quit(signum):
+        logging.info(f'Received signal {signal.Signals(signum).name}, shutting down')
+        mainloop.quit()
+        return False    # one-shot
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        GLib.unix_signal_add(GLib.PRIORITY_HIGH, signum, quit, signum)
 
     logging.info('Connected to dbus, and switching over to GLib.MainLoop() (= event based)')
     mainloop.run()
-    dc_currents.shutdown()  # Ensure we stop the background thread properly
+    scheduler.shutdown()   # waits for a periodic snapshot still being written, so it cannot overwrite the final one
+    logging.info(f'Scheduler metrics: {scheduler.get_metrics()}')
+    state_snapshot.save(get_state())  # before the sources are stopped
+    for plugin in sources.values():
+        plugin.stop()   # Ensure we stop the background threads properly
+    temp_logger.close()
     logging.info('Exiting...')
 
 if __name__ == "__main__":
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Time range queries over the dc_currents CSV day files written by CSVLogger, including compressed days.
+
+The sidecar time index written next to every day file (see log_archive.index_path) is used to seek directly to the
+first row of the range, so only the rows in the range are read and parsed:
+    python query_logs.py "2025-06-03 14:22" "2025-06-03 14:42" --columns current,b1_current,b2_current
+"""
+import argparse
+import csv
+import glob
+import heapq
+import io
+import itertools
+import os
+import sys
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from deadband import header_settings
+from log_archive import base_name, index_path, reader_at, read_index
+
+DEFAULT_LOG_PATH = '/data/VenusOS-SensorMonitor/logs/dc_currents'  # same as DcCurrents.DEFAULT_LOG_PATH
+FILE_PREFIX = 'dc_currents_'
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # sorts as text, so timestamps are compared without parsing them
+
+def day_files(directory, start, end):
+    """
+    Returns the CSV day files (compressed or not) for the days from start to end, in order.
+    """
+    paths = []
+    day = start.date()
+    while day <= end.date():
+        pattern = os.path.join(directory, FILE_PREFIX + day.strftime("%Y%m%d"))
+        names = glob.glob(pattern + '.csv*') + glob.glob(pattern + '_*.csv*')
+        paths += sorted(p for p in names if base_name(p).endswith('.csv'))
+        day += timedelta(days=1)
+    return paths
+
+def read_header(path):
+    with open(path, 'rb') as raw:
+        return next(csv.reader(io.TextIOWrapper(reader_at(raw, path, 0), newline='')), None)
+
+def query_file(path, start, end, columns=None):
+    """
+    Yields the rows of one day file with start <= timestamp <= end.
+
+    Args:
+        path (str): (Compressed) CSV day file.
+        start (str): First timestamp, formatted as TIMESTAMP_FORMAT.
+        end (str): Last timestamp, formatted as TIMESTAMP_FORMAT.
+        columns (list): Column names to return after the timestamp, None for all columns. Missing columns are None.
+
+    Yields:
+        tuple: (timestamp, value, ...) with the values as float.
+    """
+    header = read_header(path)
+    if header is None:
+        return
+    projection = [header.index(c) if c in header else None for c in columns] if columns is not None else range(1, len(header))
+
+    entries = read_index(index_path(path))
+    if path.endswith('.csv'):
+        # after a power cut without fsync the index can point past the rows that made it to disk
+        size = os.path.getsize(path)
+        entries = [entry for entry in entries if entry[1] < size]
+    if not entries:
+        yield from _scan(path, None, start, end, projection)
+        return
+    # Each ascending run of the index covers a sorted sequence of rows; there is more than one run only when rows were
+    # written after newer rows. Each run is read from its last entry before start and the runs are merged
+    runs = [[entries[0]]]
+    for entry in entries[1:]:
+        if entry[0] < runs[-1][-1][0]:
+            runs.append([])
+        runs[-1].append(entry)
+    scans = []
+    for run in runs:
+        if run[0][0] > end:
+            continue
+        position = bisect_left([timestamp for timestamp, _, _ in run], start) - 1
+        scans.append(_scan(path, run[max(position, 0)], start, end, projection))
+    yield from heapq.merge(*scans, key=lambda row: row[0])
+
+def _scan(path, entry, start, end, projection):
+    # the rows from an index entry (None for the first row) with start <= timestamp <= end, up to where the rows go back in time
+    with open(path, 'rb') as raw:
+        if entry is not None:
+            _, offset, skip = entry
+            rows = csv.reader(io.TextIOWrapper(reader_at(raw, path, offset, skip), newline=''))
+        else:
+            rows = csv.reader(io.TextIOWrapper(reader_at(raw, path, 0), newline=''))
+            next(rows, None)
+        previous = ''
+        for row in rows:
+            timestamp = row[0]
+            if timestamp > end or timestamp < previous:
+                break
+            previous = timestamp
+            if timestamp < start:
+                continue
+            yield (timestamp,) + tuple(float(row[k]) if k is not None and k < len(row) else None for k in projection)
+
+def query(start, end, columns=None, directory=DEFAULT_LOG_PATH):
+    """
+    Yields the rows of all day files with start <= timestamp <= end, as (timestamp, value, ...) tuples.
+
+    Args:
+        start (datetime): Start of the range.
+        end (datetime): End of the range.
+        columns (list): Column names to return after the timestamp, None for all columns.
+        directory (str): Directory of the day files.
+    """
+    start_text = start.strftime(TIMESTAMP_FORMAT)
+    end_text = end.strftime(TIMESTAMP_FORMAT)
+    # the _N continuation files of a day (late rows, changed columns) hold rows of the same day, so they are merged
+    for _, paths in itertools.groupby(day_files(directory, start, end), key=_file_day):
+        yield from heapq.merge(*(query_file(path, start_text, end_text, columns) for path in paths), key=lambda row: row[0])
+
+def _file_day(path):
+    return base_name(path)[len(FILE_PREFIX):len(FILE_PREFIX) + 8]
+
+def parse_time(text):
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Invalid time {text}, expected YYYY-MM-DD[ HH:MM[:SS[.ffffff]]]")
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the dc_currents log rows of a time range as CSV")
+    parser.add_argument('start', type=parse_time, help="start of the range, YYYY-MM-DD[ HH:MM[:SS]]")
+    parser.add_argument('end', type=parse_time, nargs='?', help="end of the range. Default is 20 minutes after the start")
+    parser.add_argument('--columns', help="comma separated columns to print, default all")
+    parser.add_argument('--dir', default=DEFAULT_LOG_PATH, help="directory with the dc_currents_YYYYMMDD.csv files")
+    args = parser.parse_args()
+
+    end = args.end or args.start + timedelta(minutes=20)
+    if args.columns:
+        columns = args.columns.split(',')
+    else:
+        # every file is projected onto the same columns, so rows of files with other columns are not printed under the wrong names
+        headers = {tuple(header[1:]) for header in map(read_header, day_files(args.dir, args.start, end)) if header is not None}
+        if len(headers) > 1:
+            parser.error("The columns of the log files in the range differ, select the columns to print with --columns")
+        columns = list(headers.pop()) if headers else []
+    for path in day_files(args.dir, args.start, end):
+        header = read_header(path)
+        settings = header_settings(header[0]) if header else None
+        if settings:
+            fill = 'hold until the next row' if settings['mode'] == 'deadband' else 'are on the line between the rows'
+            print(f"{path}: only the change points were logged ({settings['mode']}, deadband {settings['deadband']}), "
+                  f"the values in between {fill}", file=sys.stderr)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['timestamp'] + columns)
+    for row in query(args.start, end, columns, args.dir):
+        writer.writerow(row)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
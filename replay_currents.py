@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+Faster than real time replay of the DC current monitoring over the logged samples, to tune the DiffAlarm threshold and
+the smoothing window.
+
+The unsmoothed channel currents and the battery shunt current of the dc_currents day files (CSV written by CSVLogger, or
+binary written by BinaryLogger, compressed or not) are fed through the same code as on the device: SmoothedCurrent,
+the DiffAlarm check of monitor.update_current_services (alarm.diff_alarm_value) every tick and AlarmBuzzer.check_value,
+all driven by a simulated clock that follows the sample timestamps. Several settings are replayed in one pass over the logs:
+    python replay_currents.py /data/VenusOS-SensorMonitor/logs/dc_currents --window 10,30 --threshold 50,75 --events
+
+A gap in the log (battery current below 1 A, I2C errors or the service not running) is replayed as missing samples,
+up to one window. After that the state no longer changes, so it is checked only once until the next sample.
+"""
+import argparse
+import csv
+import glob
+import itertools
+import logging
+import os
+import re
+import time
+from datetime import datetime
+import BinaryLogger
+from SmoothedCurrent import SmoothedCurrent
+from alarm import AlarmBuzzer, diff_alarm_value
+from deadband import log_settings
+from log_archive import open_log, base_name
+
+# Same defaults as DcCurrents and the DCSourceService settings, which are not imported so the replay can run off the device
+DEFAULT_LOG_PATH = '/data/VenusOS-SensorMonitor/logs/dc_currents'
+DEFAULT_SMOOTHED_WINDOW = 10
+DEFAULT_SMOOTHED_FILTER = 'sma'
+DEFAULT_OUTPUT_RATE = 10  # samples per second
+DEFAULT_DIFF_ALARM = 50   # percent
+DEFAULT_TICK = 1          # seconds between the checks of monitor.update_current_services
+ERROR_VALUE = -999
+
+logger = logging.getLogger(__name__)
+
+class _SilentBuzzer:
+    """
+    Stands in for the gpiozero Buzzer of the AlarmBuzzer.
+    """
+    is_active = False
+
+    def beep(self, *args, **kwargs):
+        self.is_active = True
+
+    def off(self):
+        self.is_active = False
+
+class AlarmEvent:
+    def __init__(self, timestamp, channel, kind, value):
+        self.timestamp = timestamp  # simulated time.time()
+        self.channel = channel
+        self.kind = kind            # 'alarm' (buzzer started), 'repeat' (started again after the silence time) or 'normal'
+        self.value = value          # difference in percent of the baseline
+
+    def __str__(self):
+        return f"{datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')} channel {self.channel} {self.kind} ({self.value:.0f}%)"
+
+class Replay:
+    """
+    The filter and alarm state of the monitoring with one set of settings.
+    """
+
+    def __init__(self, window_size, filter, threshold, tick=DEFAULT_TICK):
+        """
+        Args:
+            window_size (int): Window size of SmoothedCurrent.
+            filter (str): Filter of SmoothedCurrent: 'sma', 'ema' or 'median'.
+            threshold (float): DiffAlarm threshold in percent.
+            tick (float): Seconds between the alarm checks.
+        """
+        self.window_size = window_size
+        self.filter = filter
+        self.threshold = threshold
+        self.tick = tick
+        self.now = None         # simulated clock
+        self.next_tick = None
+        self.smoothed_values = {}
+        self.alarm = None
+        self.events = []
+
+    def __str__(self):
+        return f"window={self.window_size} filter={self.filter} threshold={self.threshold:g}"
+
+    def _clock(self):
+        return self.now
+
+    def update(self, timestamp, baseline, voltage, currents):
+        """
+        Feeds one sample (or a missing sample when currents is empty) and runs the alarm checks that are due before it.
+
+        Args:
+            timestamp (float): time.time() of the sample.
+            baseline (float): Battery current divided by the number of channels.
+            voltage (float): Battery voltage.
+            currents (dict): Channel id -> unsmoothed current of the channels that were read.
+        """
+        if self.alarm is None:
+            self.now = timestamp
+            self.next_tick = timestamp
+            self.alarm = AlarmBuzzer(buzzer=_SilentBuzzer(), clock=self._clock)
+        if self.next_tick <= timestamp:
+            self.now = self.next_tick
+            self.check()
+            # the state has not changed since the last sample, so one check covers the ticks up to this sample
+            self.next_tick += ((timestamp - self.next_tick) // self.tick + 1) * self.tick
+        self.now = timestamp
+        for id, current in currents.items():
+            if id not in self.smoothed_values:
+                self.smoothed_values[id] = SmoothedCurrent(window_size=self.window_size, filter=self.filter)
+            self.smoothed_values[id].update(current, baseline, voltage)
+        for id in self.smoothed_values.keys() - currents.keys():
+            self.smoothed_values[id].update(None, baseline, voltage)
+
+    def check(self):
+        # same as monitor.update_current_services, on the simulated clock
+        for id, smoothed in self.smoothed_values.items():
+            diff = diff_alarm_value(smoothed.get_value(), smoothed.get_baseline_current())
+            if diff is None:
+                continue
+            before = self.alarm.active_alarms.get(id)
+            self.alarm.check_value(diff, self.threshold, id)
+            after = self.alarm.active_alarms.get(id)
+            if after is not None and after != before:
+                self.events.append(AlarmEvent(self.now, id, 'alarm' if before is None else 'repeat', diff))
+            elif after is None and before is not None:
+                self.events.append(AlarmEvent(self.now, id, 'normal', diff))
+
+def log_files(directory, since=None, until=None):
+    """
+    Returns the CSV and binary day files in the directory, optionally limited to the days since/until (YYYYMMDD), in order.
+    """
+    paths = glob.glob(os.path.join(directory, 'dc_currents_*.csv*')) + glob.glob(os.path.join(directory, 'dc_currents_*.bin*'))
+    paths = [p for p in paths if base_name(p).endswith(('.csv', '.bin'))]
+    days = {p: os.path.basename(p)[len('dc_currents_'):len('dc_currents_') + 8] for p in paths}
+    return sorted((p for p in paths if (not since or days[p] >= since) and (not until or days[p] <= until)),
+                  key=lambda p: (days[p], base_name(p)))
+
+def read_samples(path):
+    """
+    Yields the samples of one (compressed) CSV or binary day file as (timestamp, baseline, voltage, {channel: current}),
+    leaving out the channels that were not read. The baseline is the battery current divided by the number of channels.
+    """
+    if base_name(path).endswith('.bin'):
+        columns = BinaryLogger.read_header(path)['columns']
+        records = ((timestamp.timestamp(), values) for timestamp, values in BinaryLogger.iter_records(path))
+    else:
+        f = open_log(path, 'rt', newline='')
+        reader = csv.reader(f)
+        columns = next(reader, None) or []
+        records = ((_parse_timestamp(row[0]), row[1:]) for row in reader)
+    if 'current' not in columns:
+        logger.warning(f"Skipping {path}: no battery current column")
+        columns, records = [], []
+    channels = [(m.group(1), k - 1) for k, m in enumerate(re.fullmatch(r'b(\d+)_current', c) for c in columns) if m]
+    current, voltage = (columns.index('current') - 1, columns.index('voltage') - 1) if columns else (None, None)
+    try:
+        for timestamp, values in records:
+            currents = {}
+            for id, k in channels:
+                value = float(values[k])
+                if value != ERROR_VALUE:
+                    currents[id] = value
+            yield timestamp, float(values[current]) / max(len(channels), 1), float(values[voltage]), currents
+    finally:
+        if not base_name(path).endswith('.bin'):
+            f.close()
+
+_day_starts = {}
+
+def _parse_timestamp(text):
+    # Much faster than strptime: the start of the day is looked up once per day and the time of day is sliced
+    day_start = _day_starts.get(text[:10])
+    if day_start is None:
+        day_start = _day_starts[text[:10]] = datetime.strptime(text[:10], "%Y-%m-%d").timestamp()
+    return day_start + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + float(text[17:])
+
+def replay(paths, replays, output_rate=DEFAULT_OUTPUT_RATE):
+    """
+    Replays the samples of the day files through all replays.
+
+    Returns:
+        int: Number of replayed samples.
+
+    Raises:
+        ValueError: A file was logged with change-only compression (log_deadband), whose left out samples would be replayed as missing.
+    """
+    compressed = [path for path in paths if log_settings(path)]
+    if compressed:
+        raise ValueError(f"{len(compressed)} files were logged with log_deadband (change points only, e.g. {compressed[0]}): "
+                         f"the replay needs every sample. Select other days, or log with log_deadband off")
+    period = 1.0 / output_rate
+    max_missing = max(r.window_size for r in replays)
+    count = 0
+    last = None
+    for path in paths:
+        logger.info(f"Replaying {path}")
+        for timestamp, baseline, voltage, currents in read_samples(path):
+            if last is not None:
+                # samples that were not logged, as missing samples (the baseline is not used for missing samples)
+                missing = min(int(round((timestamp - last) / period)) - 1, max_missing)
+                for k in range(1, missing + 1):
+                    for r in replays:
+                        r.update(last + k * period, 0, voltage, {})
+            for r in replays:
+                r.update(timestamp, baseline, voltage, currents)
+            last = timestamp
+            count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the DC current logs through the smoothing and DiffAlarm logic")
+    parser.add_argument('log_dir', nargs='?', default=DEFAULT_LOG_PATH, help="directory with dc_currents_YYYYMMDD*.csv/.bin(.gz/.xz) files")
+    parser.add_argument('--since', help="first day to replay, YYYYMMDD")
+    parser.add_argument('--until', help="last day to replay, YYYYMMDD")
+    parser.add_argument('--window', default=str(DEFAULT_SMOOTHED_WINDOW), help="comma separated SmoothedCurrent window sizes")
+    parser.add_argument('--filter', default=DEFAULT_SMOOTHED_FILTER, help="comma separated SmoothedCurrent filters: sma, ema, median")
+    parser.add_argument('--threshold', default=str(DEFAULT_DIFF_ALARM), help="comma separated DiffAlarm thresholds in percent")
+    parser.add_argument('--output-rate', type=float, default=DEFAULT_OUTPUT_RATE, help="logged samples per second")
+    parser.add_argument('--tick', type=float, default=DEFAULT_TICK, help="seconds between the alarm checks")
+    parser.add_argument('--events', action='store_true', help="print every alarm event, not only the summary")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(name)-8s %(levelname)s: %(message)s")
+    logging.getLogger('alarm').setLevel(logging.WARNING)  # the alarms are reported below
+
+    replays = [Replay(int(window), filter, float(threshold), args.tick)
+               for window, filter, threshold in itertools.product(args.window.split(','), args.filter.split(','), args.threshold.split(','))]
+    paths = log_files(args.log_dir, args.since, args.until)
+    start = time.perf_counter()
+    try:
+        count = replay(paths, replays, args.output_rate)
+    except ValueError as e:
+        logger.error(e)
+        return 1
+    elapsed = time.perf_counter() - start
+    if not count:
+        logger.error(f"No samples found in {len(paths)} files in {args.log_dir}")
+        return 1
+    logger.info(f"Replayed {count} samples from {len(paths)} files in {elapsed:.1f} s ({count / elapsed:.0f} samples/s)")
+
+    for r in replays:
+        alarms = [e for e in r.events if e.kind != 'normal']
+        per_channel = {id: sum(1 for e in alarms if e.channel == id) for id in sorted(r.smoothed_values, key=int)}
+        print(f"{r}: {len(alarms)} alarms " + ", ".join(f"channel {id}: {n}" for id, n in per_channel.items()))
+        if args.events:
+            for event in r.events:
+                print(f"  {event}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,165 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from gi.repository import GLib # type: ignore
+
+class Job:
+    def __init__(self, name, interval, callback, priority, deadline, blocking, delay=0.0):
+        self.name = name
+        self.interval = interval
+        self.callback = callback
+        self.priority = priority
+        self.deadline = deadline
+        self.blocking = blocking
+        self.next_run = time.monotonic() + delay
+        self.due = None         # due time of the running blocking part, None when not running
+        # Metrics
+        self.runs = 0
+        self.skipped = 0        # ticks left out because the job was still running or too late
+        self.overruns = 0       # runs that finished later than the deadline after they were due
+        self.max_lateness = 0.0 # seconds between due and start
+        self.max_runtime = 0.0  # seconds between due and finish
+
+    def get_metrics(self) -> dict:
+        return {
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'overruns': self.overruns,
+            'max_lateness': self.max_lateness,
+            'max_runtime': self.max_runtime,
+        }
+
+class Scheduler:
+    """
+    Runs the periodic jobs of the monitor (the polling of the sensor sources and the state snapshots) on the GLib main loop
+    with one timer, which fires when the next job is due, instead of a GLib timer per job. Each job has an interval, a priority (lower runs first when several jobs are due at the same
+    time) and a deadline: the seconds after it was due within which it must have finished, else it counts as an overrun.
+
+    Blocking I/O (e.g. 1Wire sysfs reads, which take most of a second per sensor) does not belong on the main loop:
+    a job can have a blocking part that runs in a bounded worker pool, its result is then passed to the callback on the
+    main loop. A tick is skipped, not queued, while the blocking part of the previous tick is still running.
+    The lateness, run time and overruns of every job are measured in one place, see get_metrics().
+
+    The pool adds up to max_workers threads, started when first needed. The threads of the components are not replaced:
+    the ADC acquisition threads need sub-period timing, and the log writers and the log housekeeping do blocking file I/O
+    that also runs without a main loop, e.g. in the offline tools.
+    """
+    DEFAULT_MAX_WORKERS = 2
+
+    def __init__(self, max_workers: int = None):
+        """
+        Args:
+            max_workers (int): Threads of the worker pool for blocking parts. Default is 2.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.jobs = []
+        self.pool = ThreadPoolExecutor(max_workers=max_workers or self.DEFAULT_MAX_WORKERS, thread_name_prefix="Scheduler worker")
+        self.timer = None
+        self.overruns = 0
+
+    def add(self, name: str, interval: float, callback, priority: int = 0, deadline: float = None, blocking=None, delay: float = 0.0):
+        """
+        Adds a job, first due after delay.
+
+        Args:
+            name (str): Name in the metrics and log.
+            interval (float): Seconds between runs.
+            callback (callable): Called on the main loop, with the result of blocking if given.
+            priority (int): Lower runs first when several jobs are due. Default is 0.
+            deadline (float): Seconds after the due time within which the job must finish. Default is the interval.
+            blocking (callable): Called in the worker pool before the callback. Default is None.
+            delay (float): Seconds until the first run. Default is 0 (now).
+        """
+        job = Job(name, interval, callback, priority, deadline if deadline is not None else interval, blocking, delay)
+        self.jobs.append(job)
+        if self.timer is not None:
+            self._reschedule()
+        return job
+
+    def start(self):
+        self._reschedule()
+
+    def _reschedule(self):
+        if self.timer is not None:
+            GLib.source_remove(self.timer)
+        delay = self.run_pending()
+        self.timer = GLib.timeout_add(max(1, int(delay * 1000)), self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        self._reschedule()
+        return False    # one-shot, _reschedule() added the next timer
+
+    def run_pending(self):
+        """
+        Runs the jobs that are due, by priority.
+
+        Returns:
+            float: Seconds until the next job is due.
+        """
+        now = time.monotonic()
+        for job in sorted((j for j in self.jobs if j.next_run <= now), key=lambda j: (j.priority, j.next_run)):
+            due = job.next_run
+            # the next run is aligned to the interval; ticks that were missed entirely are skipped, not caught up
+            missed = int((now - due) // job.interval)
+            job.skipped += missed
+            job.next_run = due + (missed + 1) * job.interval
+            due += missed * job.interval
+            if job.due is not None:
+                job.skipped += 1    # the blocking part of the previous tick is still running
+                continue
+            job.max_lateness = max(job.max_lateness, time.monotonic() - due)
+            if job.blocking is None:
+                self._run(job, due, ())
+            else:
+                job.due = due
+                future = self.pool.submit(job.blocking)
+                future.add_done_callback(lambda f, job=job: GLib.idle_add(self._complete, job, f))
+        if not self.jobs:
+            return 1.0
+        return max(0.0, min(j.next_run for j in self.jobs) - time.monotonic())
+
+    def _complete(self, job, future):
+        # on the main loop, after the blocking part finished
+        due, job.due = job.due, None
+        try:
+            result = future.result()
+        except Exception:
+            self.logger.exception(f"Blocking part of {job.name} failed")
+            return False
+        self._run(job, due, (result,))
+        return False    # one-shot idle callback
+
+    def _run(self, job, due, args):
+        try:
+            job.callback(*args)
+        except Exception:
+            self.logger.exception(f"Job {job.name} failed")
+        runtime = time.monotonic() - due
+        job.runs += 1
+        job.max_runtime = max(job.max_runtime, runtime)
+        if runtime > job.deadline:
+            job.overruns += 1
+            self.overruns += 1
+            # only warn at the first overrun and then every time the count passes a power of two, to not flood the log
+            if job.overruns & (job.overruns - 1) == 0:
+                self.logger.warning(f"Job {job.name} finished {runtime:.3f} s after it was due, deadline {job.deadline} s ({job.overruns} overruns)")
+
+    def submit(self, fn, *args):
+        """
+        Runs fn(*args) in the worker pool without waiting for it, e.g. to write a file from a job.
+        """
+        return self.pool.submit(fn, *args)
+
+    def get_metrics(self) -> dict:
+        return {job.name: job.get_metrics() for job in self.jobs}
+
+    def shutdown(self):
+        """
+        Stops the timer and waits for the running work in the pool, queued work is cancelled. So a file written from the
+        pool (e.g. a periodic state snapshot) is not written after, and over, what the caller writes next.
+        """
+        if self.timer is not None:
+            GLib.source_remove(self.timer)
+            self.timer = None
+        self.pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,228 @@
+"""
+Sensor source plugins of the monitor and the JSON configuration that declares which sources are enabled.
+
+Each source is a SourcePlugin in SOURCES, created by name from the configuration file. A plugin imports the module of
+its sensors only when it is created, so sources that are disabled (e.g. no 1Wire bus or no BLE adapter) are never
+imported or polled. Example /data/VenusOS-SensorMonitor/sources.json, every key is optional:
+    {
+        "sources": {
+            "w1": {"enabled": false},
+            "ble": {"interval": 10},
+            "dc_currents": {"interval": 1, "settings": {"channels": {"1": [1, 72, 1], "2": [1, 72, 2]}, "offsets": {"1": 0.5},
+                                                        "alert_gpio": {"1:0x48": 17}, "smoothed_window": 20},
+                            "service": {"deadbands": {"/Dc/0/Current": 1.0}, "heartbeat": 30}}
+        },
+        "instances": {"temperature": 1000, "current": 2000}
+    }
+"settings" are passed to the sensor class (e.g. DcCurrents), "service" to the dbus services of the source.
+"""
+import copy
+import inspect
+import json
+import logging
+import os
+
+DEFAULT_CONFIG_PATH = '/data/VenusOS-SensorMonitor/sources.json'
+
+class SourcePlugin:
+    """
+    Interface of a sensor source polled by the monitor.
+    """
+    kind = 'temperature'    # 'temperature': read() returns id -> TempSensorData, 'current': id -> SmoothedCurrentSnapshot
+    blocking = False        # read() does blocking I/O and is run in the scheduler's worker pool
+    connection = None       # connection name of the dbus services, None to use the connection of the readings
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def start(self):
+        pass
+
+    def read(self):
+        return {}
+
+    def stop(self):
+        pass
+
+    def get_state(self):
+        """
+        Returns the runtime state to restore after a warm restart (JSON serializable), None if there is none.
+        """
+        return None
+
+    def restore_state(self, state):
+        """
+        Restores the state returned by get_state(), called before start().
+        """
+        pass
+
+class CPUTempSource(SourcePlugin):
+    blocking = True
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        from cpu_temp import CPUTemp
+        self.cpu_temp = CPUTemp(**settings)
+
+    def read(self):
+        return {'rpi': self.cpu_temp.read_temperature()}
+
+class W1TempSource(SourcePlugin):
+    blocking = True  # a 1Wire conversion takes most of a second per sensor
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        from w1_temps import W1Temps
+        self.w1_temps = W1Temps(**settings)
+
+    def read(self):
+        return self.w1_temps.read_temperatures()
+
+class BLETempSource(SourcePlugin):
+    def __init__(self, settings):
+        super().__init__(settings)
+        from ble_temps import BLETemps
+        self.ble_temps = BLETemps(**settings)
+
+    def start(self):
+        self.ble_temps.start_scanner()
+
+    def read(self):
+        return dict(self.ble_temps.get_values())
+
+    def stop(self):
+        self.ble_temps.stop_scanner()
+
+    def get_state(self):
+        return self.ble_temps.get_state()
+
+    def restore_state(self, state):
+        self.ble_temps.restore_state(state)
+
+class DcCurrentsSource(SourcePlugin):
+    kind = 'current'
+    connection = 'I2C'
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        from dc_currents import DcCurrents
+        self.dc_currents = DcCurrents(**dc_currents_settings(settings))
+
+    def start(self):
+        self.dc_currents.start_background_thread()
+
+    def read(self):
+        return self.dc_currents.get_latest_smoothed_values()
+
+    def stop(self):
+        self.dc_currents.shutdown()
+
+    def get_state(self):
+        return self.dc_currents.get_state()
+
+    def restore_state(self, state):
+        self.dc_currents.restore_state(state)
+
+def dc_currents_settings(settings):
+    """
+    Converts the dc_currents settings of sources.json to the types DcCurrents expects. JSON object keys are strings and
+    JSON has no tuples, so channel and offset keys become ints, a channel [bus, address, pin(, data_rate)] or
+    {"bus": 1, "address": 72, "pin": 1} becomes an AdcChannel and an alert_gpio key "bus:address" (e.g. "1:0x48") becomes
+    (bus, address).
+
+    A setting DcCurrents does not have (e.g. a typo) or that cannot be set from JSON is logged as a warning and ignored,
+    so it does not take the current monitoring down with it.
+
+    Raises:
+        ValueError: On a setting with an invalid value.
+    """
+    from dc_currents import DcCurrents
+    from adc_bus import AdcChannel
+    logger = logging.getLogger(__name__)
+    parameters = [p for p in inspect.signature(DcCurrents.__init__).parameters if p != 'self']
+    unknown = [key for key in settings if key not in parameters]
+    if unknown:
+        logger.warning(f"Ignoring unknown dc_currents settings {unknown} in sources.json, expected some of {parameters}")
+    if 'extra_log_columns' in settings:
+        logger.warning("Ignoring extra_log_columns in sources.json, it cannot be set there since its values are functions")
+        unknown.append('extra_log_columns')
+    settings = {key: value for key, value in settings.items() if key not in unknown}
+    channels = settings.get('channels')
+    if isinstance(channels, dict):
+        def adc_channel(channel):
+            if isinstance(channel, list):
+                return AdcChannel(*channel)
+            if isinstance(channel, dict):
+                return AdcChannel(**channel)
+            if isinstance(channel, int):
+                return AdcChannel(pin=channel)
+            raise ValueError(f"Invalid dc_currents channel {channel}, expected [bus, address, pin], an object or a pin")
+        settings['channels'] = {int(id): adc_channel(channel) for id, channel in channels.items()}
+    if settings.get('offsets') is not None:
+        settings['offsets'] = {int(id): float(offset) for id, offset in settings['offsets'].items()}
+    alert_gpio = settings.get('alert_gpio')
+    if isinstance(alert_gpio, dict):
+        def bus_address(key):
+            bus, separator, address = key.partition(':')
+            if not separator:
+                raise ValueError(f"Invalid dc_currents alert_gpio key {key}, expected \"bus:address\", e.g. \"1:0x48\"")
+            return int(bus, 0), int(address, 0)
+        settings['alert_gpio'] = {bus_address(key): int(gpio) for key, gpio in alert_gpio.items()}
+    return settings
+
+SOURCES = {
+    'cpu': CPUTempSource,
+    'w1': W1TempSource,
+    'ble': BLETempSource,
+    'dc_currents': DcCurrentsSource,
+}
+
+# The sources, intervals (seconds) and priorities used when there is no configuration file, as before it existed
+DEFAULT_CONFIG = {
+    'sources': {
+        'cpu': {'enabled': True, 'interval': 5, 'priority': 1, 'settings': {}, 'service': {}},
+        'w1': {'enabled': True, 'interval': 5, 'priority': 1, 'settings': {}, 'service': {}},
+        'ble': {'enabled': True, 'interval': 5, 'priority': 1, 'settings': {}, 'service': {}},
+        'dc_currents': {'enabled': True, 'interval': 1, 'priority': 0, 'deadline': 0.5, 'settings': {}, 'service': {}},
+    },
+    'instances': {'temperature': 1000, 'current': 2000},  # first dbus device instance per kind of service
+}
+
+def load_config(path=DEFAULT_CONFIG_PATH):
+    """
+    Returns the configuration file merged into DEFAULT_CONFIG, or DEFAULT_CONFIG if there is no (valid) file.
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if not os.path.exists(path):
+        return config
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+        for name, source in settings.get('sources', {}).items():
+            if name not in SOURCES:
+                raise ValueError(f"Unknown source {name}, expected one of {list(SOURCES)}")
+            config['sources'][name].update(source)
+        config['instances'].update(settings.get('instances', {}))
+    except Exception:
+        logging.getLogger(__name__).exception(f"Invalid source configuration {path}, using the default sources")
+        return copy.deepcopy(DEFAULT_CONFIG)
+    return config
+
+def create_sources(config):
+    """
+    Creates the enabled sources of the configuration.
+
+    Returns:
+        dict: Source name -> SourcePlugin.
+    """
+    logger = logging.getLogger(__name__)
+    sources = {}
+    for name, source in config['sources'].items():
+        if not source.get('enabled', True):
+            logger.info(f"Source {name} disabled")
+            continue
+        try:
+            sources[name] = SOURCES[name](source.get('settings', {}))
+        except Exception:
+            logger.exception(f"Failed to create source {name}, skipping it")
+    return sources
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import threading
+import time
+
+class StateSnapshot:
+    """
+    Warm restart of the monitor: the runtime state that otherwise takes a while to build up again (smoothing windows,
+    /History/MaximumCurrent, the last BLE advertisements and the alarm state) is saved as one small JSON file every
+    interval seconds and when the monitor stops, and restored on start-up when it is at most max_age seconds old.
+
+    The file is written to a temporary file, fsync'ed and renamed over the previous snapshot, so a crash or power cut
+    during the write leaves the previous snapshot intact.
+    """
+    DEFAULT_PATH = '/data/VenusOS-SensorMonitor/state.json'
+    DEFAULT_INTERVAL = 30   # seconds between snapshots
+    DEFAULT_MAX_AGE = 300   # seconds, an older snapshot is not restored
+    VERSION = 1
+
+    def __init__(self, path: str = None, interval: float = None, max_age: float = None):
+        """
+        Args:
+            path (str): Path of the snapshot. Default is '/data/VenusOS-SensorMonitor/state.json'.
+            interval (float): Seconds between snapshots. Default is 30.
+            max_age (float): Maximum age in seconds of a snapshot that is restored. Default is 300.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = path if path is not None else self.DEFAULT_PATH
+        self.interval = interval if interval is not None else self.DEFAULT_INTERVAL
+        self.max_age = max_age if max_age is not None else self.DEFAULT_MAX_AGE
+        self.lock = threading.Lock()  # a periodic save from the worker pool can overlap the save at shutdown
+        self.saves = 0
+        self.errors = 0
+
+    def load(self):
+        """
+        Returns the saved state, or None if there is no snapshot or it is invalid or too old.
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != self.VERSION:
+                raise ValueError(f"Unsupported snapshot version {snapshot.get('version')}")
+            age = time.time() - snapshot['time']
+            state = snapshot['state']
+        except Exception:
+            self.logger.exception(f"Invalid state snapshot {self.path}, starting cold")
+            return None
+        if not 0 <= age <= self.max_age:
+            self.logger.info(f"State snapshot {self.path} is {age:.0f} s old, starting cold")
+            return None
+        self.logger.info(f"Restoring state snapshot {self.path} of {age:.0f} s ago")
+        return state
+
+    def save(self, state):
+        """
+        Atomically replaces the snapshot with the state, which must be JSON serializable. Blocks until it is on disk.
+
+        Returns:
+            bool: True if the snapshot was written.
+        """
+        with self.lock:
+            return self._save(state)
+
+    def _save(self, state):
+        temp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(temp_path, 'w') as f:
+                json.dump({'version': self.VERSION, 'time': time.time(), 'state': state}, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except Exception:
+            self.errors += 1
+            self.logger.exception(f"Failed to write state snapshot {self.path}")
+            return False
+        self.saves += 1
+        return True
+
+    def get_metrics(self) -> dict:
+        return {
+            'saves': self.saves,
+            'errors': self.errors,
+        }
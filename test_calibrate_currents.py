@@ -0,0 +1,31 @@
+from CSVLogger import CSVLogger
+from log_archive import index_path
+import calibrate_currents
+import os
+import tempfile
+import time
+
+# Regression check of the calibration over a log directory written by CSVLogger, which holds the index sidecars
+# (dc_currents_YYYYMMDD.csv.idx) next to the day files: only the day files are read and the gains and offsets are found.
+#   python test_calibrate_currents.py
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    gains = {1: 20.0, 2: 25.0}
+    offsets = {1: 1.0, 2: -0.5}
+    logger = CSVLogger(directory, ['current', 'b1_voltage', 'b2_voltage'], compression=None)
+    start = time.time() - 1000
+    for k in range(1000):
+        voltages = {1: 0.1 + 0.002 * (k % 97), 2: 0.3 - 0.001 * (k % 89)}
+        current = sum(gains[c] * voltages[c] + offsets[c] for c in voltages)
+        logger.log((current, voltages[1], voltages[2]), start + k)
+    logger.close()
+    assert os.path.exists(index_path(logger.filepath)), "no index sidecar written"
+
+    paths = calibrate_currents.log_files(directory)
+    assert paths == [logger.filepath], f"expected only {logger.filepath}, got {paths}"
+    settings = calibrate_currents.fit(paths, {1: 22, 2: 22}, {1: 0.0, 2: 0.0})
+    assert settings is not None and settings['samples'] == 1000, settings
+    assert settings['rms_error'] < 0.2, settings   # only the sum of the offsets is determined by the data
+    assert abs(sum(settings['offsets'].values()) - sum(offsets.values())) < 0.5, settings
+    print("OK")
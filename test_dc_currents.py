@@ -9,13 +9,26 @@ if __name__ == "__main__":
         while True:
             smoothed_values = dc_currents.get_latest_smoothed_values()
             for channel, smoothed_current in smoothed_values.items():
-                print(f"Channel {channel}: Smoothed Current: {smoothed_current.get_value()}, "
-                      f"Baseline Current: {smoothed_current.get_baseline_current()}, "
-                      f"Voltage: {smoothed_current.get_voltage()}, "
-                      f"Quality: {smoothed_current.get_quality()}")
+                print(f"Channel {channel}: Smoothed Current: {smoothed_current.value}, "
+                      f"Baseline Current: {smoothed_current.baseline_current}, "
+                      f"Voltage: {smoothed_current.voltage}, "
+                      f"Quality: {smoothed_current.quality}")
+            diagnostics = dc_currents.get_diagnostics()
+            for bus, adc_bus in dc_currents.buses.items():
+                bus_diagnostics = diagnostics[bus]
+                assert bus_diagnostics['connected'] == adc_bus.connected, f"Bus {bus}: connected does not match the bus"
+                assert set(bus_diagnostics['channel_errors']) == set(adc_bus.channels), f"Bus {bus}: channel_errors is not per channel"
+                assert all(errors >= 0 for errors in bus_diagnostics['channel_errors'].values()), f"Bus {bus}: negative error count"
+                assert bus_diagnostics['input_rate'] >= 0 and bus_diagnostics['output_rate'] >= 0, f"Bus {bus}: negative rate"
+                print(f"Bus {bus}: connected: {bus_diagnostics['connected']}, input rate: {bus_diagnostics['input_rate']:.1f}/s, "
+                      f"output rate: {bus_diagnostics['output_rate']:.1f}/s, channel errors: {bus_diagnostics['channel_errors']}")
+            assert diagnostics['max_publish_time'] >= 0, "negative max_publish_time"
+            assert {'sample_log', 'rollups'} <= diagnostics.keys(), "log metrics missing from the diagnostics"
             time.sleep(1)  # Adjust the sleep time as needed
     except KeyboardInterrupt:
         print("Stopping DcCurrents due to keyboard interrupt.")
+    except AssertionError:
+        raise   # a failed check, exits non-zero after the shutdown below
     except Exception as e:
         print(f"An error occurred in DcCurrents: {e}")
     finally:
@@ -0,0 +1,44 @@
+from CSVLogger import CSVLogger
+import query_logs
+import tempfile
+from datetime import datetime
+
+# Regression check of the time range queries over rows that are written out of order (e.g. held back by the deadband
+# compressor, or queued again after a failed write): every row in the range must be found, in order.
+#   python test_query_logs.py
+
+def query(path, day_start, first, last):
+    return [int(row[1]) for row in query_logs.query_file(path, datetime.fromtimestamp(day_start + first).strftime(query_logs.TIMESTAMP_FORMAT),
+                                                         datetime.fromtimestamp(day_start + last).strftime(query_logs.TIMESTAMP_FORMAT))]
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    day_start = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0).timestamp()
+    writes = [range(0, 500), range(1000, 1500), range(600, 700), range(1500, 1600)]
+    logger = CSVLogger(directory, ['value'], compression=None)
+    for seconds in writes:
+        for k in reversed(seconds):     # a write is sorted by the logger
+            logger.log((k,), day_start + k)
+        logger.flush()
+    logger.close()
+    logger = CSVLogger(directory, ['value'], compression=None)  # rows written after newer rows by another logger
+    for k in range(450, 460):
+        logger.log((k + 0.5,), day_start + k + 0.5)
+    logger.close()
+
+    written = sorted([k for seconds in writes for k in seconds] + [k + 0.5 for k in range(450, 460)])
+    for first, last in [(650, 660), (0, 1600), (450, 1010), (695, 1005), (455, 455), (1550, 2000), (700, 999)]:
+        expected = [int(k) for k in written if first <= k <= last]
+        found = query(logger.filepath, day_start, first, last)
+        assert found == expected, f"query {first}-{last}: expected {len(expected)} rows, found {len(found)}"
+
+    # a late row for a day that is already compressed goes to a _1 continuation file and must come out in time order
+    closed_path = logger.filepath
+    logger = CSVLogger(directory, ['value'])
+    logger.archiver._compress(closed_path)
+    logger.log((455.25,), day_start + 455.25)
+    logger.close()
+    assert logger.filepath.endswith('_1.csv'), logger.filepath
+    found = [row[1] for row in query_logs.query(datetime.fromtimestamp(day_start + 450), datetime.fromtimestamp(day_start + 460), directory=directory)]
+    assert found == sorted(found) and 455.25 in found, f"continuation file rows out of order: {found}"
+    print("OK")
@@ -0,0 +1,56 @@
+from RollupLogger import RollupLogger
+import csv
+import glob
+import os
+import tempfile
+import time
+
+# Regression check of the rollup windows that are open when the logger is closed: they must be written on close, and a
+# restart within the same window must continue it instead of writing a second row for it, while a restart after the
+# window closed must keep the row written at close.
+#   python test_rollup_logger.py
+
+RATE = 10  # samples per second
+
+def run(directory, start, end):
+    # one run of the logger: samples from start to end seconds after t0, then close
+    logger = RollupLogger(directory, ['value'], compression=None)
+    for k in range(start * RATE, end * RATE):
+        logger.add(t0 + k / RATE, [1.0])
+    logger.close()
+
+def counts(directory, tier):
+    # window start -> list of counts of the rows of that window
+    rows = {}
+    for path in sorted(glob.glob(os.path.join(directory, tier, '*.csv'))):
+        with open(path, newline='') as f:
+            for row in list(csv.reader(f))[1:]:
+                rows.setdefault(row[0], []).append(int(row[4]))
+    return rows
+
+def check(directory, expected):
+    for tier, windows in expected.items():
+        found = counts(directory, tier)
+        assert all(len(c) == 1 for c in found.values()), f"{tier}: a window was written twice: {found}"
+        assert sorted(c[0] for c in found.values()) == sorted(windows), f"{tier}: expected counts {sorted(windows)}, found {found}"
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    t0 = time.time() // 3600 * 3600 - 7200  # at a 15 min boundary, two hours ago
+
+    # close with no restart: 100 s, the open 1 min and 15 min windows are written on close
+    run(directory, 0, 100)
+    check(directory, {'1s': [RATE] * 100, '1min': [60 * RATE, 40 * RATE], '15min': [100 * RATE]})
+
+    # restart within the same 1 min and 15 min windows: they are continued, not written twice
+    run(directory, 100, 200)
+    check(directory, {'1s': [RATE] * 200, '1min': [60 * RATE] * 3 + [20 * RATE], '15min': [200 * RATE]})
+
+    # restart after the 15 min window closed: the row written at close stands, the next window gets its own row
+    run(directory, 1000, 1010)
+    check(directory, {'1s': [RATE] * 210, '1min': [60 * RATE] * 3 + [20 * RATE] + [10 * RATE], '15min': [200 * RATE, 10 * RATE]})
+
+    # restart within a 1 min window but after the 1 s window closed
+    run(directory, 1010, 1020)
+    check(directory, {'1s': [RATE] * 220, '1min': [60 * RATE] * 3 + [20 * RATE] + [20 * RATE], '15min': [200 * RATE, 20 * RATE]})
+    print("OK")